@@ -0,0 +1,90 @@
+"""
+Benchmark the wall clock time of a command line run answered from the cache
+
+Runs src/main.py in a new interpreter for a journey already in trains.db,
+and compares it with the same run after importing the orm and the api
+client first, as main.py used to
+
+python -m benchmarks.bench_cli_startup --runs 20
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from src.data_model.db.trains import store_journey
+from benchmarks.common import (
+    argument_parser,
+    synthetic_journeys,
+    temporary_database,
+    write_results,
+)
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(REPOSITORY_ROOT, "src", "main.py")
+
+
+def run(runs: int) -> list[dict]:
+    """
+    time each command line run, from a directory holding trains.db
+    """
+    journey = synthetic_journeys(count=1)[0]
+    main_args = [
+        "--departure_date_time",
+        journey.departure_date_time.isoformat(),
+        "--station_identifiers",
+        *journey.train_stations_with_wait.station_ids(),
+        "--max_wait_time",
+        "60",
+    ]
+    commands = {
+        "main": [sys.executable, MAIN_PATH, *main_args],
+        "main_with_eager_imports": [
+            sys.executable,
+            "-c",
+            "import runpy, sys; "
+            "import src.data_model.get_train_information; "
+            f"sys.argv = {[MAIN_PATH, *main_args]!r}; "
+            f"runpy.run_path({MAIN_PATH!r}, run_name='__main__')",
+        ],
+    }
+    environment = {**os.environ, "PYTHONPATH": REPOSITORY_ROOT}
+    results = []
+    with temporary_database() as database_path:
+        store_journey(journey)
+        for name, command in commands.items():
+            timings = []
+            for _ in range(runs):
+                started_at = time.perf_counter()
+                completed = subprocess.run(
+                    command,
+                    cwd=os.path.dirname(database_path),
+                    env=environment,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                timings.append(time.perf_counter() - started_at)
+                assert "Arrival time" in completed.stdout, completed.stdout
+            timings.sort()
+            results.append(
+                {
+                    "command": name,
+                    "runs": runs,
+                    "best_ms": round(timings[0] * 1000, 1),
+                    "median_ms": round(timings[len(timings) // 2] * 1000, 1),
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("command line runs answered from the cache")
+    arg_parser.add_argument("--runs", dest="runs", type=int, default=20)
+    args = arg_parser.parse_args()
+    write_results(
+        name="cli_startup",
+        results=run(runs=args.runs),
+        output=args.output,
+    )
@@ -0,0 +1,325 @@
+"""
+Benchmark the size of the journeys tables, and their lookups, before and
+after the compact schema
+
+A database of schema version 4, with text station identifiers and text
+date and times, is filled with sqlite3 and vacuumed, then migrated with
+migrations.migrate_database_file and vacuumed again. Each is measured for
+its file size, and for journey and sub-route lookups with sqlite3, as
+journey_lookup.retrieve_stored_journey makes them, including building the
+key of each lookup. Each journey is a row of journeys and a row of
+journey_stations per station, so 2 million journeys of 4 stations are 10
+million rows
+
+python -m benchmarks.bench_compact_schema --journeys 100000
+python -m benchmarks.bench_compact_schema --journeys 2000000 --stations 4
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from math import perm
+from typing import Any, Callable
+
+from sqlalchemy import create_engine
+
+from src.data_model.db.journey_lookup import (
+    RETRIEVE_JOURNEY_SQL,
+    RETRIEVE_SUB_JOURNEY_SQL,
+    join_wait_times,
+    route_hash,
+    to_epoch_minutes,
+)
+from src.data_model.db.migrations import LEGACY_METADATA, migrate_database_file
+from benchmarks.common import (
+    STATION_IDENTIFIERS,
+    argument_parser,
+    time_call,
+    write_results,
+)
+
+START = datetime(2024, 6, 2, 6, 0)
+# the format sqlalchemy stored a DateTime in, before the compact schema
+LEGACY_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+LEGACY_RETRIEVE_JOURNEY_SQL = (
+    "SELECT total_journey_time_mins, joined_wait_times, exceeded_wait_station_order"
+    " FROM journeys"
+    " WHERE joined_journey_list = ? AND departure_date_time = ?"
+)
+LEGACY_RETRIEVE_SUB_JOURNEY_SQL = (
+    "SELECT sub_route_station.journey_id, first_station.station_order,"
+    " sub_route_station.station_identifier, sub_route_station.wait_time_mins,"
+    " sub_route_station.arrival_date_time"
+    " FROM journey_stations AS first_station"
+    " JOIN journey_stations AS sub_route_station"
+    " ON sub_route_station.journey_id = first_station.journey_id"
+    " AND sub_route_station.station_order >= first_station.station_order"
+    " AND sub_route_station.station_order < first_station.station_order + ?"
+    " WHERE first_station.station_identifier = ?"
+    " AND first_station.arrival_date_time = ?"
+    " AND first_station.wait_time_mins IS NOT NULL"
+    " ORDER BY sub_route_station.journey_id, first_station.station_order,"
+    " sub_route_station.station_order"
+)
+FILL_CHUNK_SIZE = 50_000
+
+
+class SyntheticJourneys:
+    """
+    A seeded set of journeys, over journey_count // 100 distinct routes with
+    a departure a minute apart, each leg taking 10 minutes after its wait
+    """
+
+    def __init__(self, journey_count: int, stations: int, seed: int):
+        generator = random.Random(seed)
+        self.journey_count = journey_count
+        self.stations = stations
+        route_count = min(
+            max(1, journey_count // 100), perm(len(STATION_IDENTIFIERS), stations)
+        )
+        routes = {}
+        while len(routes) < route_count:
+            route = generator.sample(STATION_IDENTIFIERS, stations)
+            routes.setdefault(tuple(route), route)
+        self.routes = list(routes.values())
+
+    def journey(self, idx: int) -> tuple[list[str], list, list[datetime]]:
+        """
+        the stations, wait times and station arrivals of the journey
+        """
+        station_list = self.routes[idx % len(self.routes)]
+        wait_times = [(idx * 7 + x * 3) % 11 for x in range(self.stations - 1)] + [None]
+        arrivals = [START + timedelta(minutes=idx // len(self.routes))]
+        for wait_time in wait_times[:-1]:
+            arrivals.append(arrivals[-1] + timedelta(minutes=wait_time + 10))
+        return station_list, wait_times, arrivals
+
+
+def fill_legacy_database(database_path: str, journeys: SyntheticJourneys) -> None:
+    """
+    create the tables of schema version 4, and fill them with the journeys
+    """
+    legacy_engine = create_engine(f"sqlite:///{database_path}")
+    LEGACY_METADATA.create_all(legacy_engine)
+    legacy_engine.dispose()
+
+    date_time_strings: dict[datetime, str] = {}
+
+    def legacy_date_time(date_time: datetime) -> str:
+        if date_time not in date_time_strings:
+            date_time_strings[date_time] = date_time.strftime(LEGACY_DATETIME_FORMAT)
+        return date_time_strings[date_time]
+
+    connection = sqlite3.connect(database_path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    for chunk_start in range(0, journeys.journey_count, FILL_CHUNK_SIZE):
+        journey_rows = []
+        journey_station_rows = []
+        for idx in range(
+            chunk_start, min(chunk_start + FILL_CHUNK_SIZE, journeys.journey_count)
+        ):
+            station_list, wait_times, arrivals = journeys.journey(idx)
+            journey_rows.append(
+                (
+                    idx + 1,
+                    legacy_date_time(arrivals[0]),
+                    "_".join(station_list),
+                    int((arrivals[-1] - arrivals[0]).total_seconds() // 60),
+                    join_wait_times(wait_times),
+                    None,
+                )
+            )
+            for order, (station_id, wait_time, arrival) in enumerate(
+                zip(station_list, wait_times, arrivals)
+            ):
+                journey_station_rows.append(
+                    (
+                        str(idx + 1),
+                        order,
+                        station_id,
+                        wait_time,
+                        legacy_date_time(arrival),
+                        None
+                        if wait_time is None
+                        else legacy_date_time(arrival + timedelta(minutes=wait_time)),
+                    )
+                )
+        connection.executemany(
+            "INSERT INTO journeys VALUES (?, ?, ?, ?, ?, ?)", journey_rows
+        )
+        connection.executemany(
+            "INSERT INTO journey_stations (journey_id, station_order,"
+            " station_identifier, wait_time_mins, arrival_date_time,"
+            " departure_date_time) VALUES (?, ?, ?, ?, ?, ?)",
+            journey_station_rows,
+        )
+        connection.commit()
+    connection.execute("PRAGMA user_version = 4")
+    connection.execute("VACUUM")
+    connection.close()
+
+
+def legacy_lookup_params(station_list: list[str], departure_date_time: datetime):
+    """
+    the journey lookup of schema version 4
+    """
+    return (
+        "_".join(station_list),
+        departure_date_time.replace(tzinfo=None).strftime(LEGACY_DATETIME_FORMAT),
+    )
+
+
+def compact_lookup_params(station_list: list[str], departure_date_time: datetime):
+    """
+    the journey lookup of journey_lookup.retrieve_stored_journey
+    """
+    return (
+        route_hash(station_list),
+        to_epoch_minutes(departure_date_time),
+        "_".join(station_list),
+    )
+
+
+def legacy_sub_route_params(station_list: list[str], departure_date_time: datetime):
+    """
+    the sub-route lookup of schema version 4
+    """
+    return (
+        len(station_list),
+        station_list[0],
+        departure_date_time.replace(tzinfo=None).strftime(LEGACY_DATETIME_FORMAT),
+    )
+
+
+def compact_sub_route_params(station_list: list[str], departure_date_time: datetime):
+    """
+    the sub-route lookup of journey_lookup.retrieve_stored_journey
+    """
+    return (len(station_list), station_list[0], to_epoch_minutes(departure_date_time))
+
+
+def lookups_per_sec(
+    database_path: str,
+    sql: str,
+    build_params: Callable[[list[str], datetime], tuple],
+    keys: list[tuple[list[str], datetime]],
+) -> float:
+    """
+    the lookups per second of the keys, each answered by a stored journey
+    """
+    connection = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+    try:
+
+        def lookup_all():
+            for station_list, departure_date_time in keys:
+                rows = connection.execute(
+                    sql, build_params(station_list, departure_date_time)
+                ).fetchall()
+                assert rows
+
+        # the first pass reads the pages the lookups need into the cache
+        lookup_all()
+        secs = time_call(lookup_all, repeat=3)
+    finally:
+        connection.close()
+    return round(len(keys) / secs, 1)
+
+
+def measure_schema(
+    schema: str,
+    database_path: str,
+    journey_sql: str,
+    journey_params: Callable[[list[str], datetime], tuple],
+    journey_keys: list[tuple[list[str], datetime]],
+    sub_route_sql: str,
+    sub_route_params: Callable[[list[str], datetime], tuple],
+    sub_route_keys: list[tuple[list[str], datetime]],
+) -> dict[str, Any]:
+    """
+    the file size of the database, and the journey and sub-route lookups per second
+    """
+    return {
+        "schema": schema,
+        "database_bytes": os.path.getsize(database_path),
+        "lookups": len(journey_keys),
+        "lookups_per_sec": lookups_per_sec(
+            database_path, journey_sql, journey_params, journey_keys
+        ),
+        "sub_route_lookups_per_sec": lookups_per_sec(
+            database_path, sub_route_sql, sub_route_params, sub_route_keys
+        ),
+    }
+
+
+def run(journey_count: int, stations: int, lookups: int, seed: int) -> list[dict]:
+    """
+    measure the legacy database, then migrate it and measure the compact one
+    """
+    journeys = SyntheticJourneys(journey_count=journey_count, stations=stations, seed=seed)
+    generator = random.Random(seed)
+    journey_keys = []
+    sub_route_keys = []
+    for idx in generator.sample(range(journey_count), min(lookups, journey_count)):
+        station_list, _, arrivals = journeys.journey(idx)
+        journey_keys.append((station_list, arrivals[0]))
+        sub_route_keys.append((station_list[1:3], arrivals[1]))
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "trains.db")
+        fill_legacy_database(database_path=database_path, journeys=journeys)
+        results.append(
+            measure_schema(
+                schema="legacy",
+                database_path=database_path,
+                journey_sql=LEGACY_RETRIEVE_JOURNEY_SQL,
+                journey_params=legacy_lookup_params,
+                journey_keys=journey_keys,
+                sub_route_sql=LEGACY_RETRIEVE_SUB_JOURNEY_SQL,
+                sub_route_params=legacy_sub_route_params,
+                sub_route_keys=sub_route_keys,
+            )
+        )
+        migrate_secs = time_call(
+            lambda: migrate_database_file(database_path=database_path, vacuum=True)
+        )
+        results.append(
+            measure_schema(
+                schema="compact",
+                database_path=database_path,
+                journey_sql=RETRIEVE_JOURNEY_SQL,
+                journey_params=compact_lookup_params,
+                journey_keys=journey_keys,
+                sub_route_sql=RETRIEVE_SUB_JOURNEY_SQL,
+                sub_route_params=compact_sub_route_params,
+                sub_route_keys=sub_route_keys,
+            )
+        )
+        results[-1]["migrate_secs"] = round(migrate_secs, 2)
+    for row in results:
+        row["journeys"] = journey_count
+        row["rows"] = journey_count * (1 + stations)
+        row["bytes_per_journey"] = round(row["database_bytes"] / journey_count, 1)
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("database size and lookups of the compact schema")
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=100_000)
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=4)
+    arg_parser.add_argument("--lookups", dest="lookups", type=int, default=5_000)
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_results(
+        name="compact_schema",
+        results=run(
+            journey_count=args.journeys,
+            stations=args.stations,
+            lookups=args.lookups,
+            seed=args.seed,
+        ),
+        output=args.output,
+    )
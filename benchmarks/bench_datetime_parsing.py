@@ -0,0 +1,112 @@
+"""
+Microbenchmark parsing the datetimes of recorded api responses
+
+Compares cutting the offset off and parsing with dateutil, as parse_routes
+used to, with date_times.parse_datetime, per datetime and per response
+
+python -m benchmarks.bench_datetime_parsing --repeat 200
+"""
+
+import json
+import os
+from typing import Any, Callable
+
+from dateutil import parser
+
+from src.data_model.api.transport_api import parse_routes
+from src.data_model.date_times import parse_datetime
+from benchmarks.common import argument_parser, time_call, write_results
+
+RECORDED_RESPONSES = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "tests",
+    "data_model",
+    "api",
+    "example_api_responses",
+)
+
+
+def load_corpus(directory: str) -> list[dict[str, Any]]:
+    """
+    the recorded api responses in the directory, that have routes
+    """
+    responses = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, file_name), encoding="utf-8") as fh:
+            response = json.load(fh)
+        if response.get("routes"):
+            responses.append(response)
+    return responses
+
+
+def dateutil_without_offset(datetime_str: str):
+    """
+    the parsing parse_routes used to do, which drops the offset
+    """
+    return parser.parse(datetime_str.split("+")[0])
+
+
+def run(corpus: str, repeat: int) -> list[dict]:
+    """
+    parse every datetime of the corpus repeat times with each parser
+    """
+    responses = load_corpus(corpus)
+    datetime_strs = [
+        route[key]
+        for response in responses
+        for route in response["routes"]
+        for key in ("departure_datetime", "arrival_datetime")
+    ]
+    parsers: dict[str, Callable[[str], Any]] = {
+        "dateutil_without_offset": dateutil_without_offset,
+        "parse_datetime": parse_datetime,
+    }
+    results = []
+    for name, parse in parsers.items():
+        secs = time_call(
+            lambda: [parse(x) for _ in range(repeat) for x in datetime_strs],
+            repeat=3,
+        )
+        parsed = repeat * len(datetime_strs)
+        results.append(
+            {
+                "parser": name,
+                "datetimes": parsed,
+                "secs": round(secs, 4),
+                "usecs_per_datetime": round(secs * 1_000_000 / parsed, 3),
+            }
+        )
+
+    secs = time_call(
+        lambda: [parse_routes(x) for _ in range(repeat) for x in responses],
+        repeat=3,
+    )
+    results.append(
+        {
+            "parser": "parse_routes",
+            "responses": repeat * len(responses),
+            "secs": round(secs, 4),
+            "usecs_per_response": round(secs * 1_000_000 / (repeat * len(responses)), 2),
+        }
+    )
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("datetimes of recorded responses per second")
+    arg_parser.add_argument(
+        "--corpus",
+        dest="corpus",
+        help="a directory of recorded api responses, as json files",
+        default=RECORDED_RESPONSES,
+    )
+    arg_parser.add_argument("--repeat", dest="repeat", type=int, default=200)
+    args = arg_parser.parse_args()
+    write_results(
+        name="datetime_parsing",
+        results=run(corpus=args.corpus, repeat=args.repeat),
+        output=args.output,
+    )
@@ -0,0 +1,122 @@
+"""
+Benchmark the cost of the instrumentation hooks, disabled and enabled
+
+Times a traced function, a span and a counter against the bare call, and
+journeys answered from the memory cache, the shortest path through the
+instrumented stages, with no exporter and with an InMemoryCollector
+
+python -m benchmarks.bench_instrumentation --calls 200000
+"""
+
+import io
+import time
+from contextlib import redirect_stdout
+from typing import Any, Callable
+
+from src.data_model.instrumentation import (
+    InMemoryCollector,
+    increment,
+    set_exporter,
+    span,
+    traced,
+)
+from src.data_model.get_train_information import retrieve_journey
+from benchmarks.bench_pipeline import clear_memory_caches, journey_requests
+from benchmarks.common import argument_parser, temporary_database, write_results
+from benchmarks.stub_upstream import SyntheticTimetable, SyntheticTimetableClient
+from src.data_model.api.transport_api import set_client
+
+
+def bare_function() -> None:
+    pass
+
+
+@traced("bench.traced_function")
+def traced_function() -> None:
+    pass
+
+
+def in_span() -> None:
+    with span("bench.span"):
+        pass
+
+
+def counter() -> None:
+    increment("bench.counter")
+
+
+def time_calls(function: Callable[[], Any], calls: int) -> float:
+    """
+    the best of 3 timings of the calls, in nanoseconds per call
+    """
+    timings = []
+    for _ in range(3):
+        started_at = time.perf_counter()
+        for _ in range(calls):
+            function()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings) * 1_000_000_000 / calls
+
+
+def run(calls: int, journey_count: int, seed: int) -> list[dict]:
+    """
+    time each hook, and the memory cached journeys, without and with an exporter
+    """
+    requests = journey_requests(count=journey_count, stations=5, seed=seed)
+    results = []
+    with temporary_database():
+        set_client(SyntheticTimetableClient(timetable=SyntheticTimetable(seed=seed)))
+        clear_memory_caches()
+        try:
+            with redirect_stdout(io.StringIO()):
+                for journey_request in requests:
+                    retrieve_journey(journey_request)
+            for exporter in ("none", "in_memory"):
+                collector = InMemoryCollector()
+                set_exporter(None if exporter == "none" else collector)
+                try:
+                    for hook, function in [
+                        ("bare_function", bare_function),
+                        ("traced_function", traced_function),
+                        ("span", in_span),
+                        ("increment", counter),
+                    ]:
+                        results.append(
+                            {
+                                "hook": hook,
+                                "exporter": exporter,
+                                "nsecs_per_call": round(time_calls(function, calls), 1),
+                            }
+                        )
+                        collector.clear()
+                    nsecs = time_calls(
+                        lambda: [retrieve_journey(x) for x in requests], calls=20
+                    ) / len(requests)
+                    results.append(
+                        {
+                            "hook": "retrieve_journey_from_memory",
+                            "exporter": exporter,
+                            "nsecs_per_call": round(nsecs, 1),
+                            "spans_per_call": len(collector.spans)
+                            // (3 * 20 * len(requests)),
+                        }
+                    )
+                finally:
+                    set_exporter(None)
+        finally:
+            set_client(None)
+            clear_memory_caches()
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("nanoseconds per call of the instrumentation hooks")
+    arg_parser.add_argument("--calls", dest="calls", type=int, default=200_000)
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=100)
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_results(
+        name="instrumentation",
+        results=run(calls=args.calls, journey_count=args.journeys, seed=args.seed),
+        output=args.output,
+    )
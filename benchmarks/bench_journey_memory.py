@@ -0,0 +1,109 @@
+"""
+Benchmark the memory held by many journeys, in bytes per journey
+
+Compares the layout JourneyDetails used to have, a dataclass holding a list
+of a dictionary per station, with the slotted JourneyDetails and its
+array backed StationWaits
+
+python -m benchmarks.bench_journey_memory --journeys 100000 --stations 4
+"""
+
+import gc
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable
+
+from src.data_model.dataclasses import JourneyDetails, StationWaits
+from benchmarks.common import argument_parser, synthetic_journeys, write_results
+
+
+@dataclass
+class DictJourneyDetails:
+    """
+    the layout of JourneyDetails before StationWaits
+    """
+
+    time_in_mins: int
+    departure_date_time: datetime
+    train_stations_with_wait: list[dict[str, Any]]
+
+
+def allocated_bytes(build: Callable[[], list]) -> tuple[int, list]:
+    """
+    the bytes still allocated by build once it returns, and what it built
+    """
+    gc.collect()
+    tracemalloc.start()
+    built = build()
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated, built
+
+
+def run(journey_count: int, stations: int) -> list[dict]:
+    """
+    build the same journeys in each layout, and measure the memory held
+    """
+    journeys = synthetic_journeys(count=journey_count, stations=stations)
+    columns = [
+        (
+            x.time_in_mins,
+            x.departure_date_time,
+            x.train_stations_with_wait.station_ids(),
+            x.train_stations_with_wait.wait_times(),
+        )
+        for x in journeys
+    ]
+    del journeys
+
+    layouts = {
+        "list_of_dicts": lambda: [
+            DictJourneyDetails(
+                time_in_mins=time_in_mins,
+                departure_date_time=departure_date_time,
+                train_stations_with_wait=[
+                    {"station_id": x, "wait_time": y}
+                    for x, y in zip(station_ids, wait_times)
+                ],
+            )
+            for time_in_mins, departure_date_time, station_ids, wait_times in columns
+        ],
+        "station_waits": lambda: [
+            JourneyDetails(
+                time_in_mins=time_in_mins,
+                departure_date_time=departure_date_time,
+                train_stations_with_wait=StationWaits.from_lists(
+                    station_ids=station_ids, wait_times=wait_times
+                ),
+            )
+            for time_in_mins, departure_date_time, station_ids, wait_times in columns
+        ],
+    }
+    results = []
+    for name, build in layouts.items():
+        allocated, built = allocated_bytes(build)
+        results.append(
+            {
+                "layout": name,
+                "journeys": journey_count,
+                "stations": stations,
+                "allocated_bytes": allocated,
+                "bytes_per_journey": round(allocated / journey_count, 1),
+            }
+        )
+        del built
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("memory held per journey")
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=100_000)
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=4)
+    args = arg_parser.parse_args()
+    write_results(
+        name="journey_memory",
+        results=run(journey_count=args.journeys, stations=args.stations),
+        output=args.output,
+    )
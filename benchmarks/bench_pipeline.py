@@ -0,0 +1,428 @@
+"""
+Benchmark the whole journey pipeline, offline
+
+Journeys are retrieved through get_train_information.retrieve_journey, with
+the api answered in process by a SyntheticTimetableClient, so every run is
+seeded and needs no network. Each section reports its own rows:
+
+* cache: the same journeys retrieved cold (empty database and caches), warm
+  from the database, and warm from the memory cache, for each route length
+* concurrency: cold and warm journeys retrieved by a pool of threads, as the
+  service does, for each number of threads
+* db_size: retrieving and storing a journey with the journeys table
+  already holding each number of journeys
+* process_response: processing a single api response into a leg
+
+python -m benchmarks.bench_pipeline --sections cache concurrency --journeys 200
+python -m benchmarks.bench_pipeline --sections db_size --db_sizes 1000 1000000 10000000
+"""
+
+import io
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import timedelta
+from statistics import quantiles
+from typing import Any, Callable
+
+from src.data_model.api.transport_api import (
+    leg_memory_cache,
+    process_response,
+    set_client,
+    timetable_graph,
+)
+from src.data_model.dataclasses import JourneyDetails, JourneyRequest
+from src.data_model.db.trains import retrieve_journey, store_journey, store_journeys
+from src.data_model.get_train_information import (
+    journey_memory_cache,
+    retrieve_journey as retrieve_through_pipeline,
+)
+from benchmarks.bench_timetable import WINDOW_START, synthetic_routes
+from benchmarks.common import (
+    argument_parser,
+    synthetic_journeys,
+    temporary_database,
+    write_results,
+)
+from benchmarks.stub_upstream import SyntheticTimetable, SyntheticTimetableClient
+
+SECTIONS = ["cache", "concurrency", "db_size", "process_response"]
+
+# the journeys are prefilled in batches of this many, each in one transaction
+DB_FILL_BATCH_SIZE = 10_000
+
+
+def clear_memory_caches() -> None:
+    """
+    empty every in memory cache in front of the database
+    """
+    journey_memory_cache.clear()
+    leg_memory_cache.clear()
+    timetable_graph.clear()
+
+
+def journey_requests(count: int, stations: int, seed: int) -> list[JourneyRequest]:
+    """
+    build a seeded list of journey requests, with a wait that is never exceeded
+    """
+    return [
+        JourneyRequest(
+            departure_date_time=departure_date_time,
+            max_wait_time=600,
+            station_identifiers=station_list,
+        )
+        for station_list, departure_date_time in synthetic_routes(
+            count=count, stations=stations, seed=seed
+        )
+    ]
+
+
+def latency_summary(latencies: list[float], secs: float) -> dict[str, Any]:
+    """
+    the throughput and latency percentiles, in ms, of a run
+    """
+    latencies = sorted(latencies)
+    summary = {
+        "journeys": len(latencies),
+        "secs": round(secs, 4),
+        "journeys_per_sec": round(len(latencies) / secs, 1),
+    }
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100)
+        summary["p50_ms"] = round(percentiles[49] * 1000, 3)
+        summary["p99_ms"] = round(percentiles[98] * 1000, 3)
+    return summary
+
+
+def retrieve_all(
+    requests: list[JourneyRequest],
+    retrieve: Callable[[JourneyRequest], Any],
+    threads: int = 1,
+) -> dict[str, Any]:
+    """
+    retrieve every journey, one at a time or from a pool of threads
+    """
+
+    def timed_retrieve(journey_request: JourneyRequest) -> float:
+        started_at = time.perf_counter()
+        retrieve(journey_request)
+        return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    # get_train_information prints each journey it retrieves from the api
+    with redirect_stdout(io.StringIO()):
+        if threads == 1:
+            latencies = [timed_retrieve(x) for x in requests]
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                latencies = list(executor.map(timed_retrieve, requests))
+    return latency_summary(latencies, secs=time.perf_counter() - started_at)
+
+
+def run_cache(
+    journey_count: int, station_counts: list[int], latency_ms: float, seed: int
+) -> list[dict]:
+    """
+    retrieve the same journeys cold, warm from the database and warm from memory
+    """
+    results = []
+    for stations in station_counts:
+        requests = journey_requests(count=journey_count, stations=stations, seed=seed)
+        client = SyntheticTimetableClient(
+            timetable=SyntheticTimetable(seed=seed), latency_secs=latency_ms / 1000
+        )
+        with temporary_database():
+            set_client(client)
+            try:
+                clear_memory_caches()
+                cold = retrieve_all(requests, retrieve=retrieve_through_pipeline)
+                api_requests = client.request_count
+                clear_memory_caches()
+                warm_database = retrieve_all(
+                    requests, retrieve=retrieve_through_pipeline
+                )
+                warm_memory = retrieve_all(requests, retrieve=retrieve_through_pipeline)
+            finally:
+                set_client(None)
+                clear_memory_caches()
+        for cache, summary in [
+            ("cold", cold),
+            ("warm_database", warm_database),
+            ("warm_memory", warm_memory),
+        ]:
+            results.append(
+                {
+                    "section": "cache",
+                    "cache": cache,
+                    "stations": stations,
+                    "latency_ms": latency_ms,
+                    **summary,
+                    "api_requests": api_requests if cache == "cold" else 0,
+                }
+            )
+        # a warm journey must not have gone to the api
+        assert client.request_count == api_requests
+    return results
+
+
+def run_concurrency(
+    journey_count: int,
+    stations: int,
+    thread_counts: list[int],
+    latency_ms: float,
+    seed: int,
+) -> list[dict]:
+    """
+    retrieve cold, then warm from the database, journeys from a pool of threads
+    """
+    results = []
+    for threads in thread_counts:
+        requests = journey_requests(count=journey_count, stations=stations, seed=seed)
+        client = SyntheticTimetableClient(
+            timetable=SyntheticTimetable(seed=seed), latency_secs=latency_ms / 1000
+        )
+        with temporary_database():
+            set_client(client)
+            try:
+                clear_memory_caches()
+                cold = retrieve_all(
+                    requests, retrieve=retrieve_through_pipeline, threads=threads
+                )
+                clear_memory_caches()
+                warm_database = retrieve_all(
+                    requests, retrieve=retrieve_through_pipeline, threads=threads
+                )
+            finally:
+                set_client(None)
+                clear_memory_caches()
+        for cache, summary in [("cold", cold), ("warm_database", warm_database)]:
+            results.append(
+                {
+                    "section": "concurrency",
+                    "cache": cache,
+                    "threads": threads,
+                    "stations": stations,
+                    "latency_ms": latency_ms,
+                    **summary,
+                }
+            )
+    return results
+
+
+def fill_database(
+    journey_count: int, sample_size: int, seed: int
+) -> list[JourneyDetails]:
+    """
+    store journey_count distinct journeys, in batches
+
+    Returns:
+        list[JourneyDetails]: a seeded sample of the stored journeys, from every batch
+    """
+    generator = random.Random(seed)
+    batch_count = -(-journey_count // DB_FILL_BATCH_SIZE)
+    sample = []
+    for batch_start in range(0, journey_count, DB_FILL_BATCH_SIZE):
+        journeys = synthetic_journeys(
+            count=min(DB_FILL_BATCH_SIZE, journey_count - batch_start),
+            seed=seed + batch_start,
+            start=WINDOW_START + timedelta(minutes=batch_start),
+        )
+        store_journeys(journeys)
+        sample += generator.sample(
+            journeys, min(len(journeys), -(-sample_size // batch_count))
+        )
+    return sample
+
+
+def run_db_size(db_sizes: list[int], lookups: int, seed: int) -> list[dict]:
+    """
+    retrieve stored journeys, and store new ones, with the database holding
+    each number of journeys
+    """
+    results = []
+    for db_size in db_sizes:
+        with temporary_database() as database_path:
+            started_at = time.perf_counter()
+            stored_journeys = fill_database(
+                journey_count=db_size, sample_size=lookups, seed=seed
+            )
+            fill_secs = time.perf_counter() - started_at
+            random.Random(seed).shuffle(stored_journeys)
+            new_journeys = synthetic_journeys(
+                count=lookups,
+                seed=seed - 1,
+                start=WINDOW_START + timedelta(minutes=db_size),
+            )
+
+            retrieve_latencies = []
+            for journey in stored_journeys[:lookups]:
+                call_started_at = time.perf_counter()
+                journey_details = retrieve_journey(
+                    station_list=journey.train_stations_with_wait.station_ids(),
+                    departure_date_time=journey.departure_date_time,
+                )
+                retrieve_latencies.append(time.perf_counter() - call_started_at)
+                assert journey_details.time_in_mins is not None
+
+            store_latencies = []
+            for journey in new_journeys:
+                call_started_at = time.perf_counter()
+                store_journey(journey)
+                store_latencies.append(time.perf_counter() - call_started_at)
+            # with WAL journaling, the latest pages are still in the -wal file
+            database_bytes = sum(
+                os.path.getsize(x)
+                for x in (database_path, f"{database_path}-wal")
+                if os.path.exists(x)
+            )
+
+        for operation, latencies in [
+            ("retrieve_journey", retrieve_latencies),
+            ("store_journey", store_latencies),
+        ]:
+            summary = latency_summary(latencies, secs=sum(latencies))
+            results.append(
+                {
+                    "section": "db_size",
+                    "operation": operation,
+                    "db_size": db_size,
+                    "fill_secs": round(fill_secs, 2),
+                    "database_bytes": database_bytes,
+                    "calls": summary.pop("journeys"),
+                    "calls_per_sec": summary.pop("journeys_per_sec"),
+                    **summary,
+                }
+            )
+    return results
+
+
+def run_process_response(repeat: int, seed: int) -> list[dict]:
+    """
+    process synthetic api responses into legs
+    """
+    timetable = SyntheticTimetable(seed=seed)
+    generator = random.Random(seed)
+    earliest_departure_times = [
+        WINDOW_START + timedelta(hours=1, minutes=generator.randrange(12 * 60))
+        for _ in range(100)
+    ]
+    responses = [
+        (
+            x,
+            timetable.response(
+                origin_station="LBG", destination="CHX", departures_from=x
+            ),
+        )
+        for x in earliest_departure_times
+    ]
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        for earliest_departure_time, response in responses:
+            process_response(
+                earliest_departure_time=earliest_departure_time, response=response
+            )
+    secs = time.perf_counter() - started_at
+    calls = repeat * len(responses)
+    return [
+        {
+            "section": "process_response",
+            "responses": calls,
+            "routes_per_response": len(responses[0][1]["routes"]),
+            "secs": round(secs, 4),
+            "usecs_per_response": round(secs * 1_000_000 / calls, 2),
+        }
+    ]
+
+
+def run(
+    sections: list[str],
+    journey_count: int = 200,
+    station_counts: list[int] = (2, 5, 10, 20),
+    thread_counts: list[int] = (1, 4, 16),
+    concurrency_stations: int = 5,
+    db_sizes: list[int] = (1_000, 10_000, 100_000),
+    lookups: int = 500,
+    latency_ms: float = 0.0,
+    concurrency_latency_ms: float = 5.0,
+    repeat: int = 100,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    run each of the sections
+    """
+    results = []
+    if "cache" in sections:
+        results += run_cache(
+            journey_count=journey_count,
+            station_counts=list(station_counts),
+            latency_ms=latency_ms,
+            seed=seed,
+        )
+    if "concurrency" in sections:
+        results += run_concurrency(
+            journey_count=journey_count,
+            stations=concurrency_stations,
+            thread_counts=list(thread_counts),
+            latency_ms=concurrency_latency_ms,
+            seed=seed,
+        )
+    if "db_size" in sections:
+        results += run_db_size(db_sizes=list(db_sizes), lookups=lookups, seed=seed)
+    if "process_response" in sections:
+        results += run_process_response(repeat=repeat, seed=seed)
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("the journey pipeline, cold and warm, offline")
+    arg_parser.add_argument(
+        "--sections", dest="sections", nargs="+", choices=SECTIONS, default=SECTIONS
+    )
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=200)
+    arg_parser.add_argument(
+        "--stations", dest="stations", nargs="+", type=int, default=[2, 5, 10, 20]
+    )
+    arg_parser.add_argument(
+        "--threads", dest="threads", nargs="+", type=int, default=[1, 4, 16]
+    )
+    arg_parser.add_argument(
+        "--db_sizes",
+        dest="db_sizes",
+        nargs="+",
+        type=int,
+        default=[1_000, 10_000, 100_000],
+    )
+    arg_parser.add_argument("--lookups", dest="lookups", type=int, default=500)
+    arg_parser.add_argument(
+        "--latency_ms",
+        dest="latency_ms",
+        type=float,
+        default=0.0,
+        help="the latency of each api request in the cache section",
+    )
+    arg_parser.add_argument(
+        "--concurrency_latency_ms",
+        dest="concurrency_latency_ms",
+        type=float,
+        default=5.0,
+        help="the latency of each api request in the concurrency section",
+    )
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_results(
+        name="pipeline",
+        results=run(
+            sections=args.sections,
+            journey_count=args.journeys,
+            station_counts=args.stations,
+            thread_counts=args.threads,
+            db_sizes=args.db_sizes,
+            lookups=args.lookups,
+            latency_ms=args.latency_ms,
+            concurrency_latency_ms=args.concurrency_latency_ms,
+            seed=args.seed,
+        ),
+        output=args.output,
+    )
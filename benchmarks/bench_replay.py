@@ -0,0 +1,177 @@
+"""
+Benchmark the whole journey retrieval pipeline against a recorded transport api
+
+Without --recording, the api is first recorded from the stub upstream serving
+the synthetic timetable. The same journeys are then retrieved, from an empty
+database, with the recording replayed in process by a ReplayClient, and over
+http by the stub upstream, where the TransportApiClient's retries and
+connection pool are exercised too. The latency and error rate of the replay
+are set on the command line, so the numbers are reproducible
+
+python -m benchmarks.bench_replay --journeys 200 --latency_ms 20 --error_rate 0.05
+"""
+
+import io
+import os
+import tempfile
+import time
+from contextlib import ExitStack, nullcontext, redirect_stdout
+from typing import Any
+
+from src import defaults
+from src.data_model.api.client import TransportApiClient, TransportApiError
+from src.data_model.api.replay import RecordingClient, ReplayClient
+from src.data_model.api.transport_api import (
+    NoJourneyFound,
+    leg_memory_cache,
+    set_client,
+    timetable_graph,
+)
+from src.data_model.dataclasses import JourneyRequest
+from src.data_model.get_train_information import journey_memory_cache, retrieve_journey
+from benchmarks.bench_timetable import synthetic_routes
+from benchmarks.common import argument_parser, temporary_database, write_results
+from benchmarks.stub_upstream import StubUpstream, SyntheticTimetable
+
+
+def retrieve_journeys(journey_requests: list[JourneyRequest]) -> dict[str, Any]:
+    """
+    retrieve every journey through get_train_information, from an empty
+    database and empty caches
+    """
+    journey_memory_cache.clear()
+    leg_memory_cache.clear()
+    timetable_graph.clear()
+    failed = 0
+    started_at = time.perf_counter()
+    # get_train_information prints each journey it retrieves from the api
+    with redirect_stdout(io.StringIO()):
+        for journey_request in journey_requests:
+            try:
+                retrieve_journey(journey_request=journey_request)
+            except (NoJourneyFound, TransportApiError):
+                failed += 1
+    secs = time.perf_counter() - started_at
+    return {
+        "journeys": len(journey_requests),
+        "failed": failed,
+        "secs": round(secs, 4),
+        "journeys_per_sec": round(len(journey_requests) / secs, 1),
+    }
+
+
+def record(journey_requests: list[JourneyRequest], path: str, seed: int) -> None:
+    """
+    record the requests the journeys make of the stub upstream
+    """
+    base_url = defaults.BASE_URL
+    with temporary_database(), StubUpstream(
+        timetable=SyntheticTimetable(seed=seed)
+    ) as upstream:
+        defaults.BASE_URL = upstream.url
+        set_client(RecordingClient(client=TransportApiClient(), path=path))
+        try:
+            retrieve_journeys(journey_requests)
+        finally:
+            set_client(None)
+            defaults.BASE_URL = base_url
+
+
+def run(
+    journey_count: int,
+    stations: int,
+    seed: int,
+    recording: str,
+    latency_ms: float,
+    error_rate: float,
+) -> list[dict]:
+    """
+    replay the recording in process and over http
+    """
+    journey_requests = [
+        JourneyRequest(
+            departure_date_time=departure_date_time,
+            max_wait_time=600,
+            station_identifiers=station_list,
+        )
+        for station_list, departure_date_time in synthetic_routes(
+            count=journey_count, stations=stations, seed=seed
+        )
+    ]
+    results = []
+    with ExitStack() as stack:
+        if recording is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+            recording = os.path.join(directory, "recording.jsonl.gz")
+            record(journey_requests=journey_requests, path=recording, seed=seed)
+
+        def replay_client() -> ReplayClient:
+            return ReplayClient(
+                path=recording,
+                latency_secs=latency_ms / 1000,
+                error_rate=error_rate,
+                seed=seed,
+            )
+
+        base_url = defaults.BASE_URL
+        for transport in ("in_process", "http_stub"):
+            replay = replay_client()
+            with temporary_database(), (
+                StubUpstream(replay=replay)
+                if transport == "http_stub"
+                else nullcontext()
+            ) as upstream:
+                if upstream is None:
+                    set_client(replay)
+                else:
+                    defaults.BASE_URL = upstream.url
+                    set_client(TransportApiClient(backoff_secs=0.01))
+                try:
+                    result = retrieve_journeys(journey_requests)
+                finally:
+                    set_client(None)
+                    defaults.BASE_URL = base_url
+            results.append(
+                {
+                    "transport": transport,
+                    **result,
+                    "api_requests": replay.request_count
+                    if upstream is None
+                    else upstream.request_count,
+                    "recorded_requests": len(replay),
+                    "latency_ms": latency_ms,
+                    "error_rate": error_rate,
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("journeys per second against a recorded api")
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=200)
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=4)
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    arg_parser.add_argument(
+        "--recording",
+        dest="recording",
+        help="a .jsonl.gz recording to replay, rather than recording the stub",
+    )
+    arg_parser.add_argument(
+        "--latency_ms", dest="latency_ms", type=float, default=0.0
+    )
+    arg_parser.add_argument(
+        "--error_rate", dest="error_rate", type=float, default=0.0
+    )
+    args = arg_parser.parse_args()
+    write_results(
+        name="replay",
+        results=run(
+            journey_count=args.journeys,
+            stations=args.stations,
+            seed=args.seed,
+            recording=args.recording,
+            latency_ms=args.latency_ms,
+            error_rate=args.error_rate,
+        ),
+        output=args.output,
+    )
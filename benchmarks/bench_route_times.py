@@ -0,0 +1,108 @@
+"""
+Benchmark evaluating one route at many departure times
+
+Compares a transport_api.retrieve_journey call per departure time with
+route_times.retrieve_route_times, against the same stored departures
+
+python -m benchmarks.bench_route_times --departure_times 48 --stations 4
+"""
+
+from datetime import timedelta
+
+from src.data_model.api.transport_api import (
+    leg_memory_cache,
+    retrieve_journey,
+    timetable_graph,
+)
+from src.data_model.dataclasses import JourneyRequest
+from src.data_model.route_times import retrieve_route_times
+from benchmarks.bench_timetable import WINDOW_START, store_timetable
+from benchmarks.common import (
+    STATION_IDENTIFIERS,
+    argument_parser,
+    temporary_database,
+    time_call,
+    write_results,
+)
+from benchmarks.stub_upstream import SyntheticTimetable
+
+
+def run(departure_time_count: int, stations: int, interval_mins: int) -> list[dict]:
+    """
+    evaluate the route at every departure time with each path
+    """
+    station_identifiers = STATION_IDENTIFIERS[:stations]
+    departure_date_times = [
+        WINDOW_START + timedelta(hours=1, minutes=idx * interval_mins)
+        for idx in range(departure_time_count)
+    ]
+    results = []
+    with temporary_database():
+        store_timetable(
+            timetable=SyntheticTimetable(routes_per_response=6 * 19),
+            stations=station_identifiers,
+        )
+        timetable_graph.clear()
+        timetable_graph.load(
+            pairs=list(zip(station_identifiers, station_identifiers[1:]))
+        )
+
+        def retrieve_journey_per_departure_time():
+            # each departure time is new, so the legs are not in memory
+            leg_memory_cache.clear()
+            for departure_date_time in departure_date_times:
+                retrieve_journey(
+                    JourneyRequest(
+                        departure_date_time=departure_date_time,
+                        max_wait_time=60,
+                        station_identifiers=station_identifiers,
+                    )
+                )
+
+        for name, function in [
+            ("retrieve_journey", retrieve_journey_per_departure_time),
+            (
+                "retrieve_route_times",
+                lambda: retrieve_route_times(
+                    station_identifiers=station_identifiers,
+                    departure_date_times=departure_date_times,
+                    max_wait_time=60,
+                ),
+            ),
+        ]:
+            secs = time_call(function, repeat=5)
+            results.append(
+                {
+                    "path": name,
+                    "departure_times": departure_time_count,
+                    "stations": stations,
+                    "secs": round(secs, 5),
+                    "usecs_per_departure_time": round(
+                        secs * 1_000_000 / departure_time_count, 2
+                    ),
+                }
+            )
+    timetable_graph.clear()
+    leg_memory_cache.clear()
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("one route at many departure times")
+    arg_parser.add_argument(
+        "--departure_times", dest="departure_times", type=int, default=48
+    )
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=4)
+    arg_parser.add_argument(
+        "--interval_mins", dest="interval_mins", type=int, default=5
+    )
+    args = arg_parser.parse_args()
+    write_results(
+        name="route_times",
+        results=run(
+            departure_time_count=args.departure_times,
+            stations=args.stations,
+            interval_mins=args.interval_mins,
+        ),
+        output=args.output,
+    )
@@ -0,0 +1,143 @@
+"""
+Benchmark evaluating many candidate routes from the same origin and time
+
+Compares a transport_api.retrieve_journey call per route with
+route_trie.retrieve_routes, with the api answered in process by a
+SyntheticTimetableClient. The candidate routes branch from the origin, so
+they share their prefixes, and each run starts from an empty database
+
+python -m benchmarks.bench_route_trie --routes 50 --stations 6 --branching 3
+"""
+
+import random
+from datetime import timedelta
+
+from src.data_model.api.transport_api import (
+    leg_memory_cache,
+    retrieve_journey,
+    set_client,
+    timetable_graph,
+)
+from src.data_model.dataclasses import JourneyRequest
+from src.data_model.route_trie import build_route_trie, retrieve_routes
+from benchmarks.bench_timetable import WINDOW_START
+from benchmarks.common import (
+    STATION_IDENTIFIERS,
+    argument_parser,
+    temporary_database,
+    time_call,
+    write_results,
+)
+from benchmarks.stub_upstream import SyntheticTimetable, SyntheticTimetableClient
+
+
+def candidate_routes(
+    route_count: int, stations: int, branching: int, seed: int
+) -> list[list[str]]:
+    """
+    build seeded candidate routes from the same origin, where each prefix is
+    followed by one of branching stations, so the routes share their prefixes
+    """
+    generator = random.Random(seed)
+    routes = []
+    for _ in range(route_count):
+        route = [STATION_IDENTIFIERS[0]]
+        for _ in range(stations - 1):
+            next_stations = random.Random(f"{seed}:{'_'.join(route)}").sample(
+                [x for x in STATION_IDENTIFIERS if x != route[-1]], branching
+            )
+            route.append(generator.choice(next_stations))
+        routes.append(route)
+    return routes
+
+
+def run(
+    route_count: int, stations: int, branching: int, latency_ms: float, seed: int
+) -> list[dict]:
+    """
+    retrieve the candidate routes cold with each path
+    """
+    routes = candidate_routes(
+        route_count=route_count, stations=stations, branching=branching, seed=seed
+    )
+    departure_date_time = WINDOW_START + timedelta(hours=1)
+    distinct_legs = 0
+    nodes = list(build_route_trie(routes).values())
+    while nodes:
+        node = nodes.pop()
+        distinct_legs += len(node.children)
+        nodes += node.children.values()
+
+    def retrieve_journey_per_route():
+        for route in routes:
+            retrieve_journey(
+                JourneyRequest(
+                    departure_date_time=departure_date_time,
+                    max_wait_time=600,
+                    station_identifiers=route,
+                )
+            )
+
+    results = []
+    for name, function, legs in [
+        ("retrieve_journey", retrieve_journey_per_route, route_count * (stations - 1)),
+        (
+            "retrieve_routes",
+            lambda: retrieve_routes(
+                station_lists=routes,
+                departure_date_time=departure_date_time,
+                max_wait_time=600,
+            ),
+            distinct_legs,
+        ),
+    ]:
+        client = SyntheticTimetableClient(
+            timetable=SyntheticTimetable(seed=seed), latency_secs=latency_ms / 1000
+        )
+        with temporary_database():
+            set_client(client)
+            try:
+                leg_memory_cache.clear()
+                timetable_graph.clear()
+                secs = time_call(function)
+            finally:
+                set_client(None)
+                leg_memory_cache.clear()
+                timetable_graph.clear()
+        results.append(
+            {
+                "path": name,
+                "routes": route_count,
+                "stations": stations,
+                "branching": branching,
+                "latency_ms": latency_ms,
+                "leg_lookups": legs,
+                "api_requests": client.request_count,
+                "secs": round(secs, 4),
+                "routes_per_sec": round(route_count / secs, 1),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("many candidate routes from the same origin")
+    arg_parser.add_argument("--routes", dest="routes", type=int, default=50)
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=6)
+    arg_parser.add_argument("--branching", dest="branching", type=int, default=3)
+    arg_parser.add_argument(
+        "--latency_ms", dest="latency_ms", type=float, default=2.0
+    )
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_results(
+        name="route_trie",
+        results=run(
+            route_count=args.routes,
+            stations=args.stations,
+            branching=args.branching,
+            latency_ms=args.latency_ms,
+            seed=args.seed,
+        ),
+        output=args.output,
+    )
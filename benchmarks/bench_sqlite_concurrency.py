@@ -0,0 +1,174 @@
+"""
+Benchmark sqlite connection profiles with concurrent readers and writers
+
+Each profile is run against its own database. Readers retrieve stored
+journeys while writers store new ones, and the throughput, latency and
+"database is locked" errors of each are reported, so the pragmas in
+defaults.SQLITE_PRAGMAS can be chosen from data.
+
+The readers and writers are processes by default, so that they contend on
+the sqlite locks rather than on the GIL. Threads can be used instead, to
+see the service's thread pool
+
+python -m benchmarks.bench_sqlite_concurrency --readers 6 --writers 2 --secs 5
+"""
+
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from typing import Any
+
+from sqlalchemy.exc import OperationalError
+
+from src.data_model.dataclasses import JourneyDetails
+from src.data_model.db.trains import (
+    Session,
+    retrieve_journey,
+    store_journey,
+    store_journeys,
+)
+from src import defaults
+from benchmarks.common import (
+    argument_parser,
+    synthetic_journeys,
+    temporary_database,
+    write_results,
+)
+
+PROFILES = {
+    "rollback_full": {"journal_mode": "DELETE", "synchronous": "FULL"},
+    "wal_full": {"journal_mode": "WAL", "synchronous": "FULL"},
+    "wal_normal": {"journal_mode": "WAL", "synchronous": "NORMAL"},
+    "defaults": defaults.SQLITE_PRAGMAS,
+}
+
+# the journeys stored before the workers start, which the readers retrieve
+_stored_journeys: list[JourneyDetails] = []
+
+
+def run_worker(kind: str, seed: int, secs: float, forked: bool) -> tuple[list[float], int]:
+    """
+    retrieve, or store, journeys one at a time for secs
+
+    Returns:
+        the latency of each call, in seconds, and the number of errors
+    """
+    if forked:
+        # a forked process must not use the connections of its parent
+        Session.kw["bind"].dispose(close=False)
+    generator = random.Random(seed)
+    # each writer stores journeys that are not stored yet
+    new_journeys = iter(
+        synthetic_journeys(count=100_000, seed=seed + 1, stations=5)
+        if kind == "writer"
+        else []
+    )
+    latencies, errors = [], 0
+    finish_at = time.perf_counter() + secs
+    while time.perf_counter() < finish_at:
+        started_at = time.perf_counter()
+        try:
+            if kind == "writer":
+                store_journey(next(new_journeys))
+            else:
+                journey = generator.choice(_stored_journeys)
+                retrieve_journey(
+                    station_list=journey.train_stations_with_wait.station_ids(),
+                    departure_date_time=journey.departure_date_time,
+                )
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started_at)
+    return latencies, errors
+
+
+def run_workers(
+    kinds: list[str], secs: float, concurrency: str
+) -> list[tuple[list[float], int]]:
+    """
+    run every worker at once, in its own process or thread
+    """
+    worker_args = [(kind, seed, secs) for seed, kind in enumerate(kinds)]
+    if concurrency == "process":
+        with multiprocessing.get_context("fork").Pool(processes=len(kinds)) as pool:
+            return pool.starmap(run_worker, [(*x, True) for x in worker_args])
+    with ThreadPoolExecutor(max_workers=len(kinds)) as executor:
+        return list(executor.map(lambda x: run_worker(*x, forked=False), worker_args))
+
+
+def summarise(results: list[tuple[list[float], int]], secs: float) -> dict[str, Any]:
+    """
+    the throughput and latency percentiles, in ms, of a group of workers
+    """
+    latencies = sorted(x for worker_latencies, _ in results for x in worker_latencies)
+    summary = {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / secs),
+        "errors": sum(x for _, x in results),
+    }
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100)
+        summary["p50_ms"] = round(percentiles[49] * 1000, 3)
+        summary["p99_ms"] = round(percentiles[98] * 1000, 3)
+    return summary
+
+
+def run(
+    readers: int, writers: int, secs: float, journey_count: int, concurrency: str
+) -> list[dict]:
+    """
+    run the same mixed workload against each profile
+    """
+    _stored_journeys[:] = synthetic_journeys(count=journey_count)
+    results = []
+    for name, pragmas in PROFILES.items():
+        with temporary_database(pragmas=pragmas):
+            store_journeys(_stored_journeys)
+            Session.kw["bind"].dispose()
+            worker_results = run_workers(
+                ["reader"] * readers + ["writer"] * writers,
+                secs=secs,
+                concurrency=concurrency,
+            )
+            results.append(
+                {
+                    "profile": name,
+                    "pragmas": pragmas,
+                    "concurrency": concurrency,
+                    "readers": readers,
+                    "writers": writers,
+                    "reads": summarise(worker_results[:readers], secs=secs),
+                    "writes": summarise(worker_results[readers:], secs=secs),
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("sqlite profiles with mixed readers and writers")
+    arg_parser.add_argument("--readers", dest="readers", type=int, default=6)
+    arg_parser.add_argument("--writers", dest="writers", type=int, default=2)
+    arg_parser.add_argument("--secs", dest="secs", type=float, default=5)
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=10_000)
+    arg_parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        choices=["process", "thread"],
+        default="process",
+    )
+    args = arg_parser.parse_args()
+    write_results(
+        name="sqlite_concurrency",
+        results=run(
+            readers=args.readers,
+            writers=args.writers,
+            secs=args.secs,
+            journey_count=args.journeys,
+            concurrency=args.concurrency,
+        ),
+        output=args.output,
+    )
@@ -0,0 +1,127 @@
+"""
+Benchmark storing journeys, in rows per second
+
+Compares the per journey ORM path that store_journey used to take (an ORM
+object per station, a flush for the journey_id and a commit per journey)
+with store_journey and the bulk store_journeys
+
+python -m benchmarks.bench_store_journeys --journeys 5000
+"""
+
+from src.data_model.dataclasses import JourneyDetails
+from src.data_model.db.trains import (
+    Journeys,
+    JourneyStations,
+    Routes,
+    Session,
+    Stations,
+    join_wait_times,
+    route_hash,
+    store_journey,
+    store_journeys,
+    to_epoch_minutes,
+)
+from benchmarks.common import (
+    argument_parser,
+    synthetic_journeys,
+    temporary_database,
+    time_call,
+    write_results,
+)
+
+
+def store_journeys_orm_per_row(journeys: list[JourneyDetails]) -> None:
+    """
+    store the journeys the way store_journey did before the bulk path, with
+    an ORM object per row of the compact tables
+    """
+    for journey in journeys:
+        db_session = Session()
+        station_ids = journey.train_stations_with_wait.station_ids()
+        route_id = route_hash(station_ids)
+        if db_session.get(Routes, route_id) is None:
+            db_session.add(
+                Routes(route_id=route_id, joined_journey_list="_".join(station_ids))
+            )
+        journey_row = Journeys(
+            route_id=route_id,
+            departure_minutes=to_epoch_minutes(journey.departure_date_time),
+            total_journey_time_mins=journey.time_in_mins,
+            joined_wait_times=join_wait_times(
+                journey.train_stations_with_wait.wait_times()
+            ),
+        )
+        db_session.add(journey_row)
+        db_session.flush()
+        for idx, station in enumerate(journey.train_stations_with_wait):
+            station_row = (
+                db_session.query(Stations)
+                .filter(Stations.station_identifier == station["station_id"])
+                .first()
+            )
+            if station_row is None:
+                station_row = Stations(station_identifier=station["station_id"])
+                db_session.add(station_row)
+                db_session.flush()
+            db_session.add(
+                JourneyStations(
+                    journey_id=journey_row.journey_id,
+                    station_order=idx,
+                    station_id=station_row.station_id,
+                    wait_time_mins=station["wait_time"],
+                )
+            )
+        db_session.commit()
+        db_session.close()
+
+
+def store_journeys_one_at_a_time(journeys: list[JourneyDetails]) -> None:
+    """
+    store the journeys with a transaction per journey
+    """
+    for journey in journeys:
+        store_journey(journey)
+
+
+def run(journey_count: int, batch_size: int) -> list[dict]:
+    """
+    run each way of storing the journeys against an empty database
+    """
+    journeys = synthetic_journeys(count=journey_count)
+    rows = sum(1 + len(x.train_stations_with_wait) for x in journeys)
+
+    def store_in_batches(journeys: list[JourneyDetails]) -> None:
+        for idx in range(0, len(journeys), batch_size):
+            store_journeys(journeys[idx : idx + batch_size])
+
+    results = []
+    for name, function in [
+        ("orm_per_row", store_journeys_orm_per_row),
+        ("store_journey", store_journeys_one_at_a_time),
+        ("store_journeys", store_in_batches),
+    ]:
+        with temporary_database():
+            secs = time_call(lambda: function(journeys))
+        results.append(
+            {
+                "path": name,
+                "journeys": journey_count,
+                "rows": rows,
+                "batch_size": batch_size if name == "store_journeys" else 1,
+                "secs": round(secs, 4),
+                "rows_per_sec": round(rows / secs),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("rows per second storing journeys")
+    arg_parser.add_argument("--journeys", dest="journeys", type=int, default=2000)
+    arg_parser.add_argument("--batch_size", dest="batch_size", type=int, default=1000)
+    args = arg_parser.parse_args()
+    write_results(
+        name="store_journeys",
+        results=run(journey_count=args.journeys, batch_size=args.batch_size),
+        output=args.output,
+    )
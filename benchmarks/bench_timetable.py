@@ -0,0 +1,164 @@
+"""
+Benchmark evaluating routes from the stored departures, in routes per second
+
+Compares a query of the departures table per leg, the path
+transport_api.retrieve_leg takes for a leg it has not seen, with the
+in memory timetable graph, once its edges are loaded
+
+python -m benchmarks.bench_timetable --routes 2000 --stations 4
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Any, Callable, Union
+
+from src.data_model.api.transport_api import parse_routes, process_departure
+from src.data_model.db.trains import retrieve_next_departure, store_departures
+from src.data_model.timetable import TimetableGraph
+from benchmarks.common import (
+    STATION_IDENTIFIERS,
+    argument_parser,
+    temporary_database,
+    time_call,
+    write_results,
+)
+from benchmarks.stub_upstream import SyntheticTimetable
+
+# the stored departures cover the day from this time
+WINDOW_START = datetime(2024, 6, 2, 5, 0)
+
+
+def store_timetable(timetable: SyntheticTimetable, stations: list[str]) -> None:
+    """
+    store a window of departures for the rest of the day, for every pair of stations
+    """
+    for origin_station in stations:
+        for destination in stations:
+            if origin_station == destination:
+                continue
+            store_departures(
+                origin_station=origin_station,
+                destination=destination,
+                window_start_date_time=WINDOW_START,
+                departures=parse_routes(
+                    timetable.response(
+                        origin_station=origin_station,
+                        destination=destination,
+                        departures_from=WINDOW_START,
+                    )
+                ),
+            )
+
+
+def synthetic_routes(
+    count: int, stations: int, seed: int
+) -> list[tuple[list[str], datetime]]:
+    """
+    build a seeded list of routes and departure times
+    """
+    generator = random.Random(seed)
+    return [
+        (
+            generator.sample(STATION_IDENTIFIERS, stations),
+            WINDOW_START + timedelta(hours=1, minutes=generator.randrange(12 * 60)),
+        )
+        for _ in range(count)
+    ]
+
+
+def evaluate_routes(
+    routes: list[tuple[list[str], datetime]],
+    next_departure: Callable[[str, str, datetime], Union[dict[str, Any], None]],
+) -> list[datetime]:
+    """
+    the arrival time of each route, taking the next departure of every leg
+    """
+    arrival_times = []
+    for station_list, departure_date_time in routes:
+        next_departure_date_time = departure_date_time
+        for origin_station, destination in zip(station_list, station_list[1:]):
+            leg = process_departure(
+                earliest_departure_time=next_departure_date_time,
+                departure=next_departure(
+                    origin_station, destination, next_departure_date_time
+                ),
+            )
+            next_departure_date_time = leg["arrival_time"]
+        arrival_times.append(next_departure_date_time)
+    return arrival_times
+
+
+def run(route_count: int, stations: int, seed: int) -> list[dict]:
+    """
+    evaluate the same routes with each path, against the same stored departures
+    """
+    routes = synthetic_routes(count=route_count, stations=stations, seed=seed)
+    pairs = list(
+        {
+            (origin_station, destination)
+            for station_list, _ in routes
+            for origin_station, destination in zip(station_list, station_list[1:])
+        }
+    )
+    timetable = SyntheticTimetable(seed=seed, routes_per_response=6 * 19)
+    results = []
+    with temporary_database():
+        store_timetable(timetable=timetable, stations=STATION_IDENTIFIERS)
+
+        def query_per_leg(origin_station, destination, earliest_departure_date_time):
+            return retrieve_next_departure(
+                origin_station=origin_station,
+                destination=destination,
+                earliest_departure_date_time=earliest_departure_date_time,
+            )
+
+        timetable_graph = TimetableGraph()
+        load_secs = time_call(lambda: timetable_graph.load(pairs=pairs))
+
+        def timetable_graph_leg(origin_station, destination, earliest_departure_date_time):
+            return timetable_graph.next_departure(
+                origin_station=origin_station,
+                destination=destination,
+                earliest_departure_date_time=earliest_departure_date_time,
+            )
+
+        arrival_times = {}
+        for name, next_departure in [
+            ("query_per_leg", query_per_leg),
+            ("timetable_graph", timetable_graph_leg),
+        ]:
+            secs = time_call(
+                lambda: evaluate_routes(routes=routes, next_departure=next_departure),
+                repeat=3,
+            )
+            arrival_times[name] = evaluate_routes(
+                routes=routes, next_departure=next_departure
+            )
+            results.append(
+                {
+                    "path": name,
+                    "routes": route_count,
+                    "stations": stations,
+                    "secs": round(secs, 4),
+                    "routes_per_sec": round(route_count / secs),
+                    "usecs_per_route": round(secs * 1_000_000 / route_count, 2),
+                }
+            )
+        results[-1]["load_secs"] = round(load_secs, 4)
+        results[-1]["edges"] = len(pairs)
+        # both paths must find the same trains
+        assert arrival_times["query_per_leg"] == arrival_times["timetable_graph"]
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("routes per second from the stored departures")
+    arg_parser.add_argument("--routes", dest="routes", type=int, default=2000)
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=4)
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_results(
+        name="timetable",
+        results=run(route_count=args.routes, stations=args.stations, seed=args.seed),
+        output=args.output,
+    )
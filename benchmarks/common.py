@@ -0,0 +1,143 @@
+"""
+Shared helpers for the benchmarks
+
+Each benchmark is run from the repository root, for example
+python -m benchmarks.bench_store_journeys, and prints its results as json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterator
+
+from src.data_model.dataclasses import JourneyDetails
+from src.data_model.db.trains import (
+    Session,
+    create_database_engine,
+    engine,
+    initialise_database,
+)
+
+STATION_IDENTIFIERS = [
+    "LBG", "SAJ", "NWX", "BXY", "CHX", "WAT", "HMC", "NEM", "LYM", "PGN",
+    "VIC", "KGX", "EUS", "PAD", "LST", "MYB", "CST", "FST", "BFR", "CLJ",
+]  # fmt: skip
+
+
+@contextmanager
+def temporary_database(pragmas: dict[str, Any] = None) -> Iterator[str]:
+    """
+    run the benchmark against an empty trains.db in a temporary directory,
+    by binding the sessions to an engine for that database
+
+    Args:
+        pragmas (dict[str, Any]): the sqlite connection profile, defaults.SQLITE_PRAGMAS if not given
+
+    Yields:
+        str : the path of the database file
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "trains.db")
+        temporary_engine = create_database_engine(
+            f"sqlite:///{database_path}", pragmas=pragmas
+        )
+        Session.configure(bind=temporary_engine)
+        try:
+            initialise_database()
+            yield database_path
+        finally:
+            temporary_engine.dispose()
+            Session.configure(bind=engine)
+
+
+def synthetic_journeys(
+    count: int,
+    stations: int = 4,
+    seed: int = 0,
+    start: datetime = datetime(2024, 6, 2, 6, 0),
+) -> list[JourneyDetails]:
+    """
+    build a seeded list of distinct journeys, a minute apart
+
+    Args:
+        count (int): the number of journeys
+        stations (int): the number of stations in each journey
+        seed (int): the seed for the random station lists and waits
+        start (datetime): the departure date and time of the first journey
+
+    Returns:
+        list[JourneyDetails]
+    """
+    generator = random.Random(seed)
+    journeys = []
+    for idx in range(count):
+        station_list = generator.sample(STATION_IDENTIFIERS, stations)
+        wait_times = [generator.randint(0, 30) for _ in station_list[:-1]] + [None]
+        journeys.append(
+            JourneyDetails(
+                time_in_mins=sum(wait_times[:-1]) + (10 * (stations - 1)),
+                departure_date_time=start + timedelta(minutes=idx),
+                train_stations_with_wait=[
+                    {"station_id": x, "wait_time": y}
+                    for x, y in zip(station_list, wait_times)
+                ],
+            )
+        )
+    return journeys
+
+
+def time_call(function: Callable[[], Any], repeat: int = 1) -> float:
+    """
+    return the best wall clock time, in seconds, of repeated calls
+    """
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def environment() -> dict[str, str]:
+    """
+    describe where the benchmark was run, so results can be compared
+    """
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def argument_parser(description: str) -> argparse.ArgumentParser:
+    """
+    an argument parser with the options shared by every benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=description)
+    arg_parser.add_argument(
+        "--output",
+        dest="output",
+        help="write the json results to this file, rather than STDOUT",
+        required=False,
+    )
+    return arg_parser
+
+
+def write_results(name: str, results: list[dict[str, Any]], output: str = None) -> None:
+    """
+    write the results as json, to the output file or STDOUT
+    """
+    document = {"benchmark": name, "environment": environment(), "results": results}
+    if output:
+        with open(output, encoding="utf-8", mode="w") as fh:
+            json.dump(document, fh, indent=2)
+        return
+    json.dump(document, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,179 @@
+"""
+Compare two runs of the benchmark suite, and flag the regressions
+
+The result rows of each benchmark are matched on its key fields, and each
+metric is flagged if it got worse by more than the threshold, relative to
+the baseline, in the direction the suite declared for it. Nested results,
+such as {"reads": {"p50_ms": ...}}, are compared as "reads.p50_ms". Exits
+with status 1 if there is a regression, so it can fail a build
+
+python -m benchmarks.compare baseline.json current.json --threshold 0.2
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Union
+
+
+def flatten(row: dict[str, Any], prefix: str = "") -> dict[str, Any]:
+    """
+    flatten nested dicts into a single dict with dotted keys
+    """
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def row_key(row: dict[str, Any], key_fields: list[str]) -> str:
+    """
+    the fields that identify a result row between runs, as a string
+    """
+    return ", ".join(f"{x}={row[x]}" for x in key_fields if x in row)
+
+
+def compare_metric(
+    baseline: Union[float, None],
+    current: Union[float, None],
+    direction: str,
+    threshold: float,
+) -> Union[dict[str, Any], None]:
+    """
+    compare a metric between the runs
+
+    Returns:
+        {
+            "baseline": <float>,
+            "current": <float>,
+            "change": <float>, relative to the baseline
+            "regression": <bool>
+        }
+        or None if the metric is not in both runs
+    """
+    if not isinstance(baseline, (int, float)) or not isinstance(current, (int, float)):
+        return None
+    if baseline == 0:
+        return None
+    change = (current - baseline) / baseline
+    regression = change < -threshold if direction == "higher" else change > threshold
+    return {
+        "baseline": baseline,
+        "current": current,
+        "change": round(change, 4),
+        "regression": regression,
+    }
+
+
+def compare_documents(
+    baseline: dict[str, Any], current: dict[str, Any], threshold: float = 0.2
+) -> dict[str, Any]:
+    """
+    compare every metric of the benchmarks in both suite documents
+
+    Args:
+        baseline (dict[str, Any]): the suite document to compare against
+        current (dict[str, Any]): the suite document of this run
+        threshold (float): the relative change in a metric that is flagged
+
+    Returns:
+        {
+            "threshold": <float>,
+            "comparisons": [
+                {"benchmark": <str>, "row": <str>, "metric": <str>, ...compare_metric}
+            ],
+            "regressions": <list>, the comparisons that regressed
+            "missing": <list[str]>, the baseline rows not in this run
+        }
+    """
+    baseline_benchmarks = {x["benchmark"]: x for x in baseline["benchmarks"]}
+    comparisons, missing = [], []
+    for benchmark in current["benchmarks"]:
+        name = benchmark["benchmark"]
+        if name not in baseline_benchmarks:
+            continue
+        key_fields = benchmark["key_fields"]
+        baseline_rows = {
+            row_key(x, key_fields): flatten(x)
+            for x in baseline_benchmarks[name]["results"]
+        }
+        current_rows = {
+            row_key(x, key_fields): flatten(x) for x in benchmark["results"]
+        }
+        missing += [f"{name}: {x}" for x in baseline_rows if x not in current_rows]
+        for key, row in current_rows.items():
+            if key not in baseline_rows:
+                continue
+            for metric, direction in benchmark["metrics"].items():
+                comparison = compare_metric(
+                    baseline=baseline_rows[key].get(metric),
+                    current=row.get(metric),
+                    direction=direction,
+                    threshold=threshold,
+                )
+                if comparison is not None:
+                    comparisons.append(
+                        {"benchmark": name, "row": key, "metric": metric, **comparison}
+                    )
+    return {
+        "threshold": threshold,
+        "comparisons": comparisons,
+        "regressions": [x for x in comparisons if x["regression"]],
+        "missing": missing,
+    }
+
+
+def format_comparison(comparison: dict[str, Any]) -> str:
+    """
+    a line per regression, for the console
+    """
+    lines = [
+        f"{len(comparison['comparisons'])} metrics compared, "
+        f"{len(comparison['regressions'])} regressed by more than "
+        f"{comparison['threshold']:.0%}"
+    ]
+    for x in comparison["regressions"]:
+        lines.append(
+            f"REGRESSION {x['benchmark']} [{x['row']}] {x['metric']}: "
+            f"{x['baseline']} -> {x['current']} ({x['change']:+.1%})"
+        )
+    for x in comparison["missing"]:
+        lines.append(f"MISSING {x}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="flag regressions between two runs of the benchmark suite"
+    )
+    arg_parser.add_argument("baseline", help="the suite json document to compare against")
+    arg_parser.add_argument("current", help="the suite json document of this run")
+    arg_parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=0.2,
+        help="the relative change in a metric that is flagged",
+    )
+    arg_parser.add_argument(
+        "--output",
+        dest="output",
+        help="write the json comparison to this file",
+        required=False,
+    )
+    args = arg_parser.parse_args()
+    with open(args.baseline, encoding="utf-8") as fh:
+        baseline_document = json.load(fh)
+    with open(args.current, encoding="utf-8") as fh:
+        current_document = json.load(fh)
+    result = compare_documents(
+        baseline=baseline_document, current=current_document, threshold=args.threshold
+    )
+    if args.output:
+        with open(args.output, encoding="utf-8", mode="w") as fh:
+            json.dump(result, fh, indent=2)
+    print(format_comparison(result))
+    sys.exit(1 if result["regressions"] else 0)
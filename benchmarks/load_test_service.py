@@ -0,0 +1,206 @@
+"""
+Load test the journey service against a stub transport api
+
+The service runs in this process, with an empty database and a stub upstream
+serving a synthetic timetable. Keep-alive clients send a seeded mix of
+journeys, so that the share of requests answered from the caches is set by
+--distinct_journeys. The requests are sent twice, and the throughput and
+latency percentiles are reported for the cold and the warm pass
+
+python -m benchmarks.load_test_service --requests 2000 --concurrency 16
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from statistics import quantiles
+from urllib.parse import urlencode
+
+from src import defaults
+from src.data_model.api.client import TransportApiClient
+from src.data_model.api.transport_api import leg_memory_cache, set_client
+from src.data_model.get_train_information import journey_memory_cache
+from src.service import JourneyService
+from benchmarks.common import (
+    STATION_IDENTIFIERS,
+    argument_parser,
+    temporary_database,
+    write_results,
+)
+from benchmarks.stub_upstream import StubUpstream, SyntheticTimetable
+
+
+def journey_paths(distinct_journeys: int, stations: int, seed: int) -> list[str]:
+    """
+    build the seeded request paths for the distinct journeys
+    """
+    generator = random.Random(seed)
+    start = datetime(2024, 6, 2, 6, 0)
+    paths = []
+    for _ in range(distinct_journeys):
+        query = urlencode(
+            {
+                "departure_date_time": (
+                    start + timedelta(minutes=generator.randrange(0, 12 * 60))
+                ).strftime("%Y-%m-%dT%H:%M"),
+                "station_identifiers": ",".join(
+                    generator.sample(STATION_IDENTIFIERS, stations)
+                ),
+                "max_wait_time": 600,
+            }
+        )
+        paths.append(f"/journey?{query}")
+    return paths
+
+
+async def client(
+    port: int, paths: list[str], latencies: list[float], statuses: dict[int, int]
+) -> None:
+    """
+    send each request in turn on one keep-alive connection
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for path in paths:
+        started_at = time.perf_counter()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        headers = head.decode("latin-1").split("\r\n")
+        content_length = int(
+            next(
+                x.split(":", 1)[1]
+                for x in headers
+                if x.lower().startswith("content-length:")
+            )
+        )
+        json.loads(await reader.readexactly(content_length))
+        latencies.append(time.perf_counter() - started_at)
+        status = int(headers[0].split(" ")[1])
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+
+async def generate_load(port: int, paths: list[str], concurrency: int) -> dict:
+    """
+    split the requests between the concurrent clients, and time them
+    """
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    started_at = time.perf_counter()
+    await asyncio.gather(
+        *[
+            client(port, paths[idx::concurrency], latencies, statuses)
+            for idx in range(concurrency)
+        ]
+    )
+    duration_secs = time.perf_counter() - started_at
+    percentiles = quantiles(latencies, n=100)
+    return {
+        "duration_secs": round(duration_secs, 3),
+        "requests_per_sec": round(len(latencies) / duration_secs, 1),
+        "latency_ms": {
+            "p50": round(percentiles[49] * 1000, 2),
+            "p95": round(percentiles[94] * 1000, 2),
+            "p99": round(percentiles[98] * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "statuses": statuses,
+    }
+
+
+def run(
+    requests: int,
+    concurrency: int,
+    distinct_journeys: int,
+    stations: int,
+    upstream_latency_secs: float,
+    seed: int,
+) -> dict:
+    """
+    run the load test against a service with an empty database
+    """
+    generator = random.Random(seed)
+    distinct_paths = journey_paths(
+        distinct_journeys=distinct_journeys, stations=stations, seed=seed
+    )
+    paths = [generator.choice(distinct_paths) for _ in range(requests)]
+    base_url = defaults.BASE_URL
+    journey_memory_cache.clear()
+    leg_memory_cache.clear()
+    with temporary_database(), StubUpstream(
+        timetable=SyntheticTimetable(seed=seed), latency_secs=upstream_latency_secs
+    ) as upstream:
+        defaults.BASE_URL = upstream.url
+        # the stub has no quota, so there is no token bucket
+        set_client(TransportApiClient(pool_maxsize=concurrency))
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        service = JourneyService(port=0, max_concurrent_requests=concurrency)
+        asyncio.run_coroutine_threadsafe(service.start(), loop).result()
+        serving = asyncio.run_coroutine_threadsafe(service.serve_until_stopped(), loop)
+        result = {}
+        try:
+            # the same requests again, once the database and caches are warm
+            for phase in ("cold", "warm"):
+                upstream_requests = upstream.request_count
+                result[phase] = asyncio.run(
+                    generate_load(
+                        port=service.port, paths=paths, concurrency=concurrency
+                    )
+                )
+                result[phase]["upstream_requests"] = (
+                    upstream.request_count - upstream_requests
+                )
+        finally:
+            loop.call_soon_threadsafe(service.stop)
+            serving.result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            defaults.BASE_URL = base_url
+    result.update(
+        {
+            "requests": requests,
+            "concurrency": concurrency,
+            "distinct_journeys": distinct_journeys,
+            "stations": stations,
+            "upstream_latency_secs": upstream_latency_secs,
+        }
+    )
+    return result
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("load test the journey service")
+    arg_parser.add_argument("--requests", dest="requests", type=int, default=2000)
+    arg_parser.add_argument("--concurrency", dest="concurrency", type=int, default=16)
+    arg_parser.add_argument(
+        "--distinct_journeys", dest="distinct_journeys", type=int, default=200
+    )
+    arg_parser.add_argument("--stations", dest="stations", type=int, default=4)
+    arg_parser.add_argument(
+        "--upstream_latency_secs",
+        dest="upstream_latency_secs",
+        type=float,
+        default=0.05,
+    )
+    arg_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_results(
+        name="load_test_service",
+        results=[
+            run(
+                requests=args.requests,
+                concurrency=args.concurrency,
+                distinct_journeys=args.distinct_journeys,
+                stations=args.stations,
+                upstream_latency_secs=args.upstream_latency_secs,
+                seed=args.seed,
+            )
+        ],
+        output=args.output,
+    )
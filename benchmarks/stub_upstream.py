@@ -0,0 +1,191 @@
+"""
+A local stub of the transport api, serving a synthetic seeded timetable,
+or a recording of the transport api
+
+Every origin and destination has a train every headway_mins, with a journey
+time chosen from the seed, so any route can be answered without network access.
+A recording is served with the latency and errors of its ReplayClient, so the
+retries and connection pooling of the TransportApiClient are exercised too
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Union
+from urllib.parse import parse_qs, urlsplit
+
+from src.data_model.api.client import TransportApiError
+from src.data_model.api.replay import ReplayClient
+
+
+class SyntheticTimetable:
+    """
+    A seeded timetable, with a train every headway_mins between every pair of stations
+    """
+
+    def __init__(self, seed: int = 0, headway_mins: int = 10, routes_per_response: int = 5):
+        self.seed = seed
+        self.headway_mins = headway_mins
+        self.routes_per_response = routes_per_response
+
+    def journey_time_mins(self, origin_station: str, destination: str) -> int:
+        """
+        the journey time between two stations, the same on every request
+        """
+        return random.Random(f"{self.seed}:{origin_station}:{destination}").randint(3, 40)
+
+    def offset_mins(self, origin_station: str, destination: str) -> int:
+        """
+        the minutes past each headway that the trains depart
+        """
+        return random.Random(f"{self.seed}:{destination}:{origin_station}").randrange(
+            self.headway_mins
+        )
+
+    def response(
+        self, origin_station: str, destination: str, departures_from: datetime
+    ) -> dict:
+        """
+        the api response for the next departures from departures_from
+        """
+        journey_time_mins = self.journey_time_mins(origin_station, destination)
+        offset_mins = self.offset_mins(origin_station, destination)
+        minute_of_day = (departures_from.hour * 60) + departures_from.minute
+        first_slot = -(-(minute_of_day - offset_mins) // self.headway_mins)
+        day_start = departures_from.replace(hour=0, minute=0, second=0, microsecond=0)
+        routes = []
+        for slot in range(first_slot, first_slot + self.routes_per_response):
+            departure = day_start + timedelta(
+                minutes=(slot * self.headway_mins) + offset_mins
+            )
+            arrival = departure + timedelta(minutes=journey_time_mins)
+            routes.append(
+                {
+                    "duration": f"{journey_time_mins // 60:02d}:{journey_time_mins % 60:02d}:00",
+                    "departure_datetime": departure.strftime("%Y-%m-%dT%H:%M:%S+01:00"),
+                    "arrival_datetime": arrival.strftime("%Y-%m-%dT%H:%M:%S+01:00"),
+                }
+            )
+        return {"source": "stub", "routes": routes}
+
+    def query_response(self, query_params: dict) -> dict:
+        """
+        the api response for the query parameters built by transport_api.build_query_params
+        """
+        return self.response(
+            origin_station=query_params["from"].removeprefix("crs:"),
+            destination=query_params["to"].removeprefix("crs:"),
+            departures_from=datetime.strptime(
+                f"{query_params['date']} {query_params['time']}", "%Y-%m-%d %H:%M"
+            ),
+        )
+
+
+class SyntheticTimetableClient:
+    """
+    answer the requests of transport_api from the timetable in process,
+    a stub of get_query without any http, for transport_api.set_client
+    """
+
+    def __init__(self, timetable: SyntheticTimetable, latency_secs: float = 0.0):
+        self.timetable = timetable
+        self.latency_secs = latency_secs
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def get_json(self, url: str, query_params: dict) -> dict:
+        with self.lock:
+            self.request_count += 1
+        if self.latency_secs:
+            time.sleep(self.latency_secs)
+        return self.timetable.query_response(query_params)
+
+    def close(self) -> None:
+        pass
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """
+    serve the timetable in the format of the transport api public_journey.json
+    """
+
+    protocol_version = "HTTP/1.1"
+    # the headers and body are written separately, so without this a
+    # keep-alive client waits on a delayed ack for every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        params = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        with server.lock:
+            server.request_count += 1
+        if server.latency_secs:
+            time.sleep(server.latency_secs)
+        status_code = 200
+        if server.replay is not None:
+            try:
+                response = server.replay.response(query_params=params)
+            except TransportApiError as err:
+                status_code = err.status_code or 500
+                response = {"error": str(err)}
+        else:
+            response = server.timetable.query_response(params)
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubUpstream:
+    """
+    run the stub transport api in a background thread, serving the
+    timetable, or the recording of the replay client if one is given
+    """
+
+    def __init__(
+        self,
+        timetable: Union[SyntheticTimetable, None] = None,
+        latency_secs: float = 0.0,
+        replay: Union[ReplayClient, None] = None,
+    ):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubUpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.timetable = timetable or SyntheticTimetable()
+        self.server.replay = replay
+        self.server.latency_secs = latency_secs
+        self.server.lock = threading.Lock()
+        self.server.request_count = 0
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        """
+        the url to use in place of defaults.BASE_URL
+        """
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v3/uk/public_journey.json"
+
+    @property
+    def request_count(self) -> int:
+        """
+        the number of requests the stub has served
+        """
+        return self.server.request_count
+
+    def __enter__(self) -> "StubUpstream":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -0,0 +1,320 @@
+"""
+Run the benchmarks together, and write their results as one json document
+
+Each benchmark is registered with the fields that identify a row of its
+results, and the metrics that benchmarks.compare checks, each with whether
+higher or lower is better. Each benchmark is run repeat times, and the
+best value of each metric kept, as the noise of a single run is mostly
+slowdowns. The quick profile runs in a minute or two, for
+every change, and the full profile covers route lengths up to 20 stations
+and databases of up to a million journeys
+
+python -m benchmarks.suite --profile quick --output current.json
+python -m benchmarks.suite --repeat 3 --output current.json --compare baseline.json
+"""
+
+import json
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from benchmarks import (
+    bench_cli_startup,
+    bench_compact_schema,
+    bench_datetime_parsing,
+    bench_instrumentation,
+    bench_journey_memory,
+    bench_pipeline,
+    bench_replay,
+    bench_route_times,
+    bench_route_trie,
+    bench_store_journeys,
+    bench_timetable,
+)
+from benchmarks.common import argument_parser, environment
+from benchmarks.compare import compare_documents, format_comparison, row_key
+
+# p99 is reported but not compared, as a short run gives too few samples for it
+LATENCY_METRICS = {"p50_ms": "lower"}
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    """
+    A benchmark, with its arguments for each profile
+
+    key_fields are the fields of a result row that identify it between runs,
+    and metrics maps each compared field to "higher" or "lower", the better
+    direction. A benchmark without arguments for a profile is not run in it
+    """
+
+    run: Callable[..., list[dict[str, Any]]]
+    profiles: dict[str, dict[str, Any]]
+    key_fields: list[str]
+    metrics: dict[str, str]
+
+
+BENCHMARKS = {
+    "pipeline": Benchmark(
+        run=bench_pipeline.run,
+        profiles={
+            "quick": {
+                "sections": bench_pipeline.SECTIONS,
+                "journey_count": 50,
+                "station_counts": [2, 5, 10, 20],
+                "thread_counts": [1, 4, 16],
+                "db_sizes": [1_000, 10_000],
+                "lookups": 200,
+                "concurrency_latency_ms": 2.0,
+                "repeat": 20,
+            },
+            "full": {
+                "sections": bench_pipeline.SECTIONS,
+                "journey_count": 500,
+                "station_counts": [2, 5, 10, 20],
+                "thread_counts": [1, 4, 16, 64],
+                "db_sizes": [1_000, 10_000, 100_000, 1_000_000],
+                "lookups": 2_000,
+                "concurrency_latency_ms": 5.0,
+                "repeat": 200,
+            },
+        },
+        key_fields=["section", "cache", "stations", "threads", "operation", "db_size"],
+        metrics={
+            "journeys_per_sec": "higher",
+            "calls_per_sec": "higher",
+            "usecs_per_response": "lower",
+            **LATENCY_METRICS,
+        },
+    ),
+    "store_journeys": Benchmark(
+        run=bench_store_journeys.run,
+        profiles={
+            "quick": {"journey_count": 1_000, "batch_size": 1_000},
+            "full": {"journey_count": 10_000, "batch_size": 1_000},
+        },
+        key_fields=["path"],
+        metrics={"rows_per_sec": "higher"},
+    ),
+    "compact_schema": Benchmark(
+        run=bench_compact_schema.run,
+        profiles={
+            "quick": {"journey_count": 20_000, "stations": 4, "lookups": 1_000, "seed": 0},
+            "full": {
+                "journey_count": 1_000_000,
+                "stations": 4,
+                "lookups": 5_000,
+                "seed": 0,
+            },
+        },
+        key_fields=["schema", "journeys"],
+        metrics={
+            "bytes_per_journey": "lower",
+            "lookups_per_sec": "higher",
+            "sub_route_lookups_per_sec": "higher",
+        },
+    ),
+    "timetable": Benchmark(
+        run=bench_timetable.run,
+        profiles={
+            "quick": {"route_count": 500, "stations": 4, "seed": 0},
+            "full": {"route_count": 5_000, "stations": 10, "seed": 0},
+        },
+        key_fields=["path"],
+        metrics={"routes_per_sec": "higher"},
+    ),
+    "route_times": Benchmark(
+        run=bench_route_times.run,
+        profiles={
+            "quick": {"departure_time_count": 48, "stations": 4, "interval_mins": 5},
+            "full": {"departure_time_count": 288, "stations": 10, "interval_mins": 5},
+        },
+        key_fields=["path"],
+        metrics={"usecs_per_departure_time": "lower"},
+    ),
+    "route_trie": Benchmark(
+        run=bench_route_trie.run,
+        profiles={
+            "quick": {
+                "route_count": 50,
+                "stations": 6,
+                "branching": 3,
+                "latency_ms": 2.0,
+                "seed": 0,
+            },
+            "full": {
+                "route_count": 500,
+                "stations": 10,
+                "branching": 3,
+                "latency_ms": 5.0,
+                "seed": 0,
+            },
+        },
+        key_fields=["path"],
+        metrics={"routes_per_sec": "higher"},
+    ),
+    "datetime_parsing": Benchmark(
+        run=bench_datetime_parsing.run,
+        profiles={
+            "quick": {"corpus": bench_datetime_parsing.RECORDED_RESPONSES, "repeat": 20},
+            "full": {"corpus": bench_datetime_parsing.RECORDED_RESPONSES, "repeat": 200},
+        },
+        key_fields=["parser"],
+        metrics={"usecs_per_datetime": "lower", "usecs_per_response": "lower"},
+    ),
+    "journey_memory": Benchmark(
+        run=bench_journey_memory.run,
+        profiles={
+            "quick": {"journey_count": 10_000, "stations": 4},
+            "full": {"journey_count": 100_000, "stations": 10},
+        },
+        key_fields=["layout"],
+        metrics={"bytes_per_journey": "lower"},
+    ),
+    "replay": Benchmark(
+        run=bench_replay.run,
+        profiles={
+            "full": {
+                "journey_count": 200,
+                "stations": 4,
+                "seed": 0,
+                "recording": None,
+                "latency_ms": 5.0,
+                "error_rate": 0.0,
+            },
+        },
+        key_fields=["transport"],
+        metrics={"journeys_per_sec": "higher"},
+    ),
+    "instrumentation": Benchmark(
+        run=bench_instrumentation.run,
+        profiles={
+            "quick": {"calls": 50_000, "journey_count": 50, "seed": 0},
+            "full": {"calls": 500_000, "journey_count": 200, "seed": 0},
+        },
+        key_fields=["hook", "exporter"],
+        metrics={"nsecs_per_call": "lower"},
+    ),
+    "cli_startup": Benchmark(
+        run=bench_cli_startup.run,
+        profiles={"quick": {"runs": 5}, "full": {"runs": 20}},
+        key_fields=["command"],
+        metrics={"best_ms": "lower"},
+    ),
+}
+
+
+def best_results(
+    runs: list[list[dict[str, Any]]], key_fields: list[str], metrics: dict[str, str]
+) -> list[dict[str, Any]]:
+    """
+    the rows of the first run, with the best value of each metric over all the runs
+    """
+    results = []
+    for row in runs[0]:
+        key = row_key(row, key_fields)
+        same_rows = [x for run in runs for x in run if row_key(x, key_fields) == key]
+        best_row = dict(row)
+        for metric, direction in metrics.items():
+            values = [x[metric] for x in same_rows if x.get(metric) is not None]
+            if values:
+                best_row[metric] = max(values) if direction == "higher" else min(values)
+        results.append(best_row)
+    return results
+
+
+def run_suite(profile: str, names: list[str], repeat: int = 1) -> dict[str, Any]:
+    """
+    run the named benchmarks with the arguments of the profile, repeat times
+
+    Returns:
+        {
+            "suite": <str>, the profile
+            "environment": <dict>,
+            "benchmarks": [
+                {
+                    "benchmark": <str>,
+                    "arguments": <dict>,
+                    "key_fields": <list[str]>,
+                    "metrics": <dict[str, str]>,
+                    "repeat": <int>,
+                    "secs": <float>,
+                    "results": <list[dict]>, with the best of each metric
+                }
+            ]
+        }
+    """
+    document = {"suite": profile, "environment": environment(), "benchmarks": []}
+    for name in names:
+        benchmark = BENCHMARKS[name]
+        if profile not in benchmark.profiles:
+            continue
+        arguments = benchmark.profiles[profile]
+        print(f"running {name}", file=sys.stderr)
+        started_at = time.perf_counter()
+        runs = [benchmark.run(**arguments) for _ in range(repeat)]
+        document["benchmarks"].append(
+            {
+                "benchmark": name,
+                "arguments": arguments,
+                "key_fields": benchmark.key_fields,
+                "metrics": benchmark.metrics,
+                "repeat": repeat,
+                "secs": round(time.perf_counter() - started_at, 2),
+                "results": best_results(
+                    runs, key_fields=benchmark.key_fields, metrics=benchmark.metrics
+                ),
+            }
+        )
+    return document
+
+
+if __name__ == "__main__":
+    arg_parser = argument_parser("run the benchmarks, and compare with a baseline")
+    arg_parser.add_argument(
+        "--profile", dest="profile", choices=["quick", "full"], default="quick"
+    )
+    arg_parser.add_argument(
+        "--benchmarks",
+        dest="benchmarks",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+    )
+    arg_parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=1,
+        help="run each benchmark this many times, keeping the best of each metric",
+    )
+    arg_parser.add_argument(
+        "--compare",
+        dest="compare",
+        help="a suite json document to flag regressions against",
+    )
+    arg_parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=0.2,
+        help="the relative change in a metric that is flagged",
+    )
+    args = arg_parser.parse_args()
+    document = run_suite(
+        profile=args.profile, names=args.benchmarks, repeat=args.repeat
+    )
+    if args.output:
+        with open(args.output, encoding="utf-8", mode="w") as fh:
+            json.dump(document, fh, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            comparison = compare_documents(
+                baseline=json.load(fh), current=document, threshold=args.threshold
+            )
+        print(format_comparison(comparison), file=sys.stderr)
+        sys.exit(1 if comparison["regressions"] else 0)
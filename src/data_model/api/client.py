@@ -0,0 +1,211 @@
+"""
+module for a reusable http client for the transport api
+
+The client keeps a pool of connections open between requests, retries
+failed requests with a jittered backoff, honours Retry-After on 429 and 503
+responses, and limits its own request rate with a token bucket
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Protocol, Union
+import requests
+from requests.adapters import HTTPAdapter
+from src.data_model.instrumentation import increment
+from src import defaults
+
+# statuses that are worth retrying, as the next attempt may succeed
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TransportApiError(Exception):
+    """
+    raised when the transport api does not return a successful response
+    """
+
+    def __init__(self, message: str, status_code: Union[int, None] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ApiClient(Protocol):
+    """
+    What transport_api needs of a client. The TransportApiClient, and the
+    recording and replay clients in replay.py, all provide it
+    """
+
+    request_count: int
+
+    def get_json(self, url: str, query_params: dict[str, Any]) -> dict[str, Any]: ...
+
+    def close(self) -> None: ...
+
+
+class TokenBucket:
+    """
+    A token bucket, allowing bursts of up to capacity requests,
+    refilled at rate_per_second
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        capacity: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        take a token, waiting for one to be available
+
+        Returns:
+            float : the time waited in seconds
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + ((now - self.updated_at) * self.rate_per_second),
+            )
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            # the token is reserved, so wait until it would have been refilled
+            wait_secs = -self.tokens / self.rate_per_second
+        self.sleep(wait_secs)
+        return wait_secs
+
+
+class TransportApiClient:
+    """
+    A client for the transport api, reusing pooled keep-alive connections
+    """
+
+    def __init__(
+        self,
+        headers: Union[dict[str, str], None] = None,
+        pool_maxsize: int = defaults.HTTP_POOL_MAXSIZE,
+        timeout_secs: float = defaults.HTTP_TIMEOUT_SECS,
+        max_retries: int = defaults.HTTP_MAX_RETRIES,
+        backoff_secs: float = defaults.HTTP_BACKOFF_SECS,
+        max_backoff_secs: float = defaults.HTTP_MAX_BACKOFF_SECS,
+        token_bucket: Union[TokenBucket, None] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.timeout_secs = timeout_secs
+        self.max_retries = max_retries
+        self.backoff_secs = backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.token_bucket = token_bucket
+        self.sleep = sleep
+        # the number of http requests made, including retries
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        # retries are handled here, so that Retry-After and the token bucket apply
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+
+    def get_json(self, url: str, query_params: dict[str, Any]) -> dict[str, Any]:
+        """
+        make a request and return the json response, retrying
+        connection errors and retryable statuses
+
+        Args:
+            url (str): the url to request
+            query_params (dict[str, Any]): the query parameters
+
+        Returns:
+            dict[str, Any] : the json response
+        """
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            if self.token_bucket is not None:
+                self.token_bucket.acquire()
+            with self.lock:
+                self.request_count += 1
+            increment("api.http_requests")
+            if attempt:
+                increment("api.retries")
+            try:
+                response = self.session.get(
+                    url,
+                    params=query_params,
+                    timeout=self.timeout_secs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if is_last_attempt:
+                    raise TransportApiError(
+                        "Problem connecting to the Transport API"
+                    ) from err
+                self.sleep(self.backoff_delay(attempt=attempt))
+                continue
+
+            if response.status_code <= 200:
+                return response.json()
+            if is_last_attempt or response.status_code not in RETRY_STATUS_CODES:
+                raise TransportApiError(
+                    "Problem connecting to the Transport API",
+                    status_code=response.status_code,
+                )
+            retry_after = self.retry_after_delay(
+                response.headers.get("Retry-After")
+            )
+            if retry_after is None:
+                retry_after = self.backoff_delay(attempt=attempt)
+            self.sleep(retry_after)
+
+        raise TransportApiError("Problem connecting to the Transport API")
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        the exponential backoff for the attempt, with full jitter so that
+        clients retrying at the same time spread out
+        """
+        return random.uniform(
+            0, min(self.max_backoff_secs, self.backoff_secs * (2**attempt))
+        )
+
+    def retry_after_delay(self, retry_after: Union[str, None]) -> Union[float, None]:
+        """
+        the delay requested by a Retry-After header, in either seconds or
+        as an http date, capped at the max_backoff_secs
+
+        Returns:
+            float : the delay in seconds, or None if there is no valid header
+        """
+        if not retry_after:
+            return None
+        try:
+            delay_secs = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return None
+            # an http date in -0000 is parsed without a timezone, but is in utc
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            delay_secs = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        return min(self.max_backoff_secs, max(0.0, delay_secs))
+
+    def close(self) -> None:
+        """
+        close the pooled connections
+        """
+        self.session.close()
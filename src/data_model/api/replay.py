@@ -0,0 +1,191 @@
+"""
+module to record the transport api, and replay the recording offline
+
+A RecordingClient wraps a client and appends every request and its response,
+or its error, to a gzipped json lines file. A ReplayClient answers the same
+requests from that file, with configurable latency and injected errors, so
+the whole retrieval pipeline can be load tested and benchmarked without the
+network. Either can be passed to transport_api.set_client, or used for every
+client by setting defaults.API_RECORD_PATH or defaults.API_REPLAY_PATH
+"""
+
+import gzip
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Iterator, Union
+from src.data_model.api.client import ApiClient, TransportApiError
+
+
+def request_key(query_params: dict[str, Any]) -> str:
+    """
+    the key of a request, the same whether the parameters were
+    built by transport_api or parsed from a url query string
+    """
+    return json.dumps({k: str(v) for k, v in query_params.items()}, sort_keys=True)
+
+
+def read_recording(path: str) -> Iterator[dict[str, Any]]:
+    """
+    read each recorded request from a gzipped json lines file
+
+    Yields:
+        {
+            "params": <dict>,
+            "status_code": <int>,
+            "latency_secs": <float>,
+            "response": <dict>, or "error": <str> if the request failed
+        }
+    """
+    with gzip.open(path, mode="rt", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RecordingClient:
+    """
+    A client that records every request made through the client it wraps
+    """
+
+    def __init__(self, client: ApiClient, path: str):
+        self.client = client
+        self.path = path
+        self.lock = threading.Lock()
+        # appended to, so a recording can be built up over many runs
+        self.file = gzip.open(path, mode="at", encoding="utf-8")
+
+    @property
+    def request_count(self) -> int:
+        return self.client.request_count
+
+    def get_json(self, url: str, query_params: dict[str, Any]) -> dict[str, Any]:
+        """
+        make the request with the wrapped client, and record it
+        """
+        started_at = time.perf_counter()
+        try:
+            response = self.client.get_json(url=url, query_params=query_params)
+        except TransportApiError as err:
+            self.record(
+                {
+                    "params": query_params,
+                    "status_code": err.status_code,
+                    "latency_secs": time.perf_counter() - started_at,
+                    "error": str(err),
+                }
+            )
+            raise
+        self.record(
+            {
+                "params": query_params,
+                "status_code": 200,
+                "latency_secs": time.perf_counter() - started_at,
+                "response": response,
+            }
+        )
+        return response
+
+    def record(self, recorded_request: dict[str, Any]) -> None:
+        """
+        append a request to the recording
+        """
+        line = json.dumps(recorded_request, default=str) + "\n"
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line)
+
+    def close(self) -> None:
+        """
+        finish the recording, and close the wrapped client
+        """
+        with self.lock:
+            self.file.close()
+        self.client.close()
+
+
+class ReplayClient:
+    """
+    A client that answers requests from a recording, rather than the api.
+
+    Each request waits latency_secs, plus up to latency_jitter_secs, or the
+    latency it was recorded with if use_recorded_latency is set. A fraction
+    error_rate of the requests fail with error_status_code, and a request
+    that was not recorded fails with a 404, as the api would for an unknown route
+    """
+
+    def __init__(
+        self,
+        path: str,
+        latency_secs: float = 0.0,
+        latency_jitter_secs: float = 0.0,
+        use_recorded_latency: bool = False,
+        error_rate: float = 0.0,
+        error_status_code: int = 503,
+        seed: Union[int, None] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.path = path
+        self.latency_secs = latency_secs
+        self.latency_jitter_secs = latency_jitter_secs
+        self.use_recorded_latency = use_recorded_latency
+        self.error_rate = error_rate
+        self.error_status_code = error_status_code
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        # the number of requests answered, including injected errors
+        self.request_count = 0
+        self.lock = threading.Lock()
+        # the latest recording of each request is replayed
+        self.recordings = {
+            request_key(x["params"]): x for x in read_recording(path)
+        }
+
+    def __len__(self) -> int:
+        return len(self.recordings)
+
+    def get_json(self, url: str, query_params: dict[str, Any]) -> dict[str, Any]:
+        """
+        answer the request from the recording, whatever the url
+        """
+        with self.lock:
+            self.request_count += 1
+        return self.response(query_params=query_params)
+
+    def response(self, query_params: dict[str, Any]) -> dict[str, Any]:
+        """
+        the recorded response to the request, after the latency
+
+        Raises:
+            TransportApiError: if the request failed when it was recorded,
+                was not recorded, or an error was injected
+        """
+        recording = self.recordings.get(request_key(query_params))
+        with self.lock:
+            delay_secs = self.latency_secs + self.random.uniform(
+                0, self.latency_jitter_secs
+            )
+            is_injected_error = self.random.random() < self.error_rate
+        if self.use_recorded_latency and recording is not None:
+            delay_secs = recording["latency_secs"]
+        if delay_secs > 0:
+            self.sleep(delay_secs)
+
+        if is_injected_error:
+            raise TransportApiError(
+                "Problem connecting to the Transport API",
+                status_code=self.error_status_code,
+            )
+        if recording is None:
+            raise TransportApiError(
+                "Problem connecting to the Transport API", status_code=404
+            )
+        if "error" in recording:
+            raise TransportApiError(
+                recording["error"], status_code=recording["status_code"]
+            )
+        return recording["response"]
+
+    def close(self) -> None:
+        pass
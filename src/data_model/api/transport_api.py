@@ -3,81 +3,443 @@ module to connect to the transport api
 and retrieve journey details from there
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from math import floor
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any, Union
-import requests
-from dateutil import parser
-from src.data_model.dataclasses import JourneyDetails, JourneyRequest
+import threading
+import atexit
+from src.data_model.api.client import ApiClient, TokenBucket, TransportApiClient
+from src.data_model.api.replay import RecordingClient, ReplayClient
+from src.data_model.memory_cache import CacheStatistics, MemoryCache
+from src.data_model.instrumentation import in_current_span, increment, traced
+from src.data_model.single_flight import SingleFlight
+from src.data_model.date_times import parse_datetime
+from src.data_model.timetable import TimetableGraph
+from src.data_model.dataclasses import JourneyDetails, JourneyRequest, StationWaits
+from src.data_model.db.trains import (
+    departure_order,
+    store_leg,
+    store_departures,
+    store_failed_leg,
+    retrieve_failed_leg,
+    retrieve_next_departure,
+    retrieve_leg as retrieve_leg_from_database,
+)
 from src import defaults
 
 # ideally these should be environment variables
 API_ID = "********"
 API_KEY = "********************************"
 
+_client: Union[ApiClient, None] = None
+_client_lock = threading.Lock()
 
-def retrieve_journey(journey_request: JourneyRequest) -> JourneyDetails:
+# concurrent requests for the same leg, or window, share one lookup
+_leg_flights = SingleFlight()
+_window_flights = SingleFlight()
+
+leg_memory_cache = MemoryCache(
+    max_size=defaults.MEMORY_CACHE_MAX_LEGS,
+    ttl_secs=defaults.MEMORY_CACHE_TTL_SECS,
+)
+
+# the stored departures of every route retrieved, so legs
+# can be answered without a query
+timetable_graph = TimetableGraph()
+
+# hits are the legs answered as failed without requesting the api
+failed_leg_statistics = CacheStatistics()
+_failed_leg_statistics_lock = threading.Lock()
+
+
+class NoJourneyFound(Exception):
+    """
+    raised when the api has no journey for a leg. These are stored, so the
+    leg is not requested again until they are out of date
+    """
+
+
+@traced("api.retrieve_journey")
+def retrieve_journey(
+    journey_request: JourneyRequest,
+    prefetch: bool = defaults.PREFETCH_LEGS,
+) -> JourneyDetails:
     """
     retrieve a journey from the transport api based on the station list provided.
+    The legs are retrieved in order, stopping at the first station where the
+    wait is longer than the max wait time, as the later legs are not needed.
+    The stored departures of the route are loaded into the timetable graph,
+    so that only the legs it does not cover are looked up any further
 
     Args:
         journey_request (JourneyRequest): the journey request details
+        prefetch (bool): request every leg concurrently before resolving the journey
     Returns:
         JourneyDetails
 
     """
+    if prefetch:
+        prefetch_legs(journey_request=journey_request)
 
+    station_identifiers = journey_request.station_identifiers
+    timetable_graph.load(pairs=list(zip(station_identifiers, station_identifiers[1:])))
     next_departure_date_time = journey_request.departure_date_time
-    travel_information_responses: dict[str, [dict[str, Any]]] = {}
-    for idx, station_id in enumerate(journey_request.station_identifiers):
-        travel_information_responses[station_id] = {
-            "origin": station_id,
-            "destination": None,
-            "response": None,
-        }
-        destination = None
-        try:
-            destination = journey_request.station_identifiers[idx + 1]
-        except IndexError:
-            pass
-        travel_information_responses[station_id]["destination"] = destination
-        if not destination:
-            continue
-        query_params = build_query_params(
+    exceeded_wait_station_order = None
+    # the processed leg departing from each station, in order
+    processed_responses: list[dict[str, Any]] = []
+    for idx, (station_id, destination) in enumerate(
+        zip(station_identifiers, station_identifiers[1:])
+    ):
+        processed_response = retrieve_leg(
             origin_station=station_id,
             destination=destination,
-            departures_from=next_departure_date_time,
-        )
-        response = get_query(url=defaults.BASE_URL, query_params=query_params)
-        processed_response = process_response(
-            response=response,
             earliest_departure_time=next_departure_date_time,
         )
-        travel_information_responses[station_id]["response"] = processed_response
+        processed_responses.append(processed_response)
+        if processed_response["wait_time"] > journey_request.max_wait_time:
+            exceeded_wait_station_order = idx
+            break
         next_departure_date_time = processed_response["arrival_time"]
 
     time_in_mins: int = 0
-    train_stations_with_wait: list[dict[str, Any]] = []
-    for station_id in journey_request.station_identifiers:
-        travel_info = travel_information_responses[station_id].get("response")
-        if not travel_info:
-            train_stations_with_wait.append(
-                {"station_id": station_id, "wait_time": None}
-            )
-            continue
-        train_stations_with_wait.append(
-            {"station_id": station_id, "wait_time": travel_info.get("wait_time")}
-        )
+    for travel_info in processed_responses:
         time_in_mins += travel_info.get("journey_time", 0)
         time_in_mins += travel_info.get("wait_time", 0)
+    wait_times = [x.get("wait_time") for x in processed_responses]
+    train_stations_with_wait = StationWaits.from_lists(
+        station_ids=station_identifiers,
+        wait_times=wait_times + [None] * (len(station_identifiers) - len(wait_times)),
+    )
+    # the arrival at each station reached, including the station after a wait
+    # that was too long, as that leg was retrieved
+    arrival_offsets_secs = [0] + [
+        int((x["arrival_time"] - journey_request.departure_date_time).total_seconds())
+        for x in processed_responses
+    ]
 
     return JourneyDetails(
         time_in_mins=time_in_mins,
         departure_date_time=journey_request.departure_date_time,
         train_stations_with_wait=train_stations_with_wait,
+        exceeded_wait_station_order=exceeded_wait_station_order,
+        arrival_offsets_secs=arrival_offsets_secs
+        + [None] * (len(station_identifiers) - len(arrival_offsets_secs)),
     )
 
 
+@traced("api.prefetch_legs")
+def prefetch_legs(
+    journey_request: JourneyRequest,
+    offsets_mins: tuple[int, ...] = defaults.PREFETCH_OFFSETS_MINS,
+    max_workers: int = defaults.PREFETCH_WORKERS,
+) -> None:
+    """
+    speculatively request the legs of the journey concurrently, and store the
+    departures, so that the journey can then be resolved leg by leg from them.
+
+    This is done in rounds. In each round, the first leg not resolved from
+    the stored departures is requested from the arrival at its station, and
+    the later legs concurrently with it, for windows starting at each offset
+    after the earliest they could depart. That is the arrival, plus the
+    shortest journey time returned so far for each leg in between. The stored
+    departures then resolve as many legs as they cover, so the next round
+    starts from a later arrival. Once every leg is resolved, a wait is longer
+    than the max wait time, or the leg from the arrival is not returned by
+    the api, no more is requested, and the journey is resolved as usual
+
+    Args:
+        journey_request (JourneyRequest): the journey request details
+        offsets_mins (tuple[int, ...]): the offsets for the windows of the later legs
+        max_workers (int): the maximum number of concurrent requests
+    """
+    station_identifiers = journey_request.station_identifiers
+    pairs = list(zip(station_identifiers, station_identifiers[1:]))
+    # the shortest journey time returned for each origin and destination
+    min_journey_times: dict[tuple[str, str], int] = {}
+    requested: set[tuple[str, str, datetime]] = set()
+    # the first leg not resolved, and the arrival at the station it departs from
+    first_idx = 0
+    arrival_date_time = journey_request.departure_date_time
+
+    def fetch_window(window: tuple[str, str, datetime]) -> Union[dict[str, Any], None]:
+        origin_station, destination, window_start = window
+        query_params = build_query_params(
+            origin_station=origin_station,
+            destination=destination,
+            departures_from=window_start,
+        )
+        try:
+            return _window_flights.do(
+                window,
+                lambda: get_query(url=defaults.BASE_URL, query_params=query_params),
+            )
+        except Exception:
+            # speculative, the leg is requested again when the journey is resolved
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while first_idx < len(pairs):
+            windows: set[tuple[str, str, datetime]] = set()
+            earliest_departure_date_time = arrival_date_time
+            for idx in range(first_idx, len(pairs)):
+                origin_station, destination = pairs[idx]
+                for offset_mins in offsets_mins if idx > first_idx else (0,):
+                    window = (
+                        origin_station,
+                        destination,
+                        earliest_departure_date_time + timedelta(minutes=offset_mins),
+                    )
+                    if window not in requested and (
+                        retrieve_next_departure(
+                            origin_station=origin_station,
+                            destination=destination,
+                            earliest_departure_date_time=window[2],
+                        )
+                        is None
+                    ):
+                        windows.add(window)
+                earliest_departure_date_time += timedelta(
+                    minutes=min_journey_times.get(pairs[idx], 0)
+                )
+            windows_to_fetch = sorted(windows)
+            requested.update(windows_to_fetch)
+            responses = list(
+                executor.map(in_current_span(fetch_window), windows_to_fetch)
+            )
+
+            # stored once every request has returned, so that there is a single writer
+            for (origin_station, destination, window_start), response in zip(
+                windows_to_fetch, responses
+            ):
+                if not response or not response.get("routes"):
+                    continue
+                departures = parse_routes(response=response)
+                record_departures(
+                    origin_station=origin_station,
+                    destination=destination,
+                    window_start_date_time=window_start,
+                    departures=departures,
+                )
+                journey_time = min(x["journey_time"] for x in departures)
+                min_journey_times[(origin_station, destination)] = min(
+                    journey_time,
+                    min_journey_times.get((origin_station, destination), journey_time),
+                )
+
+            round_first_idx = first_idx
+            while first_idx < len(pairs):
+                origin_station, destination = pairs[first_idx]
+                departure = retrieve_next_departure(
+                    origin_station=origin_station,
+                    destination=destination,
+                    earliest_departure_date_time=arrival_date_time,
+                )
+                if departure is None:
+                    break
+                leg = process_departure(
+                    earliest_departure_time=arrival_date_time, departure=departure
+                )
+                if leg["wait_time"] > journey_request.max_wait_time:
+                    # the later legs are not needed
+                    return
+                arrival_date_time = leg["arrival_time"]
+                first_idx += 1
+            if first_idx == round_first_idx:
+                # the window from the arrival has been requested, and did not
+                # return the leg, so it is left to be requested as usual
+                return
+
+
+@traced("api.retrieve_leg")
+def retrieve_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_time: datetime,
+) -> dict[str, Any]:
+    """
+    retrieve a single leg, looking in the leg cache and then the stored
+    departures before requesting it from the transport api. Every departure
+    returned by the api is stored, so that later requests within that
+    window do not need to request it again. Concurrent requests for the
+    same leg share one lookup
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_time (datetime): the earliest the train can depart
+
+    Returns:
+        the processed leg, in the format returned by process_response
+    """
+    return _leg_flights.do(
+        (origin_station, destination, earliest_departure_time),
+        lambda: _retrieve_leg(
+            origin_station=origin_station,
+            destination=destination,
+            earliest_departure_time=earliest_departure_time,
+        ),
+    )
+
+
+def _retrieve_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_time: datetime,
+) -> dict[str, Any]:
+    """
+    retrieve a single leg from the caches, or the api if it is not cached
+    """
+    memory_cache_key = (origin_station, destination, earliest_departure_time)
+    processed_response = leg_memory_cache.get(memory_cache_key)
+    if processed_response is not None:
+        increment("leg_cache.memory_hits")
+        return processed_response
+
+    departure = timetable_graph.next_departure(
+        origin_station=origin_station,
+        destination=destination,
+        earliest_departure_date_time=earliest_departure_time,
+    )
+    if departure is not None:
+        # already stored, as the departures are
+        processed_response = process_departure(
+            earliest_departure_time=earliest_departure_time,
+            departure=departure,
+        )
+        leg_memory_cache.set(memory_cache_key, processed_response)
+        increment("leg_cache.timetable_hits")
+        return processed_response
+
+    processed_response = retrieve_leg_from_database(
+        origin_station=origin_station,
+        destination=destination,
+        earliest_departure_date_time=earliest_departure_time,
+    )
+    if processed_response is not None:
+        leg_memory_cache.set(memory_cache_key, processed_response)
+        increment("leg_cache.database_hits")
+        return processed_response
+
+    departure = retrieve_next_departure(
+        origin_station=origin_station,
+        destination=destination,
+        earliest_departure_date_time=earliest_departure_time,
+    )
+    if departure is not None:
+        increment("leg_cache.departures_hits")
+        processed_response = process_departure(
+            earliest_departure_time=earliest_departure_time,
+            departure=departure,
+        )
+    else:
+        increment("leg_cache.misses")
+        raise_if_failed_leg(
+            origin_station=origin_station,
+            destination=destination,
+            earliest_departure_time=earliest_departure_time,
+        )
+        query_params = build_query_params(
+            origin_station=origin_station,
+            destination=destination,
+            departures_from=earliest_departure_time,
+        )
+        response = get_query(url=defaults.BASE_URL, query_params=query_params)
+        if response.get("routes"):
+            record_departures(
+                origin_station=origin_station,
+                destination=destination,
+                window_start_date_time=earliest_departure_time,
+                departures=parse_routes(response=response),
+            )
+        try:
+            processed_response = process_response(
+                response=response,
+                earliest_departure_time=earliest_departure_time,
+            )
+        except NoJourneyFound as err:
+            store_failed_leg(
+                origin_station=origin_station,
+                destination=destination,
+                earliest_departure_date_time=earliest_departure_time,
+                reason=str(err),
+            )
+            raise
+    store_leg(
+        origin_station=origin_station,
+        destination=destination,
+        earliest_departure_date_time=earliest_departure_time,
+        leg=processed_response,
+    )
+    leg_memory_cache.set(memory_cache_key, processed_response)
+    return processed_response
+
+
+def record_departures(
+    origin_station: str,
+    destination: str,
+    window_start_date_time: datetime,
+    departures: list[dict[str, Any]],
+) -> None:
+    """
+    store the departures returned by the api, and add them to the timetable graph
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        window_start_date_time (datetime): the earliest departure that was requested from the api
+        departures (list[dict[str, Any]]): the departures, as returned by parse_routes
+    """
+    store_departures(
+        origin_station=origin_station,
+        destination=destination,
+        window_start_date_time=window_start_date_time,
+        departures=departures,
+    )
+    timetable_graph.add_departures(
+        origin_station=origin_station,
+        destination=destination,
+        window_start_date_time=window_start_date_time,
+        departures=departures,
+    )
+
+
+def raise_if_failed_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_time: datetime,
+    ttl_mins: int = defaults.FAILED_LEG_TTL_MINS,
+) -> None:
+    """
+    raise the stored NoJourneyFound, if the api had no journey for the leg
+    within the last ttl_mins
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_time (datetime): the earliest the train can depart
+        ttl_mins (int): how long a failed leg is kept for
+    """
+    failed_leg = retrieve_failed_leg(
+        origin_station=origin_station,
+        destination=destination,
+        earliest_departure_date_time=earliest_departure_time,
+    )
+    retrieved_after = datetime.now() - timedelta(minutes=ttl_mins)
+    with _failed_leg_statistics_lock:
+        if failed_leg is None:
+            failed_leg_statistics.misses += 1
+            return
+        if failed_leg["retrieved_time"] < retrieved_after:
+            failed_leg_statistics.misses += 1
+            failed_leg_statistics.expirations += 1
+            return
+        failed_leg_statistics.hits += 1
+    increment("leg_cache.failed_leg_hits")
+    raise NoJourneyFound(failed_leg["reason"])
+
+
+@traced("api.process_response")
 def process_response(
     earliest_departure_time: datetime, response: dict[str, Any]
 ) -> dict[str, Any]:
@@ -86,6 +448,9 @@ def process_response(
     wait time (in mins),
     the journey_time (in mins),
     the arrival_time at the destination
+    of the first departure at or after the earliest departure time, in the
+    order of trains.departure_order rather than the order the api lists them,
+    so that the leg is the same as when it is answered from the stored departures
 
     Args:
         earliest_departure_time (datetime): the earliest_departure_time possible
@@ -98,51 +463,141 @@ def process_response(
             "arrival_time": <datetime>
         }
     """
+    viable_departures = [
+        x
+        for x in parse_routes(response=response)
+        if process_departure(earliest_departure_time=earliest_departure_time, departure=x)
+        is not None
+    ]
+    if not viable_departures:
+        raise NoJourneyFound("No viable journey found")
+    return process_departure(
+        earliest_departure_time=earliest_departure_time,
+        departure=min(viable_departures, key=departure_order),
+    )
+
+
+def parse_routes(response: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    parse every route in the response, in the order given by the api
+
+    Args:
+        response (dict[str, Any]): the response from the api
+
+    Returns:
+        [
+            {
+                "departure_time": <datetime>,
+                "arrival_time": <datetime>,
+                "journey_time": <int>
+            }
+        ]
+    """
     response_routes = response.get("routes", [])
     if not response_routes:
-        raise Exception("No routes found")
+        raise NoJourneyFound("No routes found")
 
+    departures = []
     for response_route in response_routes:
-        departure_datetime = response_route.get("departure_datetime").split("+")[0]
-        arrival_datetime = response_route.get("arrival_datetime").split("+")[0]
-        departure_datetime = parser.parse(departure_datetime)
-        arrival_datetime = parser.parse(arrival_datetime)
-
-        wait_time_delta = departure_datetime - earliest_departure_time
-        if wait_time_delta.total_seconds() < 0:
-            continue
-
-        wait_time_in_whole_mins = floor((wait_time_delta.total_seconds() / 60) + 0.5)
+        departure_datetime = parse_datetime(response_route.get("departure_datetime"))
+        arrival_datetime = parse_datetime(response_route.get("arrival_datetime"))
 
         hours, mins, _ = response_route.get("duration").split(":")
         hours = int(hours)
         mins = int(mins)
         journey_time = (hours * 60) + mins
-        return {
-            "wait_time": wait_time_in_whole_mins,
-            "journey_time": journey_time,
-            "arrival_time": arrival_datetime,
-        }
+        departures.append(
+            {
+                "departure_time": departure_datetime,
+                "arrival_time": arrival_datetime,
+                "journey_time": journey_time,
+            }
+        )
+    return departures
 
-    raise Exception("No viable journey found")
 
+def process_departure(
+    earliest_departure_time: datetime, departure: dict[str, Any]
+) -> Union[dict[str, Any], None]:
+    """
+    process a single departure into a leg, as returned by process_response
 
-def get_query(url: str, query_params: dict[str, Any]) -> dict[str, Any]:
+    Args:
+        earliest_departure_time (datetime): the earliest_departure_time possible
+        departure (dict[str, Any]): the departure, as returned by parse_routes
+
+    Returns:
+        the leg, or None if the departure leaves before the earliest_departure_time
     """
-    make a request and return the json response
+    wait_time_delta = departure["departure_time"] - earliest_departure_time
+    if wait_time_delta.total_seconds() < 0:
+        return None
+
+    wait_time_in_whole_mins = floor((wait_time_delta.total_seconds() / 60) + 0.5)
+    return {
+        "wait_time": wait_time_in_whole_mins,
+        "journey_time": departure["journey_time"],
+        "arrival_time": departure["arrival_time"],
+    }
+
+
+def get_client() -> ApiClient:
+    """
+    return the shared client, so that connections are reused between requests.
+    With defaults.API_REPLAY_PATH set, requests are answered from that recording,
+    and with defaults.API_RECORD_PATH set, they are recorded to that file
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = build_default_client()
+        return _client
+
+
+def build_default_client() -> ApiClient:
     """
-    response = requests.get(
-        url,
-        params=query_params,
+    build the client used when none has been set
+    """
+    if defaults.API_REPLAY_PATH:
+        return ReplayClient(path=defaults.API_REPLAY_PATH)
+    client = TransportApiClient(
         headers={
             "X-App-Key": API_KEY,
             "X-App-Id": API_ID,
         },
-        timeout=10,
-    )  # JSON-Request API
-    if response.status_code > 200:
-        raise Exception("Problem connecting to the Transport API")
-    return response.json()
+        token_bucket=TokenBucket(
+            rate_per_second=defaults.API_RATE_LIMIT_PER_SECOND,
+            capacity=defaults.API_RATE_LIMIT_BURST,
+        ),
+    )
+    if defaults.API_RECORD_PATH:
+        client = RecordingClient(client=client, path=defaults.API_RECORD_PATH)
+        # the recording is only complete once it is closed
+        atexit.register(client.close)
+    return client
+
+
+def set_client(client: Union[ApiClient, None]) -> None:
+    """
+    set the shared client, for example with different limits, or a
+    replay.ReplayClient. The previous client is closed.
+    Setting None creates the default client on next use
+    """
+    global _client
+    with _client_lock:
+        previous_client = _client
+        _client = client
+    if previous_client is not None and previous_client is not client:
+        previous_client.close()
+
+
+@traced("api.get_query")
+def get_query(url: str, query_params: dict[str, Any]) -> dict[str, Any]:
+    """
+    make a request and return the json response
+    """
+    increment("api.calls")
+    return get_client().get_json(url=url, query_params=query_params)
 
 
 def build_query_params(
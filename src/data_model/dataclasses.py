@@ -2,9 +2,36 @@
 Module for describing dataclasses
 """
 
-from dataclasses import dataclass
+import threading
+from array import array
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Union
+
+# the station identifiers, interned as small ints so that many journeys
+# can share them. A station keeps its code for the life of the process
+_station_codes: dict[str, int] = {}
+_station_identifiers: list[str] = []
+_station_codes_lock = threading.Lock()
+
+# no wait time, for the last station, or those after a wait that was too long
+NO_WAIT_TIME = -1
+# no arrival time, for the stations after the last leg that was retrieved
+NO_ARRIVAL_TIME = -1
+
+
+def station_code(station_id: str) -> int:
+    """
+    the interned code of the station identifier
+    """
+    code = _station_codes.get(station_id)
+    if code is None:
+        with _station_codes_lock:
+            code = _station_codes.setdefault(station_id, len(_station_identifiers))
+            if code == len(_station_identifiers):
+                _station_identifiers.append(station_id)
+    return code
 
 
 @dataclass
@@ -17,29 +44,259 @@ class JourneyRequest:
     max_wait_time: int
     station_identifiers: list[str]
 
+    def cache_key(self) -> tuple[datetime, int, tuple[str, ...]]:
+        """
+        return the request as a hashable key, so identical requests can be found
+        """
+        return (
+            self.departure_date_time,
+            self.max_wait_time,
+            tuple(self.station_identifiers),
+        )
 
-@dataclass
+
+class StationWait(Mapping):
+    """
+    A read only view of one station of a StationWaits, which behaves as the
+    dictionary {"station_id": <str>, "wait_time": <int or None>}
+    """
+
+    __slots__ = ("station_waits", "idx")
+
+    def __init__(self, station_waits: "StationWaits", idx: int):
+        self.station_waits = station_waits
+        self.idx = idx
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "station_id":
+            return self.station_waits.station_id(self.idx)
+        if key == "wait_time":
+            return self.station_waits.wait_time(self.idx)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(("station_id", "wait_time"))
+
+    def __len__(self) -> int:
+        return 2
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class StationWaits(Sequence):
+    """
+    The stations of a journey and the wait at each, held as arrays of the
+    interned station codes and the wait times in minutes.
+
+    It is immutable, and each item is a StationWait view, so callers can
+    still read it as a list of dictionaries without copying it
+    """
+
+    __slots__ = ("station_codes", "wait_times_mins")
+
+    def __init__(self, station_codes: array, wait_times_mins: array):
+        self.station_codes = station_codes
+        self.wait_times_mins = wait_times_mins
+
+    @classmethod
+    def from_lists(
+        cls, station_ids: Iterable[str], wait_times: Iterable[Union[int, None]]
+    ) -> "StationWaits":
+        """
+        build from the station identifiers and the wait time at each
+        """
+        return cls(
+            station_codes=array("H", [station_code(x) for x in station_ids]),
+            wait_times_mins=array(
+                "h", [NO_WAIT_TIME if x is None else x for x in wait_times]
+            ),
+        )
+
+    @classmethod
+    def from_dicts(cls, stations: Iterable[Mapping[str, Any]]) -> "StationWaits":
+        """
+        build from a list of {"station_id": <str>, "wait_time": <int or None>}
+        """
+        stations = list(stations)
+        return cls.from_lists(
+            station_ids=[x["station_id"] for x in stations],
+            wait_times=[x.get("wait_time") for x in stations],
+        )
+
+    def station_id(self, idx: int) -> str:
+        """
+        the station identifier at the position
+        """
+        return _station_identifiers[self.station_codes[idx]]
+
+    def wait_time(self, idx: int) -> Union[int, None]:
+        """
+        the wait time at the position, or None if there is no wait
+        """
+        wait_time = self.wait_times_mins[idx]
+        return None if wait_time == NO_WAIT_TIME else wait_time
+
+    def station_ids(self) -> list[str]:
+        """
+        every station identifier, in order
+        """
+        return [_station_identifiers[x] for x in self.station_codes]
+
+    def wait_times(self) -> list[Union[int, None]]:
+        """
+        every wait time, in order
+        """
+        return [None if x == NO_WAIT_TIME else x for x in self.wait_times_mins]
+
+    def as_list(self) -> list[dict[str, Any]]:
+        """
+        return a copy as a list of dictionaries
+        """
+        return [
+            {"station_id": x, "wait_time": y}
+            for x, y in zip(self.station_ids(), self.wait_times())
+        ]
+
+    def __getitem__(self, idx: Union[int, slice]) -> Any:
+        if isinstance(idx, slice):
+            return [StationWait(self, x) for x in range(len(self))[idx]]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("station index out of range")
+        return StationWait(self, idx)
+
+    def __len__(self) -> int:
+        return len(self.station_codes)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, StationWaits):
+            return (
+                self.station_codes == other.station_codes
+                and self.wait_times_mins == other.wait_times_mins
+            )
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(
+                x == y for x, y in zip(self, other)
+            )
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self.station_codes.tobytes(), self.wait_times_mins.tobytes()))
+
+    def __repr__(self) -> str:
+        return repr(self.as_list())
+
+
+@dataclass(frozen=True, slots=True)
 class JourneyDetails:
     """
     A class to describe the journey details
+
+    If the wait at a station was longer than the max wait time, the journey is
+    not retrieved any further. exceeded_wait_station_order is then the position
+    of that station, and the stations after it have no wait time.
+
+    arrival_offsets_secs holds the arrival at each station, in seconds after
+    the departure_date_time, with NO_ARRIVAL_TIME after the last leg that was
+    retrieved, so the journey can answer its sub-routes. It is None for a
+    journey that was built without the times of its legs, and is not compared.
+
+    It is immutable, so that cached journeys can be shared. The
+    train_stations_with_wait can be given as a list of dictionaries,
+    and is held as StationWaits
     """
 
     time_in_mins: int
     departure_date_time: datetime
-    train_stations_with_wait: list[dict[str, Any]]
+    train_stations_with_wait: StationWaits
+    exceeded_wait_station_order: Union[int, None] = None
+    arrival_offsets_secs: Union[array, None] = field(
+        default=None, compare=False, repr=False
+    )
+
+    def __post_init__(self):
+        if not isinstance(self.train_stations_with_wait, StationWaits):
+            object.__setattr__(
+                self,
+                "train_stations_with_wait",
+                StationWaits.from_dicts(self.train_stations_with_wait),
+            )
+        if self.arrival_offsets_secs is not None and not isinstance(
+            self.arrival_offsets_secs, array
+        ):
+            object.__setattr__(
+                self,
+                "arrival_offsets_secs",
+                array(
+                    "l",
+                    [NO_ARRIVAL_TIME if x is None else x for x in self.arrival_offsets_secs],
+                ),
+            )
 
     def as_dict(self) -> dict[str, Any]:
         """
-        return the data as a dictionary
+        return the data as a dictionary, with train_stations_with_wait
+        as a list of dictionaries
         """
         return {
             "time_in_mins": self.time_in_mins,
             "departure_date_time": self.departure_date_time,
-            "train_stations_with_wait": self.train_stations_with_wait,
+            "train_stations_with_wait": self.train_stations_with_wait.as_list(),
+            "exceeded_wait_station_order": self.exceeded_wait_station_order,
         }
 
+    def exceeded_wait_at_station(self) -> Union[str, None]:
+        """
+        returns the station where the wait was longer than the max wait time,
+        or None if the whole journey was retrieved
+        """
+        if self.exceeded_wait_station_order is None:
+            return None
+        return self.train_stations_with_wait.station_id(
+            self.exceeded_wait_station_order
+        )
+
+    def answers(self, max_wait_time: int) -> bool:
+        """
+        see if these details answer a request with this max wait time.
+        A journey that stopped early only answers a request where the wait it
+        stopped at is also too long
+        """
+        if self.exceeded_wait_station_order is None:
+            return True
+        wait_time = self.train_stations_with_wait.wait_time(
+            self.exceeded_wait_station_order
+        )
+        return wait_time > max_wait_time
+
     def arrival_date_time(self) -> datetime:
         """
         returns the arrival date and time as a datetime object
         """
         return self.departure_date_time + timedelta(minutes=self.time_in_mins)
+
+    def station_arrival_date_time(self, idx: int) -> Union[datetime, None]:
+        """
+        returns the arrival date and time at the station in the position,
+        which is the departure_date_time for the first station, or None if
+        it is not known
+        """
+        if self.arrival_offsets_secs is None:
+            return None
+        offset_secs = self.arrival_offsets_secs[idx]
+        if offset_secs == NO_ARRIVAL_TIME:
+            return None
+        return self.departure_date_time + timedelta(seconds=offset_secs)
+
+    def station_departure_date_time(self, idx: int) -> Union[datetime, None]:
+        """
+        returns the departure date and time of the train from the station in
+        the position, after its wait, or None if it is not known
+        """
+        arrival_date_time = self.station_arrival_date_time(idx)
+        wait_time = self.train_stations_with_wait.wait_time(idx)
+        if arrival_date_time is None or wait_time is None:
+            return None
+        return arrival_date_time + timedelta(minutes=wait_time)
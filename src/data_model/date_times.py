@@ -0,0 +1,84 @@
+"""
+Module to parse the datetimes given by the api and by passengers
+
+The api gives ISO 8601 datetimes with an offset, such as
+2024-06-02T14:25:00+01:00. These are parsed without dateutil, which is only
+used for the formats datetime.fromisoformat does not know.
+Datetimes are held without a timezone, as wall clock times in
+defaults.TIMEZONE, so a datetime with a different offset is converted to that timezone
+"""
+
+from datetime import datetime, timedelta
+from typing import Union
+from zoneinfo import ZoneInfo
+
+from src import defaults
+
+LOCAL_TIMEZONE = ZoneInfo(defaults.TIMEZONE)
+# the length of 2024-06-02T14:25:00+01:00, and where its offset starts
+API_DATETIME_LENGTH = 25
+API_OFFSET_START = 19
+
+# the offsets seen, such as "+01:00", as timedeltas
+_offsets: dict[str, timedelta] = {}
+
+
+def parse_datetime(datetime_str: str) -> datetime:
+    """
+    parse a datetime string into a datetime without a timezone
+
+    Args:
+        datetime_str (str): the datetime, ideally in ISO 8601 format
+
+    Returns:
+        datetime: the wall clock time in defaults.TIMEZONE
+
+    Raises:
+        ValueError: if the datetime is not in a recognised format
+    """
+    if (
+        len(datetime_str) == API_DATETIME_LENGTH
+        and datetime_str[API_OFFSET_START] in "+-"
+    ):
+        date_time = _parse_api_datetime(datetime_str)
+        if date_time is not None:
+            return date_time
+    try:
+        date_time = datetime.fromisoformat(datetime_str)
+    except ValueError:
+        # imported here, as it is slow to import and rarely needed
+        from dateutil import parser
+
+        date_time = parser.parse(datetime_str)
+    return local_datetime(date_time)
+
+
+def _parse_api_datetime(datetime_str: str) -> Union[datetime, None]:
+    """
+    parse a datetime in the format the api gives, if its offset is the
+    local offset at that time, otherwise None
+    """
+    offset_str = datetime_str[API_OFFSET_START:]
+    offset = _offsets.get(offset_str)
+    try:
+        if offset is None:
+            offset = datetime.fromisoformat(
+                f"2000-01-01T00:00:00{offset_str}"
+            ).utcoffset()
+            _offsets[offset_str] = offset
+        wall_clock = datetime.fromisoformat(datetime_str[:API_OFFSET_START])
+    except ValueError:
+        return None
+    if LOCAL_TIMEZONE.utcoffset(wall_clock) != offset:
+        return None
+    return wall_clock
+
+
+def local_datetime(date_time: datetime) -> datetime:
+    """
+    the wall clock time of a datetime in defaults.TIMEZONE, without a timezone.
+    A datetime without a timezone is assumed to be in defaults.TIMEZONE already
+    """
+    if date_time.tzinfo is None:
+        return date_time
+    return date_time.astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
@@ -0,0 +1,246 @@
+"""
+This file retrieves a stored journey with the sqlite3 module alone
+
+It answers a journey that is already in trains.db without importing
+SQLAlchemy, requests or dateutil, so that a command line run answered from
+the cache starts quickly. It reads the same rows as trains.retrieve_journey
+and trains.retrieve_sub_journey, and anything it can not answer is left to
+get_train_information
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Any, Sequence, Union
+from src.data_model.dataclasses import JourneyDetails, JourneyRequest, StationWaits
+from src.data_model.instrumentation import traced
+
+DATABASE_PATH = "./trains.db"
+# the wall clock dates and times of journeys are stored as whole minutes since this
+EPOCH = datetime(1970, 1, 1)
+ONE_MINUTE = timedelta(minutes=1)
+# the 64 bit FNV-1a hash, of the joined_journey_list, is the route_id of a route
+FNV_OFFSET_BASIS = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+# the same query as trains._RETRIEVE_JOURNEY
+RETRIEVE_JOURNEY_SQL = (
+    "SELECT journeys.total_journey_time_mins, journeys.joined_wait_times,"
+    " journeys.exceeded_wait_station_order"
+    " FROM journeys JOIN routes ON routes.route_id = journeys.route_id"
+    " WHERE journeys.route_id = ? AND journeys.departure_minutes = ?"
+    " AND routes.joined_journey_list = ?"
+)
+# the same query as trains._RETRIEVE_SUB_JOURNEY
+RETRIEVE_SUB_JOURNEY_SQL = (
+    "SELECT sub_route_station.journey_id, first_station.station_order,"
+    " stations.station_identifier, sub_route_station.wait_time_mins,"
+    " sub_route_station.arrival_minutes"
+    " FROM journey_stations AS first_station"
+    " JOIN journey_stations AS sub_route_station"
+    " ON sub_route_station.journey_id = first_station.journey_id"
+    " AND sub_route_station.station_order >= first_station.station_order"
+    " AND sub_route_station.station_order < first_station.station_order + ?"
+    " JOIN stations ON stations.station_id = sub_route_station.station_id"
+    " WHERE first_station.station_id ="
+    " (SELECT station_id FROM stations WHERE station_identifier = ?)"
+    " AND first_station.arrival_minutes = ?"
+    " AND first_station.wait_time_mins IS NOT NULL"
+    " ORDER BY sub_route_station.journey_id, first_station.station_order,"
+    " sub_route_station.station_order"
+)
+
+
+@traced("db.retrieve_stored_journey")
+def retrieve_stored_journey(
+    journey_request: JourneyRequest,
+    database_path: str = DATABASE_PATH,
+) -> Union[JourneyDetails, None]:
+    """
+    retrieve the journey from the database, if it is stored and answers the request
+
+    Args:
+        journey_request (JourneyRequest): The journey that has been requested
+        database_path (str): the path of the sqlite database
+    Returns:
+        JourneyDetails, or None if the journey is not stored, or stopped
+        before a wait that is not too long for this request
+    """
+    station_list = journey_request.station_identifiers
+    departure_date_time = journey_request.departure_date_time
+    departure_minutes = to_epoch_minutes(departure_date_time)
+    if departure_minutes is None:
+        # only journeys departing on a whole minute are stored
+        return None
+    try:
+        connection = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        # there is no database yet
+        return None
+    journey_details = None
+    try:
+        row = connection.execute(
+            RETRIEVE_JOURNEY_SQL,
+            (route_hash(station_list), departure_minutes, "_".join(station_list)),
+        ).fetchone()
+        if row is not None:
+            journey_details = build_journey_details(
+                station_list=station_list,
+                departure_date_time=departure_date_time,
+                total_journey_time_mins=row[0],
+                joined_wait_times=row[1],
+                exceeded_wait_station_order=row[2],
+            )
+        if journey_details is None or not journey_details.answers(
+            journey_request.max_wait_time
+        ):
+            rows = connection.execute(
+                RETRIEVE_SUB_JOURNEY_SQL,
+                (len(station_list), station_list[0], departure_minutes),
+            ).fetchall()
+            journey_details = build_sub_journey(
+                station_list=station_list,
+                departure_date_time=departure_date_time,
+                rows=rows,
+            )
+    except sqlite3.OperationalError:
+        # the tables are missing, or have not been migrated to this schema
+        return None
+    finally:
+        connection.close()
+
+    if journey_details is None or not journey_details.answers(
+        journey_request.max_wait_time
+    ):
+        return None
+    return journey_details
+
+
+def to_epoch_minutes(date_time: Union[datetime, None]) -> Union[int, None]:
+    """
+    the wall clock date and time as whole minutes since the EPOCH, ignoring
+    any timezone, as the DateTime columns did
+
+    Returns:
+        int, or None if there is no date and time, or it is not on a whole minute
+    """
+    if date_time is None or date_time.second or date_time.microsecond:
+        return None
+    return (date_time.replace(tzinfo=None) - EPOCH) // ONE_MINUTE
+
+
+def from_epoch_minutes(epoch_minutes: int) -> datetime:
+    """
+    the wall clock date and time of the whole minutes since the EPOCH
+    """
+    return EPOCH + timedelta(minutes=epoch_minutes)
+
+
+def route_hash(station_list: Sequence[str]) -> int:
+    """
+    the route_id of the stations, the 64 bit FNV-1a hash of the
+    joined_journey_list, as a signed integer to fit a sqlite INTEGER.
+    It is the same in every process, unlike hash()
+    """
+    value = FNV_OFFSET_BASIS
+    for byte in "_".join(station_list).encode():
+        value = ((value ^ byte) * FNV_PRIME) & 0xFFFFFFFFFFFFFFFF
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def join_wait_times(wait_times: list[Union[int, None]]) -> str:
+    """
+    join the wait times into a string to store, in the same way as
+    the joined_journey_list. No wait time is stored as an empty string
+    """
+    return "_".join(["" if x is None else str(x) for x in wait_times])
+
+
+def split_wait_times(joined_wait_times: str) -> list[Union[int, None]]:
+    """
+    split the stored wait times back into a list
+    """
+    return [int(x) if x else None for x in joined_wait_times.split("_")]
+
+
+def build_journey_details(
+    station_list: list[str],
+    departure_date_time: datetime,
+    total_journey_time_mins: int,
+    joined_wait_times: str,
+    exceeded_wait_station_order: Union[int, None] = None,
+) -> JourneyDetails:
+    """
+    build the JourneyDetails from a row of the journeys table
+    """
+    wait_times = split_wait_times(joined_wait_times)
+    station_count = min(len(station_list), len(wait_times))
+    train_stations_with_wait = StationWaits.from_lists(
+        station_ids=station_list[:station_count],
+        wait_times=wait_times[:station_count],
+    )
+    return JourneyDetails(
+        time_in_mins=total_journey_time_mins,
+        departure_date_time=departure_date_time,
+        train_stations_with_wait=train_stations_with_wait,
+        exceeded_wait_station_order=exceeded_wait_station_order,
+    )
+
+
+def build_sub_journey(
+    station_list: list[str],
+    departure_date_time: datetime,
+    rows: Sequence[Sequence[Any]],
+) -> Union[JourneyDetails, None]:
+    """
+    build the JourneyDetails of a sub-route from the stored stations of the
+    journeys that arrived at its first station at its departure date and time.
+    A journey that retrieved every leg of the sub-route is preferred, and
+    otherwise the one that retrieved the most of it, which stopped at a wait
+    longer than its max wait time, as transport_api.retrieve_journey would
+
+    Args:
+        station_list (list[str]): the stations of the sub-route, in order
+        departure_date_time (datetime): the departure date and time of the sub-route
+        rows (Sequence[Sequence[Any]]): the rows of the sub-route lookup, as
+            (journey_id, first_station_order, station_identifier,
+            wait_time_mins, arrival_minutes), ordered by the journey, the
+            first station and the station order
+    Returns:
+        JourneyDetails, or None if no stored journey covers the sub-route
+    """
+    best_stations, best_legs = None, 0
+    for _, journey_rows in groupby(rows, key=lambda x: (x[0], x[1])):
+        stations = [x[2:] for x in journey_rows]
+        if [x[0] for x in stations] != station_list:
+            continue
+        # the legs retrieved, up to the station where the stored journey stopped
+        legs = 0
+        while legs < len(stations) - 1 and stations[legs][1] is not None:
+            legs += 1
+        if stations[legs][2] is not None and legs > best_legs:
+            best_stations, best_legs = stations, legs
+    if best_stations is None:
+        return None
+
+    # each leg is its wait and its journey time, from arrival to arrival
+    time_in_mins = best_stations[best_legs][2] - best_stations[0][2]
+    return JourneyDetails(
+        time_in_mins=time_in_mins,
+        departure_date_time=departure_date_time,
+        train_stations_with_wait=StationWaits.from_lists(
+            station_ids=station_list,
+            wait_times=[x[1] for x in best_stations[:best_legs]]
+            + [None] * (len(station_list) - best_legs),
+        ),
+        exceeded_wait_station_order=None
+        if best_legs == len(station_list) - 1
+        else best_legs - 1,
+        # a journey stored before the station times were added has no
+        # arrivals at the stations in between
+        arrival_offsets_secs=[
+            None
+            if idx > best_legs or x[2] is None
+            else (x[2] - best_stations[0][2]) * 60
+            for idx, x in enumerate(best_stations)
+        ],
+    )
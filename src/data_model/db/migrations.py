@@ -0,0 +1,476 @@
+"""
+This file migrates an existing trains database to the current schema
+
+The schema version is held in the sqlite user_version pragma. Each migration
+brings the database up to its version, and checks the tables before changing
+them, so that a database created with the current schema is left as it is.
+The journeys and journey_stations tables as they were before the compact
+schema of version 5 are described here, for the migrations up to it
+"""
+
+import argparse
+import os
+import sys
+from typing import Any, Callable
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    Engine,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    UniqueConstraint,
+)
+
+module_path = os.path.abspath(os.path.join(".."))
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from src.data_model.db.journey_lookup import DATABASE_PATH, route_hash
+from src.data_model.db.trains import (
+    JOURNEY_STATIONS,
+    JOURNEYS,
+    ROUTES,
+    STATIONS,
+    Base,
+    create_database_engine,
+    join_wait_times,
+)
+
+LEGACY_METADATA = MetaData()
+
+LEGACY_JOURNEYS = Table(
+    "journeys",
+    LEGACY_METADATA,
+    Column("journey_id", Integer, primary_key=True),
+    Column("departure_date_time", DateTime(timezone=True), nullable=False),
+    Column("joined_journey_list", String, nullable=False),
+    Column("total_journey_time_mins", Integer, nullable=False),
+    Column("joined_wait_times", String, nullable=False, server_default=""),
+    Column("exceeded_wait_station_order", Integer, nullable=True),
+    UniqueConstraint(
+        "joined_journey_list",
+        "departure_date_time",
+        name="uidx_joined_journey_list_departure_date_time",
+    ),
+    Index(
+        "idx_journeys_lookup",
+        "joined_journey_list",
+        "departure_date_time",
+        "total_journey_time_mins",
+        "joined_wait_times",
+        "exceeded_wait_station_order",
+    ),
+)
+
+LEGACY_JOURNEY_STATIONS = Table(
+    "journey_stations",
+    LEGACY_METADATA,
+    Column("journey_station_id", Integer, primary_key=True),
+    Column(
+        "journey_id",
+        String,
+        ForeignKey("journeys.journey_id", ondelete="Cascade", onupdate="Cascade"),
+    ),
+    Column("station_order", Integer, nullable=False),
+    Column("station_identifier", String, nullable=False),
+    Column("wait_time_mins", Integer, nullable=True),
+    Column("arrival_date_time", DateTime(timezone=True), nullable=True),
+    Column("departure_date_time", DateTime(timezone=True), nullable=True),
+    Index(
+        "idx_station_ident_arrival",
+        "station_identifier",
+        "arrival_date_time",
+        "journey_id",
+        "station_order",
+    ),
+    Index("idx_journey_stations_journey_id_order", "journey_id", "station_order"),
+)
+
+
+def get_schema_version(connection: Connection) -> int:
+    """
+    get the schema version of the database
+    """
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def has_unique_index(connection: Connection, table_name: str, columns: list[str]) -> bool:
+    """
+    see if the table has a unique index on exactly these columns
+
+    Args:
+        connection (Connection): the database connection
+        table_name (str): the name of the table
+        columns (list[str]): the columns in the index, in order
+
+    Returns:
+        bool : True if there is a unique index on the columns
+    """
+    index_list = connection.exec_driver_sql(f"PRAGMA index_list({table_name})").all()
+    for index in index_list:
+        _, index_name, is_unique, *_ = index
+        if not is_unique:
+            continue
+        index_info = connection.exec_driver_sql(
+            f"PRAGMA index_info('{index_name}')"
+        ).all()
+        if [x[2] for x in index_info] == columns:
+            return True
+    return False
+
+
+def get_column_names(connection: Connection, table_name: str) -> list[str]:
+    """
+    get the names of the columns currently in the table
+    """
+    table_info = connection.exec_driver_sql(f"PRAGMA table_info({table_name})").all()
+    return [x[1] for x in table_info]
+
+
+def has_legacy_journeys(connection: Connection) -> bool:
+    """
+    see if the journeys are still in the tables from before the compact schema
+    """
+    return "joined_journey_list" in get_column_names(
+        connection=connection, table_name=LEGACY_JOURNEYS.name
+    )
+
+
+def rebuild_table(connection: Connection, table: Table) -> None:
+    """
+    rebuild a table so that it matches the table description, keeping the rows.
+    This is the way sqlite recommends changing constraints on a table.
+    Columns that are not yet in the table are given their default
+
+    Args:
+        connection (Connection): the database connection
+        table (Table): the description of the table to rebuild
+    """
+    new_table = table.to_metadata(MetaData(), name=f"{table.name}_new")
+    # the indexes are created once the table has been renamed
+    new_table.indexes.clear()
+    new_table.create(connection)
+
+    existing_column_names = get_column_names(
+        connection=connection, table_name=table.name
+    )
+    column_names = ", ".join(
+        x.name for x in table.columns if x.name in existing_column_names
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO {new_table.name} ({column_names}) "
+        f"SELECT {column_names} FROM {table.name}"
+    )
+    connection.exec_driver_sql(f"DROP TABLE {table.name}")
+    connection.exec_driver_sql(f"ALTER TABLE {new_table.name} RENAME TO {table.name}")
+    for index in table.indexes:
+        index.create(connection)
+
+
+def migrate_journeys_unique_on_departure(connection: Connection) -> None:
+    """
+    The journeys table was unique on joined_journey_list alone, so only one
+    departure time of each route could be stored. Make it unique on the
+    joined_journey_list and departure_date_time
+    """
+    if has_unique_index(
+        connection=connection,
+        table_name=LEGACY_JOURNEYS.name,
+        columns=["joined_journey_list"],
+    ):
+        rebuild_table(connection=connection, table=LEGACY_JOURNEYS)
+
+
+def migrate_journeys_joined_wait_times(connection: Connection) -> None:
+    """
+    Add the joined_wait_times to the journeys table, filled in from the
+    journey_stations table, so that a journey can be retrieved without a join.
+    Replace the lookup index with one that covers it
+    """
+    if not has_legacy_journeys(connection=connection):
+        return
+    if "joined_wait_times" not in get_column_names(
+        connection=connection, table_name=LEGACY_JOURNEYS.name
+    ):
+        connection.exec_driver_sql(
+            f"ALTER TABLE {LEGACY_JOURNEYS.name} "
+            "ADD COLUMN joined_wait_times VARCHAR NOT NULL DEFAULT ''"
+        )
+
+    rows = connection.exec_driver_sql(
+        "SELECT journey_stations.journey_id, journey_stations.wait_time_mins "
+        "FROM journeys JOIN journey_stations "
+        "ON journey_stations.journey_id = journeys.journey_id "
+        "WHERE journeys.joined_wait_times = '' "
+        "ORDER BY journey_stations.journey_id, journey_stations.station_order"
+    ).all()
+    wait_times_by_journey: dict[int, list] = {}
+    for journey_id, wait_time_mins in rows:
+        wait_times_by_journey.setdefault(journey_id, []).append(wait_time_mins)
+    if wait_times_by_journey:
+        connection.exec_driver_sql(
+            f"UPDATE {LEGACY_JOURNEYS.name} "
+            "SET joined_wait_times = ? WHERE journey_id = ?",
+            [
+                (join_wait_times(wait_times), journey_id)
+                for journey_id, wait_times in wait_times_by_journey.items()
+            ],
+        )
+
+    connection.exec_driver_sql(
+        "DROP INDEX IF EXISTS "
+        "idx_journeys_joined_journey_list_departure_date_time_total"
+    )
+    for index in LEGACY_JOURNEYS.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def migrate_journeys_exceeded_wait_station_order(connection: Connection) -> None:
+    """
+    Add the exceeded_wait_station_order to the journeys table, so that a journey
+    which stopped at a wait longer than the max wait time can be stored.
+    Every journey already stored was retrieved in full, so it is left empty.
+    Replace the lookup index with one that covers it
+    """
+    if not has_legacy_journeys(connection=connection):
+        return
+    if "exceeded_wait_station_order" not in get_column_names(
+        connection=connection, table_name=LEGACY_JOURNEYS.name
+    ):
+        connection.exec_driver_sql(
+            f"ALTER TABLE {LEGACY_JOURNEYS.name} "
+            "ADD COLUMN exceeded_wait_station_order INTEGER"
+        )
+        connection.exec_driver_sql("DROP INDEX IF EXISTS idx_journeys_lookup")
+    for index in LEGACY_JOURNEYS.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def migrate_journey_stations_times(connection: Connection) -> None:
+    """
+    Add the arrival and departure date and time of each station to the
+    journey_stations table, so that a prefix or sub-route of a stored journey
+    can be retrieved from it. The journeys already stored have no times, which
+    are derived as far as they can be by migrate_compact_journeys. Add the lookup index,
+    and the index of the journey_id and station_order, which was described on
+    the JourneyStations class but never created
+    """
+    if not has_legacy_journeys(connection=connection):
+        return
+    column_names = get_column_names(
+        connection=connection, table_name=LEGACY_JOURNEY_STATIONS.name
+    )
+    for column_name in ["arrival_date_time", "departure_date_time"]:
+        if column_name not in column_names:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {LEGACY_JOURNEY_STATIONS.name} "
+                f"ADD COLUMN {column_name} DATETIME"
+            )
+    for index in LEGACY_JOURNEY_STATIONS.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def epoch_minutes_sql(column: str) -> str:
+    """
+    the sql of a stored date and time as whole minutes since
+    journey_lookup.EPOCH, or NULL if it is not on a whole minute
+    """
+    return (
+        f"CASE WHEN strftime('%f', {column}) = '00.000' "
+        f"THEN CAST(strftime('%s', {column}) AS INTEGER) / 60 END"
+    )
+
+
+def migrate_compact_journeys(connection: Connection) -> None:
+    """
+    Move the journeys to the compact schema. The station identifiers are
+    interned in the stations table, each route is stored once in the routes
+    table, keyed on its route_hash, and the date and times are whole minutes
+    since journey_lookup.EPOCH. The journeys and stations are copied with an
+    INSERT ... SELECT each, keeping their journey_id. A journey that did not
+    depart on a whole minute, or whose route_hash is taken by another route,
+    is not kept, as it would not be stored in the compact schema either.
+
+    A journey stored before the station times were added is given the times
+    that follow from it, the arrival at and departure from its first station,
+    and the arrival at the last station retrieved, which is its departure plus
+    its total_journey_time_mins. The times of the legs were not stored, so
+    the arrivals at the stations in between are left NULL, and store_journey
+    replaces the journey when it is stored again with them
+    """
+    if not has_legacy_journeys(connection=connection):
+        return
+    for table in [LEGACY_JOURNEY_STATIONS, LEGACY_JOURNEYS]:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table.name} RENAME TO legacy_{table.name}"
+        )
+    for table in [STATIONS, ROUTES, JOURNEYS, JOURNEY_STATIONS]:
+        table.create(connection, checkfirst=True)
+
+    connection.exec_driver_sql(
+        f"INSERT OR IGNORE INTO {STATIONS.name} (station_identifier) "
+        "SELECT DISTINCT station_identifier FROM legacy_journey_stations "
+        "ORDER BY station_identifier"
+    )
+    joined_journey_lists = connection.exec_driver_sql(
+        "SELECT DISTINCT joined_journey_list FROM legacy_journeys"
+    ).scalars()
+    route_rows = [(route_hash(x.split("_")), x) for x in joined_journey_lists]
+    if route_rows:
+        # a route whose route_hash is already taken is not stored
+        connection.exec_driver_sql(
+            f"INSERT OR IGNORE INTO {ROUTES.name} (route_id, joined_journey_list) "
+            "VALUES (?, ?)",
+            route_rows,
+        )
+    connection.exec_driver_sql(
+        f"INSERT OR IGNORE INTO {JOURNEYS.name} (journey_id, route_id, "
+        "departure_minutes, total_journey_time_mins, joined_wait_times, "
+        "exceeded_wait_station_order) "
+        "SELECT legacy_journeys.journey_id, routes.route_id, "
+        f"{epoch_minutes_sql('legacy_journeys.departure_date_time')}, "
+        "legacy_journeys.total_journey_time_mins, legacy_journeys.joined_wait_times, "
+        "legacy_journeys.exceeded_wait_station_order "
+        "FROM legacy_journeys JOIN routes "
+        "ON routes.joined_journey_list = legacy_journeys.joined_journey_list "
+        "WHERE strftime('%f', legacy_journeys.departure_date_time) = '00.000'"
+    )
+    connection.exec_driver_sql(
+        f"INSERT OR IGNORE INTO {JOURNEY_STATIONS.name} (journey_id, station_order, "
+        "station_id, wait_time_mins, arrival_minutes, departure_minutes) "
+        "SELECT journeys.journey_id, legacy_journey_stations.station_order, "
+        "stations.station_id, legacy_journey_stations.wait_time_mins, "
+        f"{epoch_minutes_sql('legacy_journey_stations.arrival_date_time')}, "
+        f"{epoch_minutes_sql('legacy_journey_stations.departure_date_time')} "
+        "FROM legacy_journey_stations "
+        "JOIN journeys "
+        "ON journeys.journey_id = CAST(legacy_journey_stations.journey_id AS INTEGER) "
+        "JOIN stations "
+        "ON stations.station_identifier = legacy_journey_stations.station_identifier"
+    )
+    journey_sql = (
+        f"FROM {JOURNEYS.name} "
+        f"WHERE {JOURNEYS.name}.journey_id = {JOURNEY_STATIONS.name}.journey_id"
+    )
+    connection.exec_driver_sql(
+        f"UPDATE {JOURNEY_STATIONS.name} "
+        f"SET arrival_minutes = (SELECT departure_minutes {journey_sql}) "
+        "WHERE station_order = 0 AND arrival_minutes IS NULL"
+    )
+    # the station after a wait that was too long, or else the last station
+    connection.exec_driver_sql(
+        f"UPDATE {JOURNEY_STATIONS.name} SET arrival_minutes = "
+        f"(SELECT departure_minutes + total_journey_time_mins {journey_sql}) "
+        "WHERE arrival_minutes IS NULL AND station_order = ("
+        "SELECT COALESCE(exceeded_wait_station_order + 1, "
+        f"(SELECT MAX(station_order) FROM {JOURNEY_STATIONS.name} AS last_station "
+        f"WHERE last_station.journey_id = {JOURNEY_STATIONS.name}.journey_id)) "
+        f"{journey_sql})"
+    )
+    connection.exec_driver_sql(
+        f"UPDATE {JOURNEY_STATIONS.name} "
+        "SET departure_minutes = arrival_minutes + wait_time_mins "
+        "WHERE departure_minutes IS NULL AND arrival_minutes IS NOT NULL "
+        "AND wait_time_mins IS NOT NULL"
+    )
+    connection.exec_driver_sql("DROP TABLE legacy_journey_stations")
+    connection.exec_driver_sql("DROP TABLE legacy_journeys")
+
+
+# (schema version, migration) in the order they should be applied
+MIGRATIONS: list[tuple[int, Callable[[Connection], None]]] = [
+    (1, migrate_journeys_unique_on_departure),
+    (2, migrate_journeys_joined_wait_times),
+    (3, migrate_journeys_exceeded_wait_station_order),
+    (4, migrate_journey_stations_times),
+    (5, migrate_compact_journeys),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate_database(engine: Engine) -> None:
+    """
+    Migrate the database to the current schema version, in a single transaction
+
+    Args:
+        engine (Engine): the engine for the database
+    """
+    with engine.begin() as connection:
+        schema_version = get_schema_version(connection=connection)
+        for migration_version, migration in MIGRATIONS:
+            if schema_version < migration_version:
+                migration(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_database_file(database_path: str, vacuum: bool = False) -> dict[str, Any]:
+    """
+    Migrate the database file to the current schema version, creating any
+    tables it does not have. A migration leaves the pages it freed in the
+    file, so vacuum rewrites the file without them
+
+    Args:
+        database_path (str): the path of the sqlite database file
+        vacuum (bool): rewrite the file once it is migrated
+    Returns:
+        dict[str, Any]: the schema versions, journey count and file sizes
+        before and after
+    """
+    database_engine = create_database_engine(f"sqlite:///{database_path}")
+    try:
+        with database_engine.connect() as connection:
+            from_version = get_schema_version(connection=connection)
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        bytes_before = os.path.getsize(database_path)
+
+        Base.metadata.create_all(database_engine)
+        migrate_database(database_engine)
+        with database_engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            if vacuum:
+                connection.exec_driver_sql("VACUUM")
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            journeys = connection.exec_driver_sql(
+                f"SELECT COUNT(*) FROM {JOURNEYS.name}"
+            ).scalar()
+    finally:
+        database_engine.dispose()
+    return {
+        "from_version": from_version,
+        "to_version": SCHEMA_VERSION,
+        "journeys": journeys,
+        "bytes_before": bytes_before,
+        "bytes_after": os.path.getsize(database_path),
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Migrate a trains database to the current schema"
+    )
+    arg_parser.add_argument(
+        "--database_path",
+        dest="database_path",
+        help="the sqlite database file to migrate",
+        default=DATABASE_PATH,
+    )
+    arg_parser.add_argument(
+        "--vacuum",
+        dest="vacuum",
+        action="store_true",
+        help="rewrite the file once it is migrated, to give back the pages it freed",
+    )
+    args = arg_parser.parse_args()
+    result = migrate_database_file(database_path=args.database_path, vacuum=args.vacuum)
+    print(
+        f"Database migrated from schema version {result['from_version']} "
+        f"to {result['to_version']}, with {result['journeys']} journeys, "
+        f"from {result['bytes_before']} to {result['bytes_after']} bytes"
+    )
@@ -2,34 +2,166 @@
 This file describes the tables in the trains database, and issues a session
 """
 
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from typing import Any, Union
 from sqlalchemy import (
+    Engine,
     Table,
     UniqueConstraint,
+    bindparam,
     create_engine,
+    event,
+    select,
     Column,
     Integer,
     String,
     ForeignKey,
     Index,
     DateTime,
+    or_,
+    tuple_,
 )
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from sqlalchemy.exc import OperationalError
 from src.data_model.dataclasses import JourneyDetails
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./trains.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
+from src.data_model.instrumentation import traced
+from src.data_model.db.journey_lookup import (
+    DATABASE_PATH,
+    build_journey_details,
+    build_sub_journey,
+    join_wait_times,
+    route_hash,
+    split_wait_times,
+    to_epoch_minutes,
 )
+from src import defaults
+
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+
+
+def apply_pragmas(dbapi_connection: Any, pragmas: dict[str, Any]) -> None:
+    """
+    set the pragmas on a new sqlite connection
+
+    Args:
+        dbapi_connection: the sqlite3 connection
+        pragmas (dict[str, Any]): the pragma names and their values
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def create_database_engine(
+    database_url: str,
+    pragmas: Union[dict[str, Any], None] = None,
+) -> Engine:
+    """
+    create an engine for a sqlite database, that applies the connection
+    profile to every connection it opens
+
+    Args:
+        database_url (str): the sqlalchemy url of the database
+        pragmas (dict[str, Any]): the pragmas to apply, defaults.SQLITE_PRAGMAS if not given
+    Returns:
+        Engine
+    """
+    if pragmas is None:
+        pragmas = defaults.SQLITE_PRAGMAS
+    database_engine = create_engine(
+        database_url,
+        connect_args={"check_same_thread": False},
+        query_cache_size=defaults.SQLITE_QUERY_CACHE_SIZE,
+    )
+
+    @event.listens_for(database_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection=dbapi_connection, pragmas=pragmas)
+
+    return database_engine
+
+
+engine = create_database_engine(SQLALCHEMY_DATABASE_URL)
 Session = sessionmaker(
     autocommit=False,
     autoflush=False,
     bind=engine,
 )
 Base = declarative_base()
+# the service, and each thread that finds the tables missing, initialise the
+# database, so the tables are created and migrated by one at a time
+_initialise_lock = threading.Lock()
+
+
+STATIONS = Table(
+    "stations",
+    Base.metadata,
+    Column(
+        "station_id",
+        Integer,
+        primary_key=True,
+    ),
+    Column(
+        "station_identifier",
+        String,
+        nullable=False,
+    ),
+    UniqueConstraint(
+        "station_identifier",
+        name="uidx_station_identifier",
+    ),
+)
+
+
+class Stations(Base):
+    """
+    class to define the Stations table
+
+    Each station identifier is interned, so the stations of a journey are
+    stored as small integers
+    """
+
+    __table__ = STATIONS
+
+
+ROUTES = Table(
+    "routes",
+    Base.metadata,
+    # the route_hash of the joined_journey_list, so the route_id of a station
+    # list is known without a query
+    Column(
+        "route_id",
+        Integer,
+        primary_key=True,
+        autoincrement=False,
+    ),
+    Column(
+        "joined_journey_list",
+        String,
+        nullable=False,
+    ),
+    UniqueConstraint(
+        "joined_journey_list",
+        name="uidx_routes_joined_journey_list",
+    ),
+)
+
+
+class Routes(Base):
+    """
+    class to define the Routes table
+
+    Each route is stored once, however many departure times of it are stored.
+    A route whose route_id is already taken by another route is not stored,
+    so the journeys of a route are only found by its own station list
+    """
+
+    __table__ = ROUTES
 
 
 JOURNEYS = Table(
@@ -41,13 +173,15 @@ JOURNEYS = Table(
         primary_key=True,
     ),
     Column(
-        "departure_date_time",
-        DateTime(timezone=True),
+        "route_id",
+        Integer,
+        ForeignKey("routes.route_id"),
         nullable=False,
     ),
+    # the wall clock departure, in whole minutes since journey_lookup.EPOCH
     Column(
-        "joined_journey_list",
-        String,
+        "departure_minutes",
+        Integer,
         nullable=False,
     ),
     Column(
@@ -55,7 +189,34 @@ JOURNEYS = Table(
         Integer,
         nullable=False,
     ),
-    UniqueConstraint("joined_journey_list", name="uidx_joined_journey_list"),
+    # the wait time at each station, in the same order as joined_journey_list,
+    # so that a journey can be retrieved without joining to journey_stations
+    Column(
+        "joined_wait_times",
+        String,
+        nullable=False,
+        server_default="",
+    ),
+    # the position of the station where the wait was longer than the max wait
+    # time, if the journey was not retrieved any further
+    Column(
+        "exceeded_wait_station_order",
+        Integer,
+        nullable=True,
+    ),
+    UniqueConstraint(
+        "route_id",
+        "departure_minutes",
+        name="uidx_journeys_route_departure",
+    ),
+    Index(
+        "idx_journeys_route_lookup",
+        "route_id",
+        "departure_minutes",
+        "total_journey_time_mins",
+        "joined_wait_times",
+        "exceeded_wait_station_order",
+    ),
 )
 
 
@@ -75,28 +236,25 @@ class Journeys(Base):
 JOURNEY_STATIONS = Table(
     "journey_stations",
     Base.metadata,
-    Column(
-        "journey_station_id",
-        Integer,
-        primary_key=True,
-    ),
     Column(
         "journey_id",
-        String,
+        Integer,
         ForeignKey(
             "journeys.journey_id",
             ondelete="Cascade",
             onupdate="Cascade",
         ),
+        primary_key=True,
     ),
     Column(
         "station_order",
         Integer,
-        nullable=False,
+        primary_key=True,
     ),
     Column(
-        "station_identifier",
-        String,
+        "station_id",
+        Integer,
+        ForeignKey("stations.station_id"),
         nullable=False,
     ),
     Column(
@@ -104,6 +262,30 @@ JOURNEY_STATIONS = Table(
         Integer,
         nullable=True,
     ),
+    # the arrival at the station, in whole minutes since journey_lookup.EPOCH,
+    # which for the first station is the departure of the journey, so that
+    # any prefix or sub-route of a stored journey can be found from its first
+    # station and departure date and time
+    Column(
+        "arrival_minutes",
+        Integer,
+        nullable=True,
+    ),
+    # the departure of the train from the station, after the wait
+    Column(
+        "departure_minutes",
+        Integer,
+        nullable=True,
+    ),
+    # the primary key is held in the index, so it covers the sub-route lookup
+    Index(
+        "idx_journey_stations_station_arrival",
+        "station_id",
+        "arrival_minutes",
+    ),
+    # the rows are stored in the order of the primary key, so the stations of
+    # a journey are together, without a rowid or a second index
+    sqlite_with_rowid=False,
 )
 
 
@@ -114,64 +296,551 @@ class JourneyStations(Base):
 
     __table__ = JOURNEY_STATIONS
 
-    __table_args__ = (
-        Index(
-            "idx_station_ident_journey_id",
-            "station_identifier",
-            "journey_id",
-        ),
+
+JOURNEY_LEGS = Table(
+    "journey_legs",
+    Base.metadata,
+    Column(
+        "journey_leg_id",
+        Integer,
+        primary_key=True,
+    ),
+    Column(
+        "origin_station_identifier",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "destination_station_identifier",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "earliest_departure_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    Column(
+        "wait_time_mins",
+        Integer,
+        nullable=False,
+    ),
+    Column(
+        "journey_time_mins",
+        Integer,
+        nullable=False,
+    ),
+    Column(
+        "arrival_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    UniqueConstraint(
+        "origin_station_identifier",
+        "destination_station_identifier",
+        "earliest_departure_date_time",
+        name="uidx_journey_leg",
+    ),
+)
+
+
+class JourneyLegs(Base):
+    """
+    class to define the JourneyLegs table
+
+    Each row is a single processed leg between two stations, so that
+    different routes which share a leg only need to request it once
+    """
+
+    __table__ = JOURNEY_LEGS
+
+
+DEPARTURES = Table(
+    "departures",
+    Base.metadata,
+    Column(
+        "departure_id",
+        Integer,
+        primary_key=True,
+    ),
+    Column(
+        "origin_station_identifier",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "destination_station_identifier",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "departure_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    Column(
+        "arrival_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    Column(
+        "journey_time_mins",
+        Integer,
+        nullable=False,
+    ),
+    Column(
+        "window_start_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    Column(
+        "retrieved_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    UniqueConstraint(
+        "origin_station_identifier",
+        "destination_station_identifier",
+        "departure_date_time",
+        "window_start_date_time",
+        name="uidx_departure_window",
+    ),
+    Index(
+        "idx_departures_origin_destination_departure",
+        "origin_station_identifier",
+        "destination_station_identifier",
+        "departure_date_time",
+    ),
+)
+
+
+class Departures(Base):
+    """
+    class to define the Departures table
+
+    Each row is one route returned by the api for an origin and destination.
+    The window_start_date_time is the earliest departure that was requested,
+    so every departure between it and the latest departure stored for
+    that window is known
+    """
+
+    __table__ = DEPARTURES
+
+
+FAILED_LEGS = Table(
+    "failed_legs",
+    Base.metadata,
+    Column(
+        "failed_leg_id",
+        Integer,
+        primary_key=True,
+    ),
+    Column(
+        "origin_station_identifier",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "destination_station_identifier",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "earliest_departure_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    Column(
+        "reason",
+        String,
+        nullable=False,
+    ),
+    Column(
+        "retrieved_date_time",
+        DateTime(timezone=True),
+        nullable=False,
+    ),
+    UniqueConstraint(
+        "origin_station_identifier",
+        "destination_station_identifier",
+        "earliest_departure_date_time",
+        name="uidx_failed_leg",
+    ),
+)
+
+
+class FailedLegs(Base):
+    """
+    class to define the FailedLegs table
+
+    Each row is a leg the api returned no journey for, with the reason,
+    so that it is not requested again until it is out of date
+    """
+
+    __table__ = FAILED_LEGS
+
+
+def _store_journeys_statement(with_times: bool):
+    """
+    the upsert of the journeys, returning the journeys inserted or replaced.
+    Only a journey that stopped early is replaced, by one that went further,
+    and if the journeys have the times of their stations, a journey stored
+    without them is also replaced, by one that went as far
+    """
+    statement = insert(JOURNEYS)
+    stored_order = JOURNEYS.c.exceeded_wait_station_order
+    new_order = statement.excluded.exceeded_wait_station_order
+    replace = stored_order.is_not(None) & (
+        new_order.is_(None) | (new_order > stored_order)
+    )
+    if with_times:
+        # a station that was retrieved, as it has a wait, but has no arrival
+        missing_times = (
+            select(JOURNEY_STATIONS.c.journey_id)
+            .where(JOURNEY_STATIONS.c.journey_id == JOURNEYS.c.journey_id)
+            .where(JOURNEY_STATIONS.c.wait_time_mins.is_not(None))
+            .where(JOURNEY_STATIONS.c.arrival_minutes.is_(None))
+            .exists()
+        )
+        replace = replace | (
+            missing_times & (new_order.is_(None) | (new_order >= stored_order))
+        )
+    return statement.on_conflict_do_update(
+        index_elements=["route_id", "departure_minutes"],
+        set_={
+            "total_journey_time_mins": statement.excluded.total_journey_time_mins,
+            "joined_wait_times": statement.excluded.joined_wait_times,
+            "exceeded_wait_station_order": new_order,
+        },
+        where=replace,
+    ).returning(
+        JOURNEYS.c.journey_id,
+        JOURNEYS.c.route_id,
+        JOURNEYS.c.departure_minutes,
+    )
+
+
+# the statements of the journey lookups are built once, with bound parameters,
+# so each call reuses the compiled statement from the engine's query cache
+# rather than building and compiling the statement again. The sqlite upserts
+# have no cache key, so are compiled on each call, but still only built once
+_RETRIEVE_JOURNEY = (
+    select(
+        JOURNEYS.c.total_journey_time_mins,
+        JOURNEYS.c.joined_wait_times,
+        JOURNEYS.c.exceeded_wait_station_order,
+    )
+    .join(ROUTES, ROUTES.c.route_id == JOURNEYS.c.route_id)
+    .where(JOURNEYS.c.route_id == bindparam("route_id"))
+    .where(JOURNEYS.c.departure_minutes == bindparam("departure_minutes"))
+    # the route_id of another route with the same hash is not stored
+    .where(ROUTES.c.joined_journey_list == bindparam("joined_journey_list"))
+    .limit(1)
+)
+_STORE_STATIONS = insert(STATIONS).on_conflict_do_nothing()
+_RETRIEVE_STATIONS = select(STATIONS.c.station_identifier, STATIONS.c.station_id).where(
+    STATIONS.c.station_identifier.in_(
+        bindparam("station_identifiers", expanding=True)
+    )
+)
+_STORE_ROUTES = insert(ROUTES).on_conflict_do_nothing()
+_RETRIEVE_ROUTES = select(ROUTES.c.route_id, ROUTES.c.joined_journey_list).where(
+    ROUTES.c.route_id.in_(bindparam("route_ids", expanding=True))
+)
+_STORE_JOURNEYS = _store_journeys_statement(with_times=False)
+_STORE_JOURNEYS_WITH_TIMES = _store_journeys_statement(with_times=True)
+_DELETE_JOURNEY_STATIONS = JOURNEY_STATIONS.delete().where(
+    JOURNEY_STATIONS.c.journey_id.in_(bindparam("journey_ids", expanding=True))
+)
+_STORE_JOURNEY_STATIONS = JOURNEY_STATIONS.insert()
+_FIRST_STATION = JOURNEY_STATIONS.alias("first_station")
+_SUB_ROUTE_STATION = JOURNEY_STATIONS.alias("sub_route_station")
+# the stations of every stored journey that arrived at the first station of
+# the sub-route at its departure date and time, from that station onwards
+_RETRIEVE_SUB_JOURNEY = (
+    select(
+        _SUB_ROUTE_STATION.c.journey_id,
+        _FIRST_STATION.c.station_order.label("first_station_order"),
+        STATIONS.c.station_identifier,
+        _SUB_ROUTE_STATION.c.wait_time_mins,
+        _SUB_ROUTE_STATION.c.arrival_minutes,
+    )
+    .select_from(
+        _FIRST_STATION.join(
+            _SUB_ROUTE_STATION,
+            (_SUB_ROUTE_STATION.c.journey_id == _FIRST_STATION.c.journey_id)
+            & (_SUB_ROUTE_STATION.c.station_order >= _FIRST_STATION.c.station_order)
+            & (
+                _SUB_ROUTE_STATION.c.station_order
+                < _FIRST_STATION.c.station_order + bindparam("station_count")
+            ),
+        ).join(STATIONS, STATIONS.c.station_id == _SUB_ROUTE_STATION.c.station_id)
+    )
+    .where(
+        _FIRST_STATION.c.station_id
+        == select(STATIONS.c.station_id)
+        .where(STATIONS.c.station_identifier == bindparam("station_identifier"))
+        .scalar_subquery()
+    )
+    .where(_FIRST_STATION.c.arrival_minutes == bindparam("departure_minutes"))
+    .where(_FIRST_STATION.c.wait_time_mins.is_not(None))
+    .order_by(
+        _SUB_ROUTE_STATION.c.journey_id,
+        _FIRST_STATION.c.station_order,
+        _SUB_ROUTE_STATION.c.station_order,
+    )
+)
+_FIRST_STATION_IDENTIFIER = STATIONS.alias("first_station_identifier")
+
+
+def _retrieve_sub_journeys_statement(
+    first_stations: list[tuple[str, int]], station_count: int
+):
+    """
+    the stations of every stored journey that arrived at any of the first
+    stations at its departure minutes, as _RETRIEVE_SUB_JOURNEY, with the
+    first station and its arrival of each row. The first stations are
+    compared with an OR of each, so that sqlite looks each up with the
+    idx_journey_stations_station_arrival index. The values are bound, so a
+    statement is compiled once for each number of first stations
+
+    Args:
+        first_stations (list[tuple[str, int]]): the station identifier, and the departure minutes
+        station_count (int): the number of stations of the longest sub-route
+    """
+    return (
+        select(
+            _FIRST_STATION_IDENTIFIER.c.station_identifier.label(
+                "first_station_identifier"
+            ),
+            _FIRST_STATION.c.arrival_minutes.label("first_station_arrival_minutes"),
+            _SUB_ROUTE_STATION.c.journey_id,
+            _FIRST_STATION.c.station_order.label("first_station_order"),
+            _SUB_ROUTE_STATION.c.station_order,
+            STATIONS.c.station_identifier,
+            _SUB_ROUTE_STATION.c.wait_time_mins,
+            _SUB_ROUTE_STATION.c.arrival_minutes,
+        )
+        .select_from(
+            _FIRST_STATION.join(
+                _FIRST_STATION_IDENTIFIER,
+                _FIRST_STATION_IDENTIFIER.c.station_id == _FIRST_STATION.c.station_id,
+            )
+            .join(
+                _SUB_ROUTE_STATION,
+                (_SUB_ROUTE_STATION.c.journey_id == _FIRST_STATION.c.journey_id)
+                & (
+                    _SUB_ROUTE_STATION.c.station_order
+                    >= _FIRST_STATION.c.station_order
+                )
+                & (
+                    _SUB_ROUTE_STATION.c.station_order
+                    < _FIRST_STATION.c.station_order + station_count
+                ),
+            )
+            .join(STATIONS, STATIONS.c.station_id == _SUB_ROUTE_STATION.c.station_id)
+        )
+        .where(
+            or_(
+                *[
+                    (
+                        _FIRST_STATION.c.station_id
+                        == select(STATIONS.c.station_id)
+                        .where(STATIONS.c.station_identifier == station_identifier)
+                        .scalar_subquery()
+                    )
+                    & (_FIRST_STATION.c.arrival_minutes == departure_minutes)
+                    for station_identifier, departure_minutes in first_stations
+                ]
+            )
+        )
+        .where(_FIRST_STATION.c.wait_time_mins.is_not(None))
+        .order_by(
+            _SUB_ROUTE_STATION.c.journey_id,
+            _FIRST_STATION.c.station_order,
+            _SUB_ROUTE_STATION.c.station_order,
+        )
     )
 
 
 def initialise_database() -> None:
     """
-    Initialise the database
+    Initialise the database, migrating any existing tables to the current schema.
+    This is safe to call from many threads at once, and only creates the
+    tables that do not exist
     """
-    with Session() as session:
+    # imported here, as the migrations module describes changes to these tables
+    from src.data_model.db.migrations import migrate_database
+
+    with _initialise_lock, Session() as session:
         try:
             session.get_bind().dispose()
         except Exception:
             pass
-        Base.metadata.create_all(session.get_bind())
+        Base.metadata.create_all(session.get_bind(), checkfirst=True)
+        migrate_database(session.get_bind())
 
 
+@traced("db.store_journey")
 def store_journey(journey: JourneyDetails) -> None:
     """
-    Store a journey
+    Store a journey. If the journey has already been stored for this
+    departure date and time, for example by a concurrent request, then the
+    existing journey is kept, unless it stopped at an earlier station, or was
+    stored without the times of its stations
 
     Args:
         journey (JourneyDetails): The description of the journey as follows
 
     """
-    db_session = Session()
-    joined_journey_list = "_".join(
-        [x["station_id"] for x in journey.train_stations_with_wait]
-    )
-    journey_row = Journeys(
-        departure_date_time=journey.departure_date_time,
-        joined_journey_list=joined_journey_list,
-        total_journey_time_mins=journey.time_in_mins,
-    )
-    db_session.add(journey_row)
-    db_session.flush()
-    journey_id = journey_row.journey_id
+    store_journeys(journeys=[journey])
+
 
-    for idx, station in enumerate(journey.train_stations_with_wait):
-        journey_station_row = JourneyStations(
-            journey_id=journey_id,
-            station_order=idx,
-            station_identifier=station.get("station_id", None),
-            wait_time_mins=station.get("wait_time", None),
+@traced("db.store_journeys")
+def store_journeys(journeys: list[JourneyDetails]) -> None:
+    """
+    Store many journeys in a single transaction. Any journey already stored
+    for its departure date and time is kept, unless it stopped at an earlier
+    station than the journey being stored, or was stored without the times
+    of its stations
+
+    Args:
+        journeys (list[JourneyDetails]): The journeys to store
+
+    """
+    try:
+        _store_journeys(journeys=journeys)
+    except OperationalError:
+        # the tables are missing, or have not been migrated to this schema
+        initialise_database()
+        _store_journeys(journeys=journeys)
+
+
+def _store_journeys(journeys: list[JourneyDetails]) -> None:
+    """
+    Store the journeys in a single transaction. Their new stations and routes
+    are stored first, then the journeys with one executemany insert, and
+    their stations with another
+    """
+    journey_rows: dict[tuple[int, int], tuple[JourneyDetails, dict[str, Any]]] = {}
+    joined_journey_lists: dict[int, str] = {}
+    for journey in journeys:
+        departure_minutes = to_epoch_minutes(journey.departure_date_time)
+        if departure_minutes is None:
+            # only journeys departing on a whole minute are stored
+            continue
+        station_ids = journey.train_stations_with_wait.station_ids()
+        route_id = route_hash(station_ids)
+        joined_journey_list = "_".join(station_ids)
+        if joined_journey_lists.setdefault(route_id, joined_journey_list) != (
+            joined_journey_list
+        ):
+            # another route in this batch has the same route_id
+            continue
+        journey_rows.setdefault(
+            (route_id, departure_minutes),
+            (
+                journey,
+                {
+                    "route_id": route_id,
+                    "departure_minutes": departure_minutes,
+                    "total_journey_time_mins": journey.time_in_mins,
+                    "joined_wait_times": join_wait_times(
+                        journey.train_stations_with_wait.wait_times()
+                    ),
+                    "exceeded_wait_station_order": journey.exceeded_wait_station_order,
+                },
+            ),
         )
-        db_session.add(journey_station_row)
-    db_session.commit()
+    if not journey_rows:
+        return
+
+    with Session() as db_session, db_session.begin():
+        station_identifiers = {
+            x
+            for journey, _ in journey_rows.values()
+            for x in journey.train_stations_with_wait.station_ids()
+        }
+        db_session.execute(
+            _STORE_STATIONS, [{"station_identifier": x} for x in station_identifiers]
+        )
+        interned_station_ids = dict(
+            db_session.execute(
+                _RETRIEVE_STATIONS, {"station_identifiers": list(station_identifiers)}
+            ).all()
+        )
+        db_session.execute(
+            _STORE_ROUTES,
+            [
+                {"route_id": x, "joined_journey_list": y}
+                for x, y in joined_journey_lists.items()
+            ],
+        )
+        stored_routes = dict(
+            db_session.execute(
+                _RETRIEVE_ROUTES, {"route_ids": list(joined_journey_lists)}
+            ).all()
+        )
+        # a route whose route_id is taken by another route is not stored
+        journey_rows = {
+            key: value
+            for key, value in journey_rows.items()
+            if stored_routes[key[0]] == joined_journey_lists[key[0]]
+        }
+        if not journey_rows:
+            return
+
+        # journeys already stored, and kept, are not returned
+        inserted_rows = []
+        for statement, with_times in [
+            (_STORE_JOURNEYS, False),
+            (_STORE_JOURNEYS_WITH_TIMES, True),
+        ]:
+            rows = [
+                x
+                for journey, x in journey_rows.values()
+                if (journey.arrival_offsets_secs is not None) == with_times
+            ]
+            if rows:
+                inserted_rows += db_session.execute(statement, rows).all()
+        # the stations of any journey that has been replaced
+        db_session.execute(
+            _DELETE_JOURNEY_STATIONS,
+            {"journey_ids": [x.journey_id for x in inserted_rows]},
+        )
+        journey_station_rows = []
+        for row in inserted_rows:
+            journey, _ = journey_rows[(row.route_id, row.departure_minutes)]
+            stations = journey.train_stations_with_wait
+            for idx, (station_id, wait_time) in enumerate(
+                zip(stations.station_ids(), stations.wait_times())
+            ):
+                journey_station_rows.append(
+                    {
+                        "journey_id": row.journey_id,
+                        "station_order": idx,
+                        "station_id": interned_station_ids[station_id],
+                        "wait_time_mins": wait_time,
+                        "arrival_minutes": to_epoch_minutes(
+                            journey.station_arrival_date_time(idx)
+                        ),
+                        "departure_minutes": to_epoch_minutes(
+                            journey.station_departure_date_time(idx)
+                        ),
+                    }
+                )
+        if journey_station_rows:
+            db_session.execute(_STORE_JOURNEY_STATIONS, journey_station_rows)
 
 
+@traced("db.retrieve_journey")
 def retrieve_journey(
     station_list: list[str], departure_date_time: datetime
 ) -> JourneyDetails:
     """
     retrieve a journey from the database based on the station list provided.
+    This is a single query of the journeys table, using the
+    idx_journeys_route_lookup index, and the primary key of the routes table
 
     Args:
         station_list (list[str]): a list of the station identifiers in the order that the stations should be visited
@@ -181,35 +850,550 @@ def retrieve_journey(
 
 
     """
-    db_session = Session()
-    query = (
-        db_session.query(Journeys, JourneyStations)
-        .join(JourneyStations, JourneyStations.journey_id == Journeys.journey_id)
-        .filter(Journeys.joined_journey_list == "_".join(station_list))
-        .filter(Journeys.departure_date_time == departure_date_time)
-        .order_by(JourneyStations.station_order)
+    row = None
+    departure_minutes = to_epoch_minutes(departure_date_time)
+    with Session() as db_session:
+        try:
+            if departure_minutes is not None:
+                row = db_session.execute(
+                    _RETRIEVE_JOURNEY,
+                    {
+                        "route_id": route_hash(station_list),
+                        "departure_minutes": departure_minutes,
+                        "joined_journey_list": "_".join(station_list),
+                    },
+                ).first()
+        except OperationalError:
+            initialise_database()
+
+    if row is None:
+        return JourneyDetails(
+            time_in_mins=None,
+            departure_date_time=departure_date_time,
+            train_stations_with_wait=[],
+        )
+    return build_journey_details(
+        station_list=station_list,
+        departure_date_time=departure_date_time,
+        total_journey_time_mins=row.total_journey_time_mins,
+        joined_wait_times=row.joined_wait_times,
+        exceeded_wait_station_order=row.exceeded_wait_station_order,
     )
 
-    rows = []
-    try:
-        rows = query.all()
-    except OperationalError:
-        initialise_database()
 
-    time_in_mins: Union[int, None] = None
-    train_stations_with_wait = []
-    for row in query.all():
-        if not time_in_mins:
-            time_in_mins = row[0].total_journey_time_mins
-            departure_date_time = row[0].departure_date_time
-        train_stations_with_wait.append(
+@traced("db.retrieve_sub_journey")
+def retrieve_sub_journey(
+    station_list: list[str], departure_date_time: datetime
+) -> Union[JourneyDetails, None]:
+    """
+    retrieve a journey from the stations of the stored journeys it is a
+    prefix, or a contiguous sub-route, of. The sub-route must depart its
+    first station at the time a stored journey arrived there, which for a
+    prefix is the departure of the stored journey. This is a single query
+    of the journey_stations table, using the idx_journey_stations_station_arrival
+    index
+
+    Args:
+        station_list (list[str]): a list of the station identifiers in the order that the stations should be visited
+        departure_date_time (datetime): the departure date and time
+    Returns:
+        JourneyDetails, or None if no stored journey covers the sub-route
+    """
+    departure_minutes = to_epoch_minutes(departure_date_time)
+    if departure_minutes is None:
+        return None
+    with Session() as db_session:
+        try:
+            rows = db_session.execute(
+                _RETRIEVE_SUB_JOURNEY,
+                {
+                    "station_identifier": station_list[0],
+                    "departure_minutes": departure_minutes,
+                    "station_count": len(station_list),
+                },
+            ).all()
+        except OperationalError:
+            initialise_database()
+            return None
+    return build_sub_journey(
+        station_list=station_list,
+        departure_date_time=departure_date_time,
+        rows=rows,
+    )
+
+
+@traced("db.retrieve_sub_journeys")
+def retrieve_sub_journeys(
+    journey_keys: list[tuple[list[str], datetime]],
+    chunk_size: int = 250,
+) -> dict[tuple[tuple[str, ...], datetime], JourneyDetails]:
+    """
+    retrieve many journeys from the stations of the stored journeys they are a
+    sub-route of, in the same way as retrieve_sub_journey, with one query per
+    chunk of first stations and departure times rather than one query per journey
+
+    Args:
+        journey_keys (list[tuple[list[str], datetime]]): the station list and departure date and time of each journey
+        chunk_size (int): the number of first stations in each query, to keep
+            under the sqlite variable and expression depth limits
+    Returns:
+        the journeys that stored journeys cover, keyed on the tuple of the
+        station list and the departure date and time
+    """
+    journeys: dict[tuple[tuple[str, ...], datetime], JourneyDetails] = {}
+    # the journeys departing each first station at each departure minutes
+    requested_keys: dict[tuple[str, int], list[tuple[list[str], datetime]]] = {}
+    for station_list, departure_date_time in journey_keys:
+        departure_minutes = to_epoch_minutes(departure_date_time)
+        if departure_minutes is not None:
+            requested_keys.setdefault((station_list[0], departure_minutes), []).append(
+                (station_list, departure_date_time)
+            )
+    if not requested_keys:
+        return journeys
+    station_count = max(len(x) for x, _ in journey_keys)
+    requested_pairs = list(requested_keys)
+    rows_by_pair: dict[tuple[str, int], list[Any]] = {x: [] for x in requested_pairs}
+    with Session() as db_session:
+        for idx in range(0, len(requested_pairs), chunk_size):
+            try:
+                rows = db_session.execute(
+                    _retrieve_sub_journeys_statement(
+                        first_stations=requested_pairs[idx : idx + chunk_size],
+                        station_count=station_count,
+                    )
+                ).all()
+            except OperationalError:
+                initialise_database()
+                return journeys
+            for row in rows:
+                rows_by_pair[
+                    (row.first_station_identifier, row.first_station_arrival_minutes)
+                ].append(row)
+
+    for pair, keys in requested_keys.items():
+        for station_list, departure_date_time in keys:
+            journey_details = build_sub_journey(
+                station_list=station_list,
+                departure_date_time=departure_date_time,
+                # only the stations of this sub-route, of the longest one requested
+                rows=[
+                    (
+                        x.journey_id,
+                        x.first_station_order,
+                        x.station_identifier,
+                        x.wait_time_mins,
+                        x.arrival_minutes,
+                    )
+                    for x in rows_by_pair[pair]
+                    if x.station_order < x.first_station_order + len(station_list)
+                ],
+            )
+            if journey_details is not None:
+                journeys[(tuple(station_list), departure_date_time)] = journey_details
+    return journeys
+
+
+@traced("db.retrieve_journeys")
+def retrieve_journeys(
+    journey_keys: list[tuple[list[str], datetime]],
+    chunk_size: int = 500,
+) -> dict[tuple[tuple[str, ...], datetime], JourneyDetails]:
+    """
+    retrieve many journeys from the database, with one query per chunk of
+    journeys rather than one query per journey
+
+    Args:
+        journey_keys (list[tuple[list[str], datetime]]): the station list and departure date and time of each journey
+        chunk_size (int): the number of journeys in each query, to keep under the sqlite variable limit
+    Returns:
+        the journeys that are stored, keyed on the tuple of the station list and the departure date and time
+    """
+    journeys: dict[tuple[tuple[str, ...], datetime], JourneyDetails] = {}
+    requested_keys = {}
+    for station_list, departure_date_time in journey_keys:
+        departure_minutes = to_epoch_minutes(departure_date_time)
+        if departure_minutes is not None:
+            requested_keys[(route_hash(station_list), departure_minutes)] = (
+                station_list,
+                departure_date_time,
+            )
+    requested_pairs = list(requested_keys)
+    with Session() as db_session:
+        for idx in range(0, len(requested_pairs), chunk_size):
+            chunk = requested_pairs[idx : idx + chunk_size]
+            try:
+                rows = (
+                    db_session.query(
+                        Journeys.route_id,
+                        Journeys.departure_minutes,
+                        Journeys.total_journey_time_mins,
+                        Journeys.joined_wait_times,
+                        Journeys.exceeded_wait_station_order,
+                        Routes.joined_journey_list,
+                    )
+                    .join(Routes, Routes.route_id == Journeys.route_id)
+                    .filter(
+                        tuple_(Journeys.route_id, Journeys.departure_minutes).in_(chunk)
+                    )
+                    .all()
+                )
+            except OperationalError:
+                initialise_database()
+                return journeys
+
+            for row in rows:
+                station_list, departure_date_time = requested_keys[
+                    (row.route_id, row.departure_minutes)
+                ]
+                # the route_id of another route with the same hash is not stored
+                if row.joined_journey_list != "_".join(station_list):
+                    continue
+                journeys[(tuple(station_list), departure_date_time)] = (
+                    build_journey_details(
+                        station_list=station_list,
+                        departure_date_time=departure_date_time,
+                        total_journey_time_mins=row.total_journey_time_mins,
+                        joined_wait_times=row.joined_wait_times,
+                        exceeded_wait_station_order=row.exceeded_wait_station_order,
+                    )
+                )
+    return journeys
+
+
+@traced("db.store_leg")
+def store_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_date_time: datetime,
+    leg: dict[str, Any],
+) -> None:
+    """
+    Store a processed leg. If the leg has already been stored, then the
+    existing row is kept
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_date_time (datetime): the earliest the train could depart
+        leg (dict[str, Any]): the processed leg, as returned by transport_api.process_response
+    """
+    statement = (
+        insert(JOURNEY_LEGS)
+        .values(
+            origin_station_identifier=origin_station,
+            destination_station_identifier=destination,
+            earliest_departure_date_time=earliest_departure_date_time,
+            wait_time_mins=leg["wait_time"],
+            journey_time_mins=leg["journey_time"],
+            arrival_date_time=leg["arrival_time"],
+        )
+        .on_conflict_do_nothing(
+            index_elements=[
+                "origin_station_identifier",
+                "destination_station_identifier",
+                "earliest_departure_date_time",
+            ]
+        )
+    )
+    with Session() as db_session:
+        db_session.execute(statement)
+        db_session.commit()
+
+
+@traced("db.retrieve_leg")
+def retrieve_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_date_time: datetime,
+) -> Union[dict[str, Any], None]:
+    """
+    retrieve a processed leg from the database
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_date_time (datetime): the earliest the train could depart
+    Returns:
+        the leg in the same format as transport_api.process_response, or None if not stored
+    """
+    with Session() as db_session:
+        try:
+            row = (
+                db_session.query(JourneyLegs)
+                .filter(JourneyLegs.origin_station_identifier == origin_station)
+                .filter(JourneyLegs.destination_station_identifier == destination)
+                .filter(
+                    JourneyLegs.earliest_departure_date_time
+                    == earliest_departure_date_time
+                )
+                .first()
+            )
+        except OperationalError:
+            initialise_database()
+            return None
+
+    if row is None:
+        return None
+    return {
+        "wait_time": row.wait_time_mins,
+        "journey_time": row.journey_time_mins,
+        "arrival_time": row.arrival_date_time,
+    }
+
+
+def departure_order(departure: dict[str, Any]) -> tuple[datetime, datetime]:
+    """
+    the order a leg's train is chosen in, from the departures at or after the
+    earliest departure time. Every path that answers a leg, from the api
+    response, the stored departures, or the timetable graph, takes the first
+    departure in this order, so the same leg has the same answer from each.
+    This is the earliest departure, and then the earliest arrival
+    """
+    return departure["departure_time"], departure["arrival_time"]
+
+
+@traced("db.store_departures")
+def store_departures(
+    origin_station: str,
+    destination: str,
+    window_start_date_time: datetime,
+    departures: list[dict[str, Any]],
+) -> None:
+    """
+    Store every departure returned by the api for an origin and destination
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        window_start_date_time (datetime): the earliest departure that was requested from the api
+        departures (list[dict[str, Any]]): the departures, each in the format
             {
-                "station_id": row[1].station_identifier,
-                "wait_time": row[1].wait_time_mins,
+                "departure_time": <datetime>,
+                "arrival_time": <datetime>,
+                "journey_time": <int>
             }
+    """
+    if not departures:
+        return
+    retrieved_date_time = datetime.now()
+    statement = (
+        insert(DEPARTURES)
+        .values(
+            [
+                {
+                    "origin_station_identifier": origin_station,
+                    "destination_station_identifier": destination,
+                    "departure_date_time": departure["departure_time"],
+                    "arrival_date_time": departure["arrival_time"],
+                    "journey_time_mins": departure["journey_time"],
+                    "window_start_date_time": window_start_date_time,
+                    "retrieved_date_time": retrieved_date_time,
+                }
+                # the first of the departures with the same departure time is
+                # kept, so they are inserted in the order a train is chosen in
+                for departure in sorted(departures, key=departure_order)
+            ]
         )
-    return JourneyDetails(
-        time_in_mins=time_in_mins,
-        departure_date_time=departure_date_time,
-        train_stations_with_wait=train_stations_with_wait,
+        .on_conflict_do_nothing(
+            index_elements=[
+                "origin_station_identifier",
+                "destination_station_identifier",
+                "departure_date_time",
+                "window_start_date_time",
+            ]
+        )
+    )
+    with Session() as db_session:
+        db_session.execute(statement)
+        db_session.commit()
+
+
+@traced("db.retrieve_next_departure")
+def retrieve_next_departure(
+    origin_station: str,
+    destination: str,
+    earliest_departure_date_time: datetime,
+    staleness_mins: int = defaults.DEPARTURES_STALENESS_MINS,
+) -> Union[dict[str, Any], None]:
+    """
+    retrieve the first stored departure at or after the earliest departure time.
+    Only departures from a window that started at or before the earliest
+    departure time are used, as otherwise an earlier train may be missing
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_date_time (datetime): the earliest the train could depart
+        staleness_mins (int): ignore departures retrieved longer ago than this
+    Returns:
+        the departure in the format given to store_departures, or None if not stored
+    """
+    retrieved_after = datetime.now() - timedelta(minutes=staleness_mins)
+    with Session() as db_session:
+        try:
+            row = (
+                db_session.query(Departures)
+                .filter(Departures.origin_station_identifier == origin_station)
+                .filter(Departures.destination_station_identifier == destination)
+                .filter(Departures.departure_date_time >= earliest_departure_date_time)
+                .filter(
+                    Departures.window_start_date_time <= earliest_departure_date_time
+                )
+                .filter(Departures.retrieved_date_time >= retrieved_after)
+                # the same order as departure_order
+                .order_by(Departures.departure_date_time, Departures.arrival_date_time)
+                .first()
+            )
+        except OperationalError:
+            initialise_database()
+            return None
+
+    if row is None:
+        return None
+    return {
+        "departure_time": row.departure_date_time,
+        "arrival_time": row.arrival_date_time,
+        "journey_time": row.journey_time_mins,
+    }
+
+
+def retrieve_departures(
+    pairs: list[tuple[str, str]],
+    staleness_mins: int = defaults.DEPARTURES_STALENESS_MINS,
+    chunk_size: int = 500,
+) -> dict[tuple[str, str], list[dict[str, Any]]]:
+    """
+    retrieve every stored departure for many origins and destinations,
+    with one query per chunk of pairs
+
+    Args:
+        pairs (list[tuple[str, str]]): the origin and destination station ids
+        staleness_mins (int): ignore departures retrieved longer ago than this
+        chunk_size (int): the number of pairs in each query, to keep under the sqlite variable limit
+    Returns:
+        the departures of each pair, in the format given to store_departures,
+        with the "window_start_time" and "retrieved_time" of each
+    """
+    retrieved_after = datetime.now() - timedelta(minutes=staleness_mins)
+    departures: dict[tuple[str, str], list[dict[str, Any]]] = {x: [] for x in pairs}
+    with Session() as db_session:
+        for idx in range(0, len(pairs), chunk_size):
+            try:
+                rows = (
+                    db_session.query(
+                        Departures.origin_station_identifier,
+                        Departures.destination_station_identifier,
+                        Departures.departure_date_time,
+                        Departures.arrival_date_time,
+                        Departures.journey_time_mins,
+                        Departures.window_start_date_time,
+                        Departures.retrieved_date_time,
+                    )
+                    .filter(
+                        tuple_(
+                            Departures.origin_station_identifier,
+                            Departures.destination_station_identifier,
+                        ).in_(pairs[idx : idx + chunk_size])
+                    )
+                    .filter(Departures.retrieved_date_time >= retrieved_after)
+                    .all()
+                )
+            except OperationalError:
+                initialise_database()
+                return departures
+
+            for row in rows:
+                departures[
+                    (row.origin_station_identifier, row.destination_station_identifier)
+                ].append(
+                    {
+                        "departure_time": row.departure_date_time,
+                        "arrival_time": row.arrival_date_time,
+                        "journey_time": row.journey_time_mins,
+                        "window_start_time": row.window_start_date_time,
+                        "retrieved_time": row.retrieved_date_time,
+                    }
+                )
+    return departures
+
+
+@traced("db.store_failed_leg")
+def store_failed_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_date_time: datetime,
+    reason: str,
+) -> None:
+    """
+    Store a leg that the api returned no journey for. If the leg has already
+    been stored, then the reason and the time it was retrieved are updated
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_date_time (datetime): the earliest the train could depart
+        reason (str): why there is no journey
+    """
+    statement = insert(FAILED_LEGS).values(
+        origin_station_identifier=origin_station,
+        destination_station_identifier=destination,
+        earliest_departure_date_time=earliest_departure_date_time,
+        reason=reason,
+        retrieved_date_time=datetime.now(),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[
+            "origin_station_identifier",
+            "destination_station_identifier",
+            "earliest_departure_date_time",
+        ],
+        set_={
+            "reason": statement.excluded.reason,
+            "retrieved_date_time": statement.excluded.retrieved_date_time,
+        },
     )
+    with Session() as db_session:
+        db_session.execute(statement)
+        db_session.commit()
+
+
+@traced("db.retrieve_failed_leg")
+def retrieve_failed_leg(
+    origin_station: str,
+    destination: str,
+    earliest_departure_date_time: datetime,
+) -> Union[dict[str, Any], None]:
+    """
+    retrieve a leg that the api returned no journey for
+
+    Args:
+        origin_station (str): the station id of the departure point
+        destination (str): the station id of the destination
+        earliest_departure_date_time (datetime): the earliest the train could depart
+    Returns:
+        {
+            "reason": <str>,
+            "retrieved_time": <datetime>
+        }
+        or None if not stored
+    """
+    with Session() as db_session:
+        try:
+            row = (
+                db_session.query(FailedLegs.reason, FailedLegs.retrieved_date_time)
+                .filter(FailedLegs.origin_station_identifier == origin_station)
+                .filter(FailedLegs.destination_station_identifier == destination)
+                .filter(
+                    FailedLegs.earliest_departure_date_time
+                    == earliest_departure_date_time
+                )
+                .first()
+            )
+        except OperationalError:
+            initialise_database()
+            return None
+
+    if row is None:
+        return None
+    return {"reason": row.reason, "retrieved_time": row.retrieved_date_time}
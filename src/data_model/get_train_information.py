@@ -5,21 +5,58 @@ It should look into the database, and if it is stored there, then return this
 else it should go to request the information from the transport api,
 store a copy in the database, and then return the information
 
+Recently used journeys are also held in memory, in front of the database
+
+A journey that stopped at a wait longer than the max wait time is cached
+too, and answers any later request where that wait is also too long
+
+A journey that is not stored itself may be a prefix, or a contiguous
+sub-route, of a stored journey, and is then answered from its stations
+without calling the api
+
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Iterable, Union
 from src.data_model.dataclasses import JourneyDetails, JourneyRequest
 from src.data_model.db.trains import (
     store_journey,
+    store_journeys,
     retrieve_journey as retrieve_from_database,
+    retrieve_journeys as retrieve_many_from_database,
+    retrieve_sub_journey,
+    retrieve_sub_journeys as retrieve_many_sub_journeys,
 )
-from src.data_model.api.transport_api import retrieve_journey as retrieve_from_api
+from src.data_model.api.transport_api import (
+    NoJourneyFound,
+    retrieve_journey as retrieve_from_api,
+)
+from src.data_model.instrumentation import (
+    in_current_span,
+    increment,
+    set_attribute,
+    traced,
+)
+from src.data_model.memory_cache import MemoryCache
+from src.data_model.single_flight import SingleFlight
+from src import defaults
 
+# identical requests made at the same time share one lookup
+_journey_flights = SingleFlight()
 
+journey_memory_cache = MemoryCache(
+    max_size=defaults.MEMORY_CACHE_MAX_JOURNEYS,
+    ttl_secs=defaults.MEMORY_CACHE_TTL_SECS,
+)
+
+
+@traced("retrieve_journey")
 def retrieve_journey(journey_request: JourneyRequest) -> JourneyDetails:
     """
     retrieve a journey from models based on the station list provided.
-    store the journey in the database if it wasn't found from there
+    store the journey in the database if it wasn't found from there.
+    Concurrent identical requests wait for, and share, a single lookup
 
     Args:
         journey_request (JourneyRequest): The journey that has been requested
@@ -27,23 +64,169 @@ def retrieve_journey(journey_request: JourneyRequest) -> JourneyDetails:
         JourneyDetails
 
     """
+    return _journey_flights.do(
+        journey_request.cache_key(),
+        lambda: _retrieve_journey(journey_request=journey_request),
+    )
+
+
+def _retrieve_journey(journey_request: JourneyRequest) -> JourneyDetails:
+    """
+    retrieve a journey from the database, or from the api if it is not cached
+    """
 
     station_list = journey_request.station_identifiers
     departure_date_time = journey_request.departure_date_time
+    memory_cache_key = journey_key(journey_request=journey_request)
+    max_wait_time = journey_request.max_wait_time
+
+    set_attribute("stations", len(station_list))
+    journey_details = journey_memory_cache.get(memory_cache_key)
+    if journey_details is not None and journey_details.answers(max_wait_time):
+        increment("journey_cache.memory_hits")
+        set_attribute("source", "memory")
+        return journey_details
 
     journey_details = retrieve_from_database(
         station_list=station_list,
         departure_date_time=departure_date_time,
     )
 
-    if journey_details.time_in_mins is not None:
+    if journey_details.time_in_mins is not None and journey_details.answers(
+        max_wait_time
+    ):
+        journey_memory_cache.set(memory_cache_key, journey_details)
+        increment("journey_cache.database_hits")
+        set_attribute("source", "database")
+        return journey_details
+
+    journey_details = retrieve_sub_journey(
+        station_list=station_list,
+        departure_date_time=departure_date_time,
+    )
+    if journey_details is not None and journey_details.answers(max_wait_time):
+        journey_memory_cache.set(memory_cache_key, journey_details)
+        increment("journey_cache.sub_route_hits")
+        set_attribute("source", "sub_route")
         return journey_details
 
-    print("Not cached in database, retrieving from API")
+    increment("journey_cache.misses")
+    set_attribute("source", "api")
     journey_details = retrieve_from_api(
         journey_request=journey_request,
     )
     # cache the data
     store_journey(journey=journey_details)
+    journey_memory_cache.set(memory_cache_key, journey_details)
 
     return journey_details
+
+
+@traced("retrieve_journeys")
+def retrieve_journeys(
+    journey_requests: Iterable[JourneyRequest],
+    max_workers: int = defaults.BATCH_WORKERS,
+) -> list[Union[JourneyDetails, None]]:
+    """
+    retrieve many journeys at once. Identical journeys are only looked up once,
+    with the longest max wait time of any of their requests, the database is
+    queried for all of them together, and the journeys that are not cached
+    are retrieved from the api concurrently, and stored in a single transaction.
+    A journey the api has no journey for does not stop the rest of the batch
+
+    Args:
+        journey_requests (Iterable[JourneyRequest]): The journeys that have been requested
+        max_workers (int): the maximum number of journeys retrieved from the api at once
+    Returns:
+        list[Union[JourneyDetails, None]]: in the same order as the journey_requests,
+            or None where the api has no journey for the request
+    Raises:
+        Exception: any error other than NoJourneyFound, such as the api or
+            the database failing, once the journeys retrieved have been stored
+
+    """
+    journey_requests = list(journey_requests)
+    unique_requests: dict[tuple[tuple[str, ...], datetime], JourneyRequest] = {}
+    for journey_request in journey_requests:
+        key = journey_key(journey_request)
+        # a journey that answers the longest max wait time answers them all
+        if (
+            key not in unique_requests
+            or journey_request.max_wait_time > unique_requests[key].max_wait_time
+        ):
+            unique_requests[key] = journey_request
+
+    journeys: dict[tuple[tuple[str, ...], datetime], JourneyDetails] = {}
+    for key, journey_request in unique_requests.items():
+        journey_details = journey_memory_cache.get(key)
+        if journey_details is not None and journey_details.answers(
+            journey_request.max_wait_time
+        ):
+            journeys[key] = journey_details
+    memory_hits = len(journeys)
+    increment("journey_cache.memory_hits", memory_hits)
+
+    stored_journeys = retrieve_many_from_database(
+        journey_keys=[
+            (list(station_list), departure_date_time)
+            for station_list, departure_date_time in unique_requests
+            if (station_list, departure_date_time) not in journeys
+        ]
+    )
+    for key, journey_details in stored_journeys.items():
+        if journey_details.answers(unique_requests[key].max_wait_time):
+            journey_memory_cache.set(key, journey_details)
+            journeys[key] = journey_details
+
+    increment("journey_cache.database_hits", len(journeys) - memory_hits)
+
+    sub_journeys = retrieve_many_sub_journeys(
+        journey_keys=[
+            (list(station_list), departure_date_time)
+            for station_list, departure_date_time in unique_requests
+            if (station_list, departure_date_time) not in journeys
+        ]
+    )
+    sub_route_hits = 0
+    for key, journey_details in sub_journeys.items():
+        if journey_details.answers(unique_requests[key].max_wait_time):
+            journey_memory_cache.set(key, journey_details)
+            journeys[key] = journey_details
+            sub_route_hits += 1
+    increment("journey_cache.sub_route_hits", sub_route_hits)
+
+    missing_requests = [x for key, x in unique_requests.items() if key not in journeys]
+    increment("journey_cache.misses", len(missing_requests))
+    if missing_requests:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(in_current_span(retrieve_from_api), journey_request=x)
+                for x in missing_requests
+            ]
+        retrieved_journeys = [x.result() for x in futures if x.exception() is None]
+        # cache the data, before raising any error
+        store_journeys(journeys=retrieved_journeys)
+        for journey_request, future in zip(missing_requests, futures):
+            if future.exception() is None:
+                key = journey_key(journey_request)
+                journey_memory_cache.set(key, future.result())
+                journeys[key] = future.result()
+        # a journey the api has none for is None, but the api or
+        # the database failing fails the batch
+        for future in futures:
+            if future.exception() is not None and not isinstance(
+                future.exception(), NoJourneyFound
+            ):
+                raise future.exception()
+
+    return [journeys.get(journey_key(x)) for x in journey_requests]
+
+
+def journey_key(journey_request: JourneyRequest) -> tuple[tuple[str, ...], datetime]:
+    """
+    the key a journey is cached on, its station list and departure date and time
+    """
+    return (
+        tuple(journey_request.station_identifiers),
+        journey_request.departure_date_time,
+    )
@@ -0,0 +1,294 @@
+"""
+module to time the stages of a journey lookup, and count its cache hits
+
+Each stage is wrapped in a span, by the traced decorator or the span context
+manager, and counters are incremented with increment. Spans nest, each
+holding the ids of its trace and its parent, and the counters incremented
+within a span are added to the span it is nested in when it ends, so the
+span of a request holds its api calls, retries and cache hits and misses.
+
+Nothing is recorded until an exporter is set with set_exporter, either an
+InMemoryCollector, for tests, or a JsonLinesExporter writing each span to a
+file. Until then every hook is a check of a module global, and a traced
+function is called straight through
+"""
+
+import functools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Protocol, TypeVar, Union
+
+T = TypeVar("T")
+
+
+@dataclass(slots=True)
+class Span:
+    """
+    A timed stage of a lookup
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Union[str, None]
+    # seconds since the epoch
+    start_time: float
+    duration_secs: float = 0.0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+    # the name of the exception the stage raised
+    error: Union[str, None] = None
+    parent: Union["Span", None] = field(default=None, repr=False, compare=False)
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        return the data as a dictionary, without the parent span
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_secs * 1000, 3),
+            "attributes": self.attributes,
+            "counters": self.counters,
+            "error": self.error,
+        }
+
+
+class Exporter(Protocol):
+    """
+    What is needed of an exporter, to be given each span as it ends
+    """
+
+    def export(self, span: Span) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class InMemoryCollector:
+    """
+    An exporter holding the spans in memory, for tests
+    """
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self.lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+    def spans_named(self, name: str) -> list[Span]:
+        """
+        the ended spans with the name, in the order they ended
+        """
+        with self.lock:
+            return [x for x in self.spans if x.name == name]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.spans.clear()
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesExporter:
+    """
+    An exporter appending each span to a json lines file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, encoding="utf-8", mode="a")
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.as_dict(), default=str) + "\n"
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line)
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+_exporter: Union[Exporter, None] = None
+_lock = threading.Lock()
+_current_span: ContextVar[Union[Span, None]] = ContextVar("current_span", default=None)
+# the totals of every counter since the exporter was set
+_counters: Counter = Counter()
+
+
+def set_exporter(exporter: Union[Exporter, None]) -> None:
+    """
+    start recording spans and counters to the exporter, or stop with None.
+    The previous exporter is closed, and the counters are reset
+    """
+    global _exporter
+    with _lock:
+        previous_exporter = _exporter
+        _exporter = exporter
+        _counters.clear()
+    if previous_exporter is not None and previous_exporter is not exporter:
+        previous_exporter.close()
+
+
+def is_enabled() -> bool:
+    """
+    whether an exporter is set
+    """
+    return _exporter is not None
+
+
+def counters() -> dict[str, int]:
+    """
+    the totals of every counter since the exporter was set
+    """
+    with _lock:
+        return dict(_counters)
+
+
+def increment(name: str, value: int = 1) -> None:
+    """
+    add to a counter, and to the counters of the current span
+    """
+    if _exporter is None:
+        return
+    current_span = _current_span.get()
+    with _lock:
+        _counters[name] += value
+        if current_span is not None:
+            current_span.counters[name] = current_span.counters.get(name, 0) + value
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """
+    set an attribute of the current span
+    """
+    if _exporter is None:
+        return
+    current_span = _current_span.get()
+    if current_span is not None:
+        current_span.attributes[key] = value
+
+
+class _SpanContext:
+    """
+    The context manager that starts a span on enter, and exports it on exit
+    """
+
+    __slots__ = ("name", "attributes", "span", "started_at", "token")
+
+    def __init__(self, name: str, attributes: dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        parent = _current_span.get()
+        span_id = f"{random.getrandbits(64):016x}"
+        self.span = Span(
+            name=self.name,
+            trace_id=span_id if parent is None else parent.trace_id,
+            span_id=span_id,
+            parent_id=None if parent is None else parent.span_id,
+            start_time=time.time(),
+            attributes=self.attributes,
+            parent=parent,
+        )
+        self.token = _current_span.set(self.span)
+        self.started_at = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        span = self.span
+        span.duration_secs = time.perf_counter() - self.started_at
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        _current_span.reset(self.token)
+        if span.parent is not None and span.counters:
+            with _lock:
+                for name, value in span.counters.items():
+                    span.parent.counters[name] = span.parent.counters.get(name, 0) + value
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(span)
+
+
+class _DisabledSpan:
+    """
+    The context manager used while there is no exporter, which does nothing
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        return None
+
+
+_DISABLED_SPAN = _DisabledSpan()
+
+
+def span(name: str, **attributes: Any) -> Union[_SpanContext, _DisabledSpan]:
+    """
+    a context manager timing the stage within it, as a span nested in the current span
+
+    Args:
+        name (str): the name of the stage
+        attributes (Any): attributes of the span, such as the station ids
+
+    Returns:
+        the context manager, which gives the Span, or None if there is no exporter
+    """
+    if _exporter is None:
+        return _DISABLED_SPAN
+    return _SpanContext(name, attributes)
+
+
+def traced(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    decorate a function, so that every call is timed as a span
+    """
+
+    def decorator(function: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs) -> T:
+            if _exporter is None:
+                return function(*args, **kwargs)
+            with _SpanContext(name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def in_current_span(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    wrap a function to be run in another thread, such as by a
+    ThreadPoolExecutor, so its spans are nested in the current span
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs) -> T:
+        token = _current_span.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+
+    return wrapper
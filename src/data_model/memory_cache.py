@@ -0,0 +1,100 @@
+"""
+Module for a bounded in memory cache, which sits in front of the database
+
+Entries are evicted least recently used first once the cache is full,
+and expire after a time to live
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+
+@dataclass
+class CacheStatistics:
+    """
+    A class to describe the counters of a cache
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        """
+        return the data as a dictionary
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class MemoryCache:
+    """
+    A thread safe LRU cache, where every entry has a time to live
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_secs: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl_secs = ttl_secs
+        self.clock = clock
+        self.statistics = CacheStatistics()
+        self.lock = threading.Lock()
+        # key: (expires_at, value), with the most recently used last
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        get the value for the key
+
+        Returns:
+            the value, or None if it is not cached or has expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.statistics.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self.entries[key]
+                self.statistics.expirations += 1
+                self.statistics.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.statistics.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        cache the value for the key, evicting the least recently used
+        entry if the cache is full
+        """
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl_secs, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.statistics.evictions += 1
+
+    def clear(self) -> None:
+        """
+        remove every entry and reset the counters
+        """
+        with self.lock:
+            self.entries.clear()
+            self.statistics = CacheStatistics()
@@ -0,0 +1,227 @@
+"""
+Module to evaluate one route at many departure times at once
+
+The stored departures of each leg are taken from the timetable graph as
+sorted arrays, and the next departure for every departure time is found
+with one searchsorted per leg. Only the departure times the stored
+departures do not cover are looked up leg by leg, in the same way as
+transport_api.retrieve_journey
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Sequence
+
+import numpy as np
+
+from src.data_model.api.transport_api import (
+    NoJourneyFound,
+    retrieve_leg,
+    timetable_graph,
+)
+from src.data_model.dataclasses import JourneyDetails, StationWaits
+from src.data_model.memory_cache import MemoryCache
+from src import defaults
+
+MICROSECONDS_PER_MIN = 60_000_000
+
+
+@dataclass
+class RouteTimes:
+    """
+    A class to describe a route at many departure times, as columns.
+
+    Each column has one entry per departure time. The wait_times have a row
+    per leg, for the wait at the station the leg departs from. As with
+    JourneyDetails, a departure time stops at the first station where the
+    wait is longer than the max wait time, so the later legs are not
+    evaluated, and time_in_mins is up to that station.
+    Where no journey was found, journey_found is False and the other
+    columns for that departure time should be ignored
+    """
+
+    station_identifiers: list[str]
+    max_wait_time: int
+    departure_date_times: np.ndarray
+    arrival_date_times: np.ndarray
+    time_in_mins: np.ndarray
+    wait_times: np.ndarray
+    max_wait_exceeded: np.ndarray
+    exceeded_wait_station_order: np.ndarray
+    journey_found: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.departure_date_times)
+
+    def journey_details(self, idx: int) -> JourneyDetails:
+        """
+        returns a single departure time as JourneyDetails, the same as
+        transport_api.retrieve_journey would for that departure time
+        """
+        if not self.journey_found[idx]:
+            raise NoJourneyFound("No viable journey found")
+        exceeded_wait_station_order = None
+        legs = len(self.station_identifiers) - 1
+        if self.max_wait_exceeded[idx]:
+            exceeded_wait_station_order = int(self.exceeded_wait_station_order[idx])
+            legs = exceeded_wait_station_order + 1
+        wait_times = [int(x) for x in self.wait_times[:legs, idx]]
+        wait_times += [None] * (len(self.station_identifiers) - legs)
+        return JourneyDetails(
+            time_in_mins=int(self.time_in_mins[idx]),
+            departure_date_time=self.departure_date_times[idx].astype(datetime),
+            train_stations_with_wait=StationWaits.from_lists(
+                station_ids=self.station_identifiers, wait_times=wait_times
+            ),
+            exceeded_wait_station_order=exceeded_wait_station_order,
+        )
+
+
+def retrieve_route_times(
+    station_identifiers: list[str],
+    departure_date_times: Sequence[datetime],
+    max_wait_time: int = defaults.MAX_WAIT_TIME,
+) -> RouteTimes:
+    """
+    evaluate a route at every departure time in one pass
+
+    Args:
+        station_identifiers (list[str]): the stations in the order they are visited
+        departure_date_times (Sequence[datetime]): the departure times to evaluate
+        max_wait_time (int): the maximum time a passenger will wait at any station
+
+    Returns:
+        RouteTimes
+    """
+    pairs = list(zip(station_identifiers, station_identifiers[1:]))
+    timetable_graph.load(pairs=pairs)
+
+    starts = np.array(departure_date_times, dtype="datetime64[us]")
+    count = len(starts)
+    current = starts.copy()
+    time_in_mins = np.zeros(count, dtype=np.int64)
+    wait_times = np.zeros((len(pairs), count), dtype=np.int64)
+    exceeded_wait_station_order = np.full(count, -1, dtype=np.int64)
+    journey_found = np.ones(count, dtype=bool)
+    # the departure times still being evaluated
+    active = np.ones(count, dtype=bool)
+
+    retrieved_after = datetime.now() - timedelta(
+        minutes=timetable_graph.staleness_mins
+    )
+    for leg_idx, (origin_station, destination) in enumerate(pairs):
+        departures, arrivals, journey_times, window_starts = edge_arrays(
+            origin_station=origin_station,
+            destination=destination,
+            retrieved_after=retrieved_after,
+        )
+        leg_wait_times = np.zeros(count, dtype=np.int64)
+        leg_journey_times = np.zeros(count, dtype=np.int64)
+        leg_arrivals = current.copy()
+        covered = np.zeros(count, dtype=bool)
+        if len(departures):
+            idx = np.searchsorted(departures, current, side="left")
+            in_range = idx < len(departures)
+            idx = np.minimum(idx, len(departures) - 1)
+            covered = in_range & (window_starts[idx] <= current)
+            # the same rounding as transport_api.process_departure
+            wait_microseconds = (departures[idx] - current).astype(np.int64)
+            leg_wait_times = (
+                wait_microseconds + (MICROSECONDS_PER_MIN // 2)
+            ) // MICROSECONDS_PER_MIN
+            leg_journey_times = journey_times[idx]
+            leg_arrivals = arrivals[idx]
+
+        # in time order, so each lookup can add a window that covers the next
+        uncovered = np.flatnonzero(active & ~covered)
+        for row in uncovered[np.argsort(current[uncovered], kind="stable")]:
+            try:
+                leg = retrieve_leg(
+                    origin_station=origin_station,
+                    destination=destination,
+                    earliest_departure_time=current[row].astype(datetime),
+                )
+            except NoJourneyFound:
+                journey_found[row] = False
+                active[row] = False
+                continue
+            leg_wait_times[row] = leg["wait_time"]
+            leg_journey_times[row] = leg["journey_time"]
+            leg_arrivals[row] = np.datetime64(leg["arrival_time"], "us")
+
+        wait_times[leg_idx] = np.where(active, leg_wait_times, 0)
+        time_in_mins += np.where(active, leg_wait_times + leg_journey_times, 0)
+        current = np.where(active, leg_arrivals, current)
+        exceeded = active & (leg_wait_times > max_wait_time)
+        exceeded_wait_station_order[exceeded] = leg_idx
+        active &= ~exceeded
+
+    return RouteTimes(
+        station_identifiers=list(station_identifiers),
+        max_wait_time=max_wait_time,
+        departure_date_times=starts,
+        arrival_date_times=np.where(
+            journey_found,
+            starts + time_in_mins.astype("timedelta64[m]"),
+            np.datetime64("NaT"),
+        ),
+        time_in_mins=time_in_mins,
+        wait_times=wait_times,
+        max_wait_exceeded=exceeded_wait_station_order >= 0,
+        exceeded_wait_station_order=exceeded_wait_station_order,
+        journey_found=journey_found,
+    )
+
+
+# the arrays of each edge, with the departures of the edge they were built
+# from, for as many edges as the timetable graph holds
+_edge_arrays = MemoryCache(
+    max_size=defaults.TIMETABLE_MAX_EDGES,
+    ttl_secs=defaults.MEMORY_CACHE_TTL_SECS,
+)
+
+
+def edge_arrays(
+    origin_station: str,
+    destination: str,
+    retrieved_after: datetime,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    the departures of an edge of the timetable graph as arrays, sorted in
+    trains.departure_order, so a searchsorted on the departure times finds the
+    train each other path would choose. The arrays are kept until the edge has
+    new departures, or is evicted
+
+    Returns:
+        the departure times, arrival times, journey times and window starts
+    """
+    edge = timetable_graph.edges.get((origin_station, destination))
+    if edge is None:
+        rows = []
+        edge_departures = None
+    else:
+        edge_departures = edge.departures
+        rows = edge_departures[1]
+    cached = _edge_arrays.get((origin_station, destination))
+    if cached is not None and cached[0] is edge_departures:
+        arrays = cached[1]
+    else:
+        arrays = (
+            np.array([x["departure_time"] for x in rows], dtype="datetime64[us]"),
+            np.array([x["arrival_time"] for x in rows], dtype="datetime64[us]"),
+            np.array([x["journey_time"] for x in rows], dtype=np.int64),
+            np.array([x["window_start_time"] for x in rows], dtype="datetime64[us]"),
+            np.array([x["retrieved_time"] for x in rows], dtype="datetime64[us]"),
+        )
+        _edge_arrays.set((origin_station, destination), (edge_departures, arrays))
+
+    departures, arrivals, journey_times, window_starts, retrieved_times = arrays
+    is_fresh = retrieved_times >= np.datetime64(retrieved_after, "us")
+    if is_fresh.all():
+        return departures, arrivals, journey_times, window_starts
+    return (
+        departures[is_fresh],
+        arrivals[is_fresh],
+        journey_times[is_fresh],
+        window_starts[is_fresh],
+    )
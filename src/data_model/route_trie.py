@@ -0,0 +1,199 @@
+"""
+Module to evaluate many routes from the same departure time at once
+
+The routes are held in a prefix trie, with a node per distinct prefix, so a
+leg shared by several routes, such as LBG to SAJ of LBG SAJ NWX BXY and
+LBG SAJ X Y, is retrieved once for all of them, and the work grows with
+the distinct legs of the trie rather than the stations of every route.
+The trie is resolved a level at a time, with the legs of each level
+retrieved concurrently. As with transport_api.retrieve_journey, the legs
+after a wait longer than the max wait time are not retrieved
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Sequence, Union
+
+from src.data_model.api.transport_api import (
+    NoJourneyFound,
+    retrieve_leg,
+    timetable_graph,
+)
+from src.data_model.dataclasses import JourneyDetails, StationWaits
+from src.data_model.instrumentation import (
+    in_current_span,
+    increment,
+    set_attribute,
+    traced,
+)
+from src import defaults
+
+
+@dataclass(slots=True)
+class RouteTrieNode:
+    """
+    A node of the trie, for the routes that start with the stations from the
+    root to this node. Once resolved it holds the journey up to its station,
+    and whether the journey stopped there, at a wait longer than the max
+    wait time, or because its last leg had no journey
+    """
+
+    station_id: str
+    depth: int
+    children: dict[str, "RouteTrieNode"] = field(default_factory=dict)
+    arrival_date_time: Union[datetime, None] = None
+    time_in_mins: int = 0
+    # the wait at each station before this one
+    wait_times: list[int] = field(default_factory=list)
+    arrival_offsets_secs: list[int] = field(default_factory=lambda: [0])
+    exceeded_wait_station_order: Union[int, None] = None
+    journey_found: bool = True
+
+    def is_stopped(self) -> bool:
+        """
+        whether the routes through this node are not retrieved any further
+        """
+        return self.exceeded_wait_station_order is not None or not self.journey_found
+
+
+def build_route_trie(station_lists: Sequence[Sequence[str]]) -> dict[str, RouteTrieNode]:
+    """
+    build the trie of the routes
+
+    Args:
+        station_lists (Sequence[Sequence[str]]): the stations of each route, in order
+    Returns:
+        dict[str, RouteTrieNode]: the root node of each origin station
+    """
+    roots: dict[str, RouteTrieNode] = {}
+    for station_list in station_lists:
+        node = roots.get(station_list[0])
+        if node is None:
+            node = roots[station_list[0]] = RouteTrieNode(
+                station_id=station_list[0], depth=0
+            )
+        for station_id in station_list[1:]:
+            child = node.children.get(station_id)
+            if child is None:
+                child = node.children[station_id] = RouteTrieNode(
+                    station_id=station_id, depth=node.depth + 1
+                )
+            node = child
+    return roots
+
+
+@traced("route_trie.retrieve_routes")
+def retrieve_routes(
+    station_lists: Sequence[Sequence[str]],
+    departure_date_time: datetime,
+    max_wait_time: int = defaults.MAX_WAIT_TIME,
+    max_workers: int = defaults.BATCH_WORKERS,
+) -> list[Union[JourneyDetails, None]]:
+    """
+    retrieve every route departing at the departure date and time, retrieving
+    each leg shared by several routes once
+
+    Args:
+        station_lists (Sequence[Sequence[str]]): the stations of each route, in order
+        departure_date_time (datetime): the departure date and time of every route
+        max_wait_time (int): the maximum time a passenger will wait at any station
+        max_workers (int): the maximum number of legs retrieved at once
+    Returns:
+        list[Union[JourneyDetails, None]]: in the same order as the station_lists,
+        the same as transport_api.retrieve_journey would give for each route,
+        or None where a leg of the route has no journey
+    """
+    roots = build_route_trie(station_lists)
+    level = list(roots.values())
+    for node in level:
+        node.arrival_date_time = departure_date_time
+
+    edges: set[tuple[str, str]] = set()
+    nodes = list(level)
+    while nodes:
+        node = nodes.pop()
+        for child in node.children.values():
+            edges.add((node.station_id, child.station_id))
+            nodes.append(child)
+    timetable_graph.load(pairs=sorted(edges))
+    set_attribute("routes", len(station_lists))
+    set_attribute("edges", len(edges))
+
+    def resolve_leg(
+        node_and_child: tuple[RouteTrieNode, RouteTrieNode],
+    ) -> Union[dict[str, Any], None]:
+        node, child = node_and_child
+        try:
+            return retrieve_leg(
+                origin_station=node.station_id,
+                destination=child.station_id,
+                earliest_departure_time=node.arrival_date_time,
+            )
+        except NoJourneyFound:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while level:
+            level_edges = [
+                (node, child)
+                for node in level
+                if not node.is_stopped()
+                for child in node.children.values()
+            ]
+            increment("route_trie.legs", len(level_edges))
+            legs = list(executor.map(in_current_span(resolve_leg), level_edges))
+            for (node, child), leg in zip(level_edges, legs):
+                if leg is None:
+                    child.journey_found = False
+                    continue
+                child.arrival_date_time = leg["arrival_time"]
+                child.time_in_mins = (
+                    node.time_in_mins + leg["wait_time"] + leg["journey_time"]
+                )
+                child.wait_times = node.wait_times + [leg["wait_time"]]
+                child.arrival_offsets_secs = node.arrival_offsets_secs + [
+                    int((leg["arrival_time"] - departure_date_time).total_seconds())
+                ]
+                if leg["wait_time"] > max_wait_time:
+                    child.exceeded_wait_station_order = node.depth
+            level = [child for _, child in level_edges]
+
+    return [
+        route_journey(
+            roots=roots,
+            station_list=station_list,
+            departure_date_time=departure_date_time,
+        )
+        for station_list in station_lists
+    ]
+
+
+def route_journey(
+    roots: dict[str, RouteTrieNode],
+    station_list: Sequence[str],
+    departure_date_time: datetime,
+) -> Union[JourneyDetails, None]:
+    """
+    the journey of a route from the resolved trie, up to the node it stopped
+    at, or None if a leg of the route has no journey
+    """
+    node = roots[station_list[0]]
+    for station_id in station_list[1:]:
+        if node.is_stopped():
+            break
+        node = node.children[station_id]
+    if not node.journey_found:
+        return None
+    padding = [None] * (len(station_list) - len(node.arrival_offsets_secs))
+    return JourneyDetails(
+        time_in_mins=node.time_in_mins,
+        departure_date_time=departure_date_time,
+        train_stations_with_wait=StationWaits.from_lists(
+            station_ids=list(station_list),
+            wait_times=node.wait_times
+            + [None] * (len(station_list) - len(node.wait_times)),
+        ),
+        exceeded_wait_station_order=node.exceeded_wait_station_order,
+        arrival_offsets_secs=node.arrival_offsets_secs + padding,
+    )
@@ -0,0 +1,69 @@
+"""
+Module to coalesce concurrent identical calls into a single call
+
+While a call for a key is in flight, any other call for the same key waits
+for it to finish and shares its result (or its exception), rather than
+making the same call again
+"""
+
+import threading
+from typing import Any, Callable, Hashable, TypeVar, Union
+
+T = TypeVar("T")
+
+
+class Flight:
+    """
+    A call in flight, holding its result once it has finished
+    """
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result: Any = None
+        self.error: Union[BaseException, None] = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into a single call
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights: dict[Hashable, Flight] = {}
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        """
+        call the function, unless a call for this key is already in flight,
+        in which case wait for that call and return its result
+
+        Args:
+            key (Hashable): the key identifying identical calls
+            function (Callable[[], T]): the call to make
+
+        Returns:
+            T : the result of the call
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = Flight()
+                self.flights[key] = flight
+
+        if not is_leader:
+            flight.finished.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.finished.set()
+        return flight.result
@@ -0,0 +1,248 @@
+"""
+Module for an in memory, time dependent timetable graph
+
+Each origin and destination is an edge, holding its stored departures sorted
+in trains.departure_order, so that the next departure at or after a time is found
+with a binary search rather than a database query. The least recently used
+edges are evicted once the graph is full, and departures are dropped from an
+edge once they are stale
+"""
+
+import heapq
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Union
+from src.data_model.db.trains import departure_order, retrieve_departures
+from src import defaults
+
+
+class TimetableEdge:
+    """
+    The departures from an origin to a destination, sorted in trains.departure_order.
+
+    A departure is only the next departure for a time within the window it
+    was returned in, as an earlier train may not have been returned otherwise
+    """
+
+    def __init__(self):
+        # (departure times, departures), replaced together so that
+        # a reader never sees one without the other
+        self.departures: tuple[list[datetime], list[dict[str, Any]]] = ([], [])
+        self.earliest_window_start: Union[datetime, None] = None
+
+    def add_departures(
+        self, departures: list[dict[str, Any]], retrieved_after: datetime
+    ) -> None:
+        """
+        add departures, in the format returned by trains.retrieve_departures.
+        A departure already held for the same window is replaced, and of the
+        departures added with the same departure time and window, the first in
+        trains.departure_order is kept, as trains.store_departures keeps it.
+        Departures retrieved before retrieved_after are dropped, and the new
+        departures are merged into the sorted ones held
+
+        Args:
+            departures (list[dict[str, Any]]): the departures to add
+            retrieved_after (datetime): drop departures retrieved before this
+        """
+        new_rows: dict[tuple[datetime, datetime], dict[str, Any]] = {}
+        for departure in sorted(departures, key=departure_order):
+            if departure["retrieved_time"] >= retrieved_after:
+                new_rows.setdefault(
+                    (departure["departure_time"], departure["window_start_time"]),
+                    departure,
+                )
+        _, rows = self.departures
+        kept_rows = [
+            x
+            for x in rows
+            if x["retrieved_time"] >= retrieved_after
+            and (x["departure_time"], x["window_start_time"]) not in new_rows
+        ]
+        rows = list(heapq.merge(kept_rows, new_rows.values(), key=departure_order))
+        self.earliest_window_start = min(
+            (x["window_start_time"] for x in rows), default=None
+        )
+        self.departures = ([x["departure_time"] for x in rows], rows)
+
+    def next_departure(
+        self, earliest_departure_time: datetime, retrieved_after: datetime
+    ) -> Union[dict[str, Any], None]:
+        """
+        the first departure at or after the earliest departure time, from a
+        window that started at or before it, and was retrieved after retrieved_after
+
+        Returns:
+            the departure, or None if it is not known
+        """
+        if (
+            self.earliest_window_start is None
+            or earliest_departure_time < self.earliest_window_start
+        ):
+            return None
+        departure_times, rows = self.departures
+        first_idx = bisect_left(departure_times, earliest_departure_time)
+        for idx in range(first_idx, len(rows)):
+            row = rows[idx]
+            if (
+                row["window_start_time"] <= earliest_departure_time
+                and row["retrieved_time"] >= retrieved_after
+            ):
+                return row
+        return None
+
+
+class TimetableGraph:
+    """
+    A thread safe graph of the stored departures, keyed on the origin and destination.
+
+    The edges of a route are loaded from the database once, and the
+    departures returned by the api are then added as they are stored.
+    Once there are more than max_edges, the least recently used are evicted,
+    and loaded from the database again when next needed
+    """
+
+    def __init__(
+        self,
+        staleness_mins: int = defaults.DEPARTURES_STALENESS_MINS,
+        max_edges: int = defaults.TIMETABLE_MAX_EDGES,
+    ):
+        self.staleness_mins = staleness_mins
+        self.max_edges = max_edges
+        # with the most recently used last
+        self.edges: OrderedDict[tuple[str, str], TimetableEdge] = OrderedDict()
+        # the edges that have been loaded from the database
+        self.loaded: set[tuple[str, str]] = set()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+    def load(self, pairs: list[tuple[str, str]]) -> None:
+        """
+        load the departures of any of the origins and destinations
+        that have not been loaded, in a single query. The query is made
+        without holding the lock, so other edges are answered meanwhile
+
+        Args:
+            pairs (list[tuple[str, str]]): the origin and destination station ids
+        """
+        with self.lock:
+            pairs_to_load = []
+            for pair in dict.fromkeys(pairs):
+                if pair in self.loaded:
+                    self.edges.move_to_end(pair)
+                else:
+                    pairs_to_load.append(pair)
+        if not pairs_to_load:
+            return
+        departures = retrieve_departures(
+            pairs=pairs_to_load, staleness_mins=self.staleness_mins
+        )
+        retrieved_after = self.retrieved_after()
+        with self.lock:
+            for pair in pairs_to_load:
+                # loaded by another thread during the query
+                if pair in self.loaded:
+                    continue
+                self.edge(pair).add_departures(
+                    departures.get(pair, []), retrieved_after=retrieved_after
+                )
+                self.loaded.add(pair)
+            self.evict()
+
+    def add_departures(
+        self,
+        origin_station: str,
+        destination: str,
+        window_start_date_time: datetime,
+        departures: list[dict[str, Any]],
+    ) -> None:
+        """
+        add the departures returned by the api, in the same way as trains.store_departures
+
+        Args:
+            origin_station (str): the station id of the departure point
+            destination (str): the station id of the destination
+            window_start_date_time (datetime): the earliest departure that was requested from the api
+            departures (list[dict[str, Any]]): the departures, as returned by transport_api.parse_routes
+        """
+        retrieved_time = datetime.now()
+        retrieved_after = self.retrieved_after()
+        with self.lock:
+            self.edge((origin_station, destination)).add_departures(
+                [
+                    {
+                        **departure,
+                        "window_start_time": window_start_date_time,
+                        "retrieved_time": retrieved_time,
+                    }
+                    for departure in departures
+                ],
+                retrieved_after=retrieved_after,
+            )
+            self.evict()
+
+    def next_departure(
+        self,
+        origin_station: str,
+        destination: str,
+        earliest_departure_date_time: datetime,
+    ) -> Union[dict[str, Any], None]:
+        """
+        the first departure at or after the earliest departure time, with the
+        same rules as trains.retrieve_next_departure, without any io
+
+        Args:
+            origin_station (str): the station id of the departure point
+            destination (str): the station id of the destination
+            earliest_departure_date_time (datetime): the earliest the train could depart
+        Returns:
+            the departure, or None if it is not known
+        """
+        with self.lock:
+            edge = self.edges.get((origin_station, destination))
+            if edge is None:
+                return None
+            self.edges.move_to_end((origin_station, destination))
+        return edge.next_departure(
+            earliest_departure_time=earliest_departure_date_time,
+            retrieved_after=self.retrieved_after(),
+        )
+
+    def retrieved_after(self) -> datetime:
+        """
+        the departures retrieved before this are stale
+        """
+        return datetime.now() - timedelta(minutes=self.staleness_mins)
+
+    def edge(self, pair: tuple[str, str]) -> TimetableEdge:
+        """
+        the edge of the origin and destination, added if it is not held,
+        as the most recently used. Must be called holding the lock
+        """
+        edge = self.edges.get(pair)
+        if edge is None:
+            edge = self.edges[pair] = TimetableEdge()
+        else:
+            self.edges.move_to_end(pair)
+        return edge
+
+    def evict(self) -> None:
+        """
+        evict the least recently used edges, once there are more than
+        max_edges. Must be called holding the lock
+        """
+        while len(self.edges) > self.max_edges:
+            pair, _ = self.edges.popitem(last=False)
+            self.loaded.discard(pair)
+
+    def clear(self) -> None:
+        """
+        remove every edge
+        """
+        with self.lock:
+            self.edges.clear()
+            self.loaded.clear()
@@ -7,3 +7,54 @@ JOURNEY_TIME_TYPE = "leave_after"
 SERVICE = "tfl"
 TRAVEL_MODES = "train"
 BASE_URL = "https://transportapi.com/v3/uk/public_journey.json"
+# departures older than this are not used to answer later requests
+DEPARTURES_STALENESS_MINS = 24 * 60
+# fetch every leg of a route concurrently, before resolving the route
+PREFETCH_LEGS = False
+# the later legs are requested for windows starting this long after the
+# earliest they could depart, from the travel time known so far
+PREFETCH_OFFSETS_MINS = (0, 30, 60)
+PREFETCH_WORKERS = 8
+# the transport api http client
+HTTP_TIMEOUT_SECS = 10
+HTTP_POOL_MAXSIZE = PREFETCH_WORKERS
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_SECS = 0.5
+HTTP_MAX_BACKOFF_SECS = 30
+# client side limit, to stay under the transport api quota
+API_RATE_LIMIT_PER_SECOND = 5
+API_RATE_LIMIT_BURST = 10
+# the in memory cache in front of the database
+MEMORY_CACHE_MAX_JOURNEYS = 10_000
+MEMORY_CACHE_MAX_LEGS = 50_000
+MEMORY_CACHE_TTL_SECS = 300
+# the origins and destinations held in the in memory timetable graph
+TIMETABLE_MAX_EDGES = 10_000
+# the number of journeys retrieved from the api concurrently in a batch
+BATCH_WORKERS = 8
+# the http journey service
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_MAX_CONCURRENT_REQUESTS = 32
+SERVICE_MAX_PENDING_REQUESTS = 256
+SERVICE_SHUTDOWN_TIMEOUT_SECS = 30
+# a leg with no journey is not requested again from the api for this long
+FAILED_LEG_TTL_MINS = 60
+# the times of requests and stored journeys are wall clock times in this timezone
+TIMEZONE = "Europe/London"
+# the connection profile applied to every sqlite connection
+SQLITE_PRAGMAS = {
+    # readers are not blocked by a writer, and a writer by readers
+    "journal_mode": "WAL",
+    # with WAL, only a checkpoint waits for the disk, rather than every commit
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,  # bytes
+    "cache_size": -64 * 1024,  # negative is in KiB, rather than pages
+    "temp_store": "MEMORY",
+}
+# the number of compiled statements sqlalchemy keeps for each engine
+SQLITE_QUERY_CACHE_SIZE = 500
+# record every api request and response to this gzipped json lines file
+API_RECORD_PATH = None
+# answer api requests from this recording, rather than from the transport api
+API_REPLAY_PATH = None
@@ -5,18 +5,22 @@ main file to run the application
 import os
 import sys
 import argparse
-from dateutil import parser
-from datetime import datetime, timedelta
-from typing import Any
-
-from tomlkit import date
+import atexit
+from datetime import datetime
 
 module_path = os.path.abspath(os.path.join(".."))
 if module_path not in sys.path:
     sys.path.append(module_path)
 
 from src.data_model.dataclasses import JourneyDetails, JourneyRequest
-from src.data_model.get_train_information import retrieve_journey
+from src.data_model.date_times import parse_datetime
+from src.data_model.db.journey_lookup import retrieve_stored_journey
+from src.data_model.instrumentation import (
+    JsonLinesExporter,
+    increment,
+    set_exporter,
+    span,
+)
 from src import defaults
 
 
@@ -36,7 +40,7 @@ def is_wait_is_too_long(journey_details: JourneyDetails, max_wait_time: int) ->
 
     """
 
-    for wait_time in [x["wait_time"] for x in journey_details.train_stations_with_wait]:
+    for wait_time in journey_details.train_stations_with_wait.wait_times():
         if wait_time is not None and wait_time > max_wait_time:
             return True
     return False
@@ -47,7 +51,7 @@ def get_datetime_from_string(datetime_str: str) -> datetime:
     converts a datetime string into a datetime object
     """
     try:
-        dt_object = parser.parse(datetime_str)
+        dt_object = parse_datetime(datetime_str)
     except Exception:
         print("datetime is not in a recognised format")
         raise
@@ -89,9 +93,18 @@ def stdout_output_result(
 
 def main(journey_request: JourneyRequest) -> None:
     """
-    primary function to run the code
+    primary function to run the code.
+    A journey already in the database is answered without importing the
+    ORM or the api client, which are only imported when they are needed
     """
-    journey_details = retrieve_journey(journey_request=journey_request)
+    with span("main"):
+        journey_details = retrieve_stored_journey(journey_request=journey_request)
+        if journey_details is None:
+            from src.data_model.get_train_information import retrieve_journey
+
+            journey_details = retrieve_journey(journey_request=journey_request)
+        else:
+            increment("journey_cache.database_hits")
     stdout_output_result(
         journey_request=journey_request,
         journey_details=journey_details,
@@ -117,10 +130,35 @@ if __name__ == "__main__":
         arg_parser.add_argument(
             "--max_wait_time",
             dest="max_wait_time",
+            type=int,
             help="the maximum amount of time (in mins) that you would wait at a station",
             required=False,
         )
+        arg_parser.add_argument(
+            "--record_path",
+            dest="record_path",
+            help="record the transport api requests to this .jsonl.gz file",
+            required=False,
+        )
+        arg_parser.add_argument(
+            "--replay_path",
+            dest="replay_path",
+            help="answer the transport api requests from this .jsonl.gz recording",
+            required=False,
+        )
+        arg_parser.add_argument(
+            "--trace_path",
+            dest="trace_path",
+            help="append a timed span for each stage of the lookup to this .jsonl file",
+            required=False,
+        )
         args = arg_parser.parse_args()
+        defaults.API_RECORD_PATH = args.record_path
+        defaults.API_REPLAY_PATH = args.replay_path
+        if args.trace_path:
+            set_exporter(JsonLinesExporter(args.trace_path))
+            # the spans are only all written once the file is closed
+            atexit.register(set_exporter, None)
 
         request_departure_date_time = get_datetime_from_string(args.departure_date_time)
         max_wait_time = args.max_wait_time
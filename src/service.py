@@ -0,0 +1,351 @@
+"""
+long running http service, to return the journey details
+
+The engine, the transport api client and the in memory caches are kept
+warm between requests. Journeys are looked up in a thread pool, so the
+event loop keeps accepting requests while the database or api is busy.
+
+GET /journey?departure_date_time=2024-06-02T14:17&station_identifiers=LBG,CHX,WAT,HMC&max_wait_time=60
+
+returns
+
+{"arrival_time": "2024-06-02T16:09:00", "error": null}
+"""
+
+import os
+import sys
+import argparse
+import atexit
+import asyncio
+import json
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Union
+from urllib.parse import parse_qs, urlsplit
+
+module_path = os.path.abspath(os.path.join(".."))
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from src.data_model.dataclasses import JourneyRequest
+from src.data_model.date_times import parse_datetime
+from src.data_model.get_train_information import retrieve_journey
+from src.data_model.api.transport_api import NoJourneyFound, set_client
+from src.data_model.db.trains import engine, initialise_database
+from src.data_model.instrumentation import JsonLinesExporter, set_exporter
+from src.main import is_wait_is_too_long
+from src import defaults
+
+# the largest request head that will be read, in bytes
+MAX_REQUEST_HEAD_SIZE = 16 * 1024
+
+
+class BadRequest(Exception):
+    """
+    raised when the request can not be turned into a JourneyRequest
+    """
+
+
+class JourneyService:
+    """
+    An asyncio http server, returning the arrival time of a journey
+    """
+
+    def __init__(
+        self,
+        host: str = defaults.SERVICE_HOST,
+        port: int = defaults.SERVICE_PORT,
+        max_concurrent_requests: int = defaults.SERVICE_MAX_CONCURRENT_REQUESTS,
+        max_pending_requests: int = defaults.SERVICE_MAX_PENDING_REQUESTS,
+        shutdown_timeout_secs: float = defaults.SERVICE_SHUTDOWN_TIMEOUT_SECS,
+    ):
+        self.host = host
+        self.port = port
+        self.max_pending_requests = max_pending_requests
+        self.shutdown_timeout_secs = shutdown_timeout_secs
+        self.concurrency_limit = asyncio.Semaphore(max_concurrent_requests)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_requests)
+        self.server: Union[asyncio.Server, None] = None
+        self.connections: set[asyncio.Task] = set()
+        # the connections part way through a request
+        self.busy_connections: set[asyncio.Task] = set()
+        self.pending_requests = 0
+        self.stopping = asyncio.Event()
+
+    async def start(self) -> None:
+        """
+        initialise the database, then start listening.
+        If the port is 0, then the port chosen is set on self.port
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, initialise_database)
+        self.server = await asyncio.start_server(
+            self.handle_connection,
+            host=self.host,
+            port=self.port,
+            limit=MAX_REQUEST_HEAD_SIZE,
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_until_stopped(self) -> None:
+        """
+        serve requests until stop is called, then shut down gracefully
+        """
+        await self.stopping.wait()
+        await self.shutdown()
+
+    def stop(self) -> None:
+        """
+        ask the service to shut down gracefully
+        """
+        self.stopping.set()
+
+    async def shutdown(self) -> None:
+        """
+        stop accepting connections, wait for the requests in flight to finish,
+        then release the pooled resources. The connections are closed before
+        waiting for the server to close, as from python 3.12 it waits for them
+        """
+        if self.server is not None:
+            self.server.close()
+        # idle keep-alive connections are closed straight away
+        for connection in self.connections - self.busy_connections:
+            connection.cancel()
+        if self.connections:
+            _, still_running = await asyncio.wait(
+                self.connections, timeout=self.shutdown_timeout_secs
+            )
+            for connection in still_running:
+                connection.cancel()
+            if still_running:
+                await asyncio.wait(still_running)
+        if self.server is not None:
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+        set_client(None)
+        engine.dispose()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        handle each request on a keep-alive connection
+        """
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            keep_alive = True
+            while keep_alive and not self.stopping.is_set():
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                self.busy_connections.add(connection)
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = {
+                    x.split(":", 1)[0].strip().lower(): x.split(":", 1)[1].strip()
+                    for x in header_lines
+                    if ":" in x
+                }
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    method, target, version = "", "", "HTTP/1.0"
+                status, body = await self.handle_request(method=method, target=target)
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                    and not self.stopping.is_set()
+                )
+                self.write_response(
+                    writer=writer, status=status, body=body, keep_alive=keep_alive
+                )
+                await writer.drain()
+                self.busy_connections.discard(connection)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(connection)
+            self.busy_connections.discard(connection)
+            writer.close()
+
+    async def handle_request(
+        self, method: str, target: str
+    ) -> tuple[HTTPStatus, dict[str, Any]]:
+        """
+        route the request, limiting the number of journeys looked up at once
+        """
+        url = urlsplit(target)
+        if url.path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if url.path != "/journey":
+            return HTTPStatus.NOT_FOUND, {"arrival_time": None, "error": "Not found"}
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {
+                "arrival_time": None,
+                "error": "Method not allowed",
+            }
+        try:
+            journey_request = build_journey_request(query=url.query)
+        except BadRequest as err:
+            return HTTPStatus.BAD_REQUEST, {"arrival_time": None, "error": str(err)}
+
+        if self.pending_requests >= self.max_pending_requests:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {
+                "arrival_time": None,
+                "error": "Too many requests, try again later",
+            }
+        self.pending_requests += 1
+        try:
+            async with self.concurrency_limit:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self.executor, journey_response, journey_request
+                )
+        finally:
+            self.pending_requests -= 1
+
+    @staticmethod
+    def write_response(
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        body: dict[str, Any],
+        keep_alive: bool,
+    ) -> None:
+        """
+        write the json response
+        """
+        encoded_body = json.dumps(body).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(encoded_body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + encoded_body)
+
+
+def build_journey_request(query: str) -> JourneyRequest:
+    """
+    build the JourneyRequest from the query string
+
+    Args:
+        query (str): the query string, with departure_date_time,
+            station_identifiers as a comma separated list, and optionally max_wait_time
+
+    Returns:
+        JourneyRequest
+    """
+    params = parse_qs(query)
+    try:
+        departure_date_time = parse_datetime(params["departure_date_time"][0])
+    except KeyError as err:
+        raise BadRequest("departure_date_time is required") from err
+    except (ValueError, OverflowError) as err:
+        raise BadRequest("datetime is not in a recognised format") from err
+
+    station_identifiers = [
+        x.strip().upper()
+        for value in params.get("station_identifiers", [])
+        for x in value.split(",")
+        if x.strip()
+    ]
+    if len(station_identifiers) < 2:
+        raise BadRequest("at least 2 station_identifiers are required")
+
+    try:
+        max_wait_time = int(params.get("max_wait_time", [defaults.MAX_WAIT_TIME])[0])
+    except ValueError as err:
+        raise BadRequest("max_wait_time must be a whole number of minutes") from err
+
+    return JourneyRequest(
+        departure_date_time=departure_date_time,
+        max_wait_time=max_wait_time,
+        station_identifiers=station_identifiers,
+    )
+
+
+def journey_response(
+    journey_request: JourneyRequest,
+) -> tuple[HTTPStatus, dict[str, Any]]:
+    """
+    look up the journey, and build the response in the format
+    {"arrival_time": "<isoformat>", "error": "any error found"}
+    """
+    try:
+        journey_details = retrieve_journey(journey_request=journey_request)
+    except NoJourneyFound as err:
+        return HTTPStatus.OK, {"arrival_time": None, "error": str(err)}
+    except Exception as err:
+        return HTTPStatus.BAD_GATEWAY, {"arrival_time": None, "error": str(err)}
+
+    if is_wait_is_too_long(
+        journey_details=journey_details, max_wait_time=journey_request.max_wait_time
+    ):
+        return HTTPStatus.OK, {
+            "arrival_time": None,
+            "error": f"This journey has at least one wait at a station longer than the requested maximum wait time of {journey_request.max_wait_time} minutes.",
+        }
+    return HTTPStatus.OK, {
+        "arrival_time": journey_details.arrival_date_time().isoformat(),
+        "error": None,
+    }
+
+
+async def serve(service: JourneyService) -> None:
+    """
+    run the service until it receives SIGINT or SIGTERM
+    """
+    await service.start()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, service.stop)
+    print(f"Serving journeys on http://{service.host}:{service.port}/journey")
+    await service.serve_until_stopped()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="How long is my journey? service")
+    arg_parser.add_argument("--host", dest="host", default=defaults.SERVICE_HOST)
+    arg_parser.add_argument(
+        "--port", dest="port", type=int, default=defaults.SERVICE_PORT
+    )
+    arg_parser.add_argument(
+        "--max_concurrent_requests",
+        dest="max_concurrent_requests",
+        type=int,
+        default=defaults.SERVICE_MAX_CONCURRENT_REQUESTS,
+        help="the maximum number of journeys looked up at once",
+    )
+    arg_parser.add_argument(
+        "--record_path",
+        dest="record_path",
+        help="record the transport api requests to this .jsonl.gz file",
+    )
+    arg_parser.add_argument(
+        "--replay_path",
+        dest="replay_path",
+        help="answer the transport api requests from this .jsonl.gz recording",
+    )
+    arg_parser.add_argument(
+        "--trace_path",
+        dest="trace_path",
+        help="append a timed span for each stage of every lookup to this .jsonl file",
+    )
+    args = arg_parser.parse_args()
+    defaults.API_RECORD_PATH = args.record_path
+    defaults.API_REPLAY_PATH = args.replay_path
+    if args.trace_path:
+        set_exporter(JsonLinesExporter(args.trace_path))
+        atexit.register(set_exporter, None)
+    asyncio.run(
+        serve(
+            JourneyService(
+                host=args.host,
+                port=args.port,
+                max_concurrent_requests=args.max_concurrent_requests,
+            )
+        )
+    )
@@ -0,0 +1,37 @@
+"""
+shared test configuration
+"""
+
+from dataclasses import fields
+import pytest
+from src.data_model.api.transport_api import (
+    failed_leg_statistics,
+    leg_memory_cache,
+    timetable_graph,
+)
+from src.data_model.get_train_information import journey_memory_cache
+from src.data_model.route_times import _edge_arrays
+
+
+def clear_module_state():
+    """
+    clear the in memory caches, and reset the counters of the failed legs
+    in place, as they are imported by name
+    """
+    journey_memory_cache.clear()
+    leg_memory_cache.clear()
+    timetable_graph.clear()
+    _edge_arrays.clear()
+    for field in fields(failed_leg_statistics):
+        setattr(failed_leg_statistics, field.name, 0)
+
+
+@pytest.fixture(autouse=True)
+def clear_memory_caches():
+    """
+    the in memory caches and counters live for the whole process,
+    so clear them so that each test starts from the database alone
+    """
+    clear_module_state()
+    yield
+    clear_module_state()
@@ -0,0 +1,165 @@
+"""
+test the client module, against a local stub http server
+"""
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from src.data_model.api.client import (
+    TokenBucket,
+    TransportApiClient,
+    TransportApiError,
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    A stub of the transport api, counting the connections and requests made
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.request_count += 1
+            responses = self.server.responses
+            status_code, headers = responses.pop(0) if responses else (200, {})
+        body = json.dumps({"routes": [], "path": self.path}).encode("utf-8")
+        self.send_response(status_code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestTransportApiClient:
+    def setup_method(self, method):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.connection_count = 0
+        self.server.request_count = 0
+        self.server.responses = []
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}
+        )
+        self.server_thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/journey"
+        self.sleeps = []
+        self.client = TransportApiClient(
+            headers={"X-App-Id": "test"},
+            sleep=self.sleeps.append,
+        )
+
+    def teardown_method(self, method):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    def test_connection_is_reused(self):
+        """
+        test that many requests share a single keep-alive connection
+        """
+        for _ in range(5):
+            assert self.client.get_json(url=self.url, query_params={"from": "crs:LBG"}) == {
+                "routes": [],
+                "path": "/journey?from=crs%3ALBG",
+            }
+        assert self.server.request_count == 5
+        assert self.server.connection_count == 1
+
+    def test_retry_after_is_honoured(self):
+        """
+        test that a 429 is retried after the time in the Retry-After header
+        """
+        self.server.responses = [(429, {"Retry-After": "2"})]
+        self.client.get_json(url=self.url, query_params={})
+        assert self.server.request_count == 2
+        assert self.sleeps == [2.0]
+
+    def test_retry_after_http_date_is_honoured(self):
+        """
+        test that a 503 is retried after the http date in the Retry-After
+        header, including a date in -0000, which has no timezone when parsed
+        """
+        retry_after = formatdate(time.time() + 10)
+        assert retry_after.endswith("-0000")
+        self.server.responses = [(503, {"Retry-After": retry_after})]
+        self.client.get_json(url=self.url, query_params={})
+        assert self.server.request_count == 2
+        assert len(self.sleeps) == 1
+        assert 8 <= self.sleeps[0] <= 10
+
+    def test_retries_are_bounded(self):
+        """
+        test that a failing server is retried max_retries times, with a
+        backoff between each attempt, before raising
+        """
+        self.server.responses = [(503, {})] * 10
+        with pytest.raises(TransportApiError) as err:
+            self.client.get_json(url=self.url, query_params={})
+        assert err.value.status_code == 503
+        assert self.server.request_count == self.client.max_retries + 1
+        assert self.client.request_count == self.server.request_count
+        assert len(self.sleeps) == self.client.max_retries
+        for attempt, sleep in enumerate(self.sleeps):
+            assert 0 <= sleep <= self.client.backoff_secs * (2**attempt)
+
+    def test_not_found_is_not_retried(self):
+        """
+        test that a status that will not change is raised straight away
+        """
+        self.server.responses = [(404, {})]
+        with pytest.raises(TransportApiError) as err:
+            self.client.get_json(url=self.url, query_params={})
+        assert err.value.status_code == 404
+        assert self.server.request_count == 1
+
+    def test_requests_are_throttled(self):
+        """
+        test that the token bucket limits the rate of requests to the server
+        """
+        clock_time = [0.0]
+        self.client.token_bucket = TokenBucket(
+            rate_per_second=2,
+            capacity=2,
+            clock=lambda: clock_time[0],
+            sleep=self.sleeps.append,
+        )
+        for _ in range(4):
+            self.client.get_json(url=self.url, query_params={})
+        assert self.server.request_count == 4
+        # the burst is allowed, then each request waits for a token
+        assert self.sleeps == [0.5, 1.0]
+
+
+class TestTokenBucket:
+    def test_tokens_are_refilled(self):
+        """
+        test that tokens are refilled over time, up to the capacity
+        """
+        clock_time = [0.0]
+        sleeps = []
+        token_bucket = TokenBucket(
+            rate_per_second=1,
+            capacity=1,
+            clock=lambda: clock_time[0],
+            sleep=sleeps.append,
+        )
+        assert token_bucket.acquire() == 0.0
+        clock_time[0] = 10.0
+        assert token_bucket.acquire() == 0.0
+        assert token_bucket.acquire() == 1.0
+        assert sleeps == [1.0]
@@ -0,0 +1,232 @@
+"""
+test the replay module
+"""
+
+import gzip
+import json
+import os
+from unittest.mock import MagicMock, patch
+import pytest
+from src import defaults
+from src.data_model.api.client import TransportApiClient, TransportApiError
+from src.data_model.api.replay import (
+    RecordingClient,
+    ReplayClient,
+    read_recording,
+    request_key,
+)
+from src.data_model.api.transport_api import (
+    get_client,
+    leg_memory_cache,
+    retrieve_journey,
+    set_client,
+    timetable_graph,
+)
+from src.data_model.db.trains import initialise_database
+from tests.data_model.api.test_transport_api import (
+    JOURNEY_DETAILS,
+    JOURNEY_REQUEST,
+    LBG_CHX_ARGS,
+    MOCK_LBG_CHX_JOURNEY,
+    mocked_requests_get,
+)
+
+BASE_URL = "https://transportapi.com/v3/uk/public_journey.json"
+
+
+def write_recording(path, recorded_requests: list[dict]) -> None:
+    with gzip.open(path, mode="wt", encoding="utf-8") as fh:
+        for recorded_request in recorded_requests:
+            fh.write(json.dumps(recorded_request) + "\n")
+
+
+class TestRecordingClient:
+    def test_records_responses_and_errors(self, tmp_path):
+        """
+        test that each request is recorded with its response, or its error,
+        and the recording is appended to
+        """
+        path = tmp_path / "recording.jsonl.gz"
+        client = MagicMock(request_count=0)
+        client.get_json.side_effect = [
+            MOCK_LBG_CHX_JOURNEY,
+            TransportApiError("Problem connecting to the Transport API", 500),
+        ]
+        recording_client = RecordingClient(client=client, path=path)
+        assert recording_client.get_json(BASE_URL, LBG_CHX_ARGS) == MOCK_LBG_CHX_JOURNEY
+        with pytest.raises(TransportApiError):
+            recording_client.get_json(BASE_URL, {**LBG_CHX_ARGS, "time": "23:59"})
+        recording_client.close()
+        client.close.assert_called_once()
+
+        recording_client = RecordingClient(
+            client=MagicMock(get_json=MagicMock(return_value={"routes": []})),
+            path=path,
+        )
+        recording_client.get_json(BASE_URL, {**LBG_CHX_ARGS, "to": "crs:WAT"})
+        recording_client.close()
+
+        recorded_requests = list(read_recording(path))
+        assert [x["status_code"] for x in recorded_requests] == [200, 500, 200]
+        assert recorded_requests[0]["params"] == LBG_CHX_ARGS
+        assert recorded_requests[0]["response"] == MOCK_LBG_CHX_JOURNEY
+        assert "error" in recorded_requests[1]
+
+
+class TestReplayClient:
+    def test_replays_recorded_requests(self, tmp_path):
+        """
+        test that a recorded request is answered whatever the url, and with
+        the parameters as strings, as a url query string would give them
+        """
+        path = tmp_path / "recording.jsonl.gz"
+        write_recording(
+            path,
+            [
+                {
+                    "params": {**LBG_CHX_ARGS, "limit": 5},
+                    "status_code": 200,
+                    "latency_secs": 0.2,
+                    "response": MOCK_LBG_CHX_JOURNEY,
+                }
+            ],
+        )
+        replay_client = ReplayClient(path=path)
+        assert len(replay_client) == 1
+        assert (
+            replay_client.get_json("http://127.0.0.1/", {**LBG_CHX_ARGS, "limit": "5"})
+            == MOCK_LBG_CHX_JOURNEY
+        )
+        assert replay_client.request_count == 1
+        assert request_key({"a": 1, "b": "x"}) == request_key({"b": "x", "a": "1"})
+
+    def test_recorded_and_missing_requests_fail(self, tmp_path):
+        """
+        test that a request that failed when recorded fails again,
+        and a request that was not recorded fails with a 404
+        """
+        path = tmp_path / "recording.jsonl.gz"
+        write_recording(
+            path,
+            [
+                {
+                    "params": LBG_CHX_ARGS,
+                    "status_code": 503,
+                    "latency_secs": 0.2,
+                    "error": "Problem connecting to the Transport API",
+                }
+            ],
+        )
+        replay_client = ReplayClient(path=path)
+        with pytest.raises(TransportApiError) as err:
+            replay_client.get_json(BASE_URL, LBG_CHX_ARGS)
+        assert err.value.status_code == 503
+        with pytest.raises(TransportApiError) as err:
+            replay_client.get_json(BASE_URL, {**LBG_CHX_ARGS, "to": "crs:XXX"})
+        assert err.value.status_code == 404
+
+    def test_latency_and_error_injection(self, tmp_path):
+        """
+        test that every request waits the configured latency, and the
+        injected errors are a seeded share of the requests
+        """
+        path = tmp_path / "recording.jsonl.gz"
+        write_recording(
+            path,
+            [
+                {
+                    "params": LBG_CHX_ARGS,
+                    "status_code": 200,
+                    "latency_secs": 0.2,
+                    "response": MOCK_LBG_CHX_JOURNEY,
+                }
+            ],
+        )
+
+        def replay(**kwargs) -> tuple[list[float], list[int]]:
+            delays = []
+            replay_client = ReplayClient(path=path, seed=1, sleep=delays.append, **kwargs)
+            status_codes = []
+            for _ in range(200):
+                try:
+                    replay_client.get_json(BASE_URL, LBG_CHX_ARGS)
+                    status_codes.append(200)
+                except TransportApiError as err:
+                    status_codes.append(err.status_code)
+            return delays, status_codes
+
+        delays, status_codes = replay(
+            latency_secs=0.05, latency_jitter_secs=0.01, error_rate=0.25
+        )
+        assert len(delays) == 200
+        assert all(0.05 <= x <= 0.06 for x in delays)
+        assert 25 < status_codes.count(503) < 75
+        assert set(status_codes) == {200, 503}
+        # the same seed gives the same errors
+        assert replay(latency_secs=0.05, latency_jitter_secs=0.01, error_rate=0.25)[
+            1
+        ] == status_codes
+
+        delays, status_codes = replay(use_recorded_latency=True)
+        assert set(delays) == {0.2}
+        assert set(status_codes) == {200}
+
+
+class TestRecordAndReplayPipeline:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        set_client(None)
+        os.remove("trains.db")
+
+    def restart(self):
+        """
+        start again from an empty database and empty caches
+        """
+        os.remove("trains.db")
+        initialise_database()
+        leg_memory_cache.clear()
+        timetable_graph.clear()
+
+    def test_replayed_journey_matches_recorded_journey(self, tmp_path):
+        """
+        test that a journey retrieved from the api while recording is
+        retrieved the same from the recording, without the api
+        """
+        path = str(tmp_path / "recording.jsonl.gz")
+        with patch("requests.Session.get", side_effect=mocked_requests_get):
+            set_client(RecordingClient(client=TransportApiClient(), path=path))
+            assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
+            set_client(None)
+
+        self.restart()
+        with patch("requests.Session.get") as mock_get:
+            replay_client = ReplayClient(path=path)
+            set_client(replay_client)
+            assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
+        mock_get.assert_not_called()
+        assert replay_client.request_count == len(replay_client) == 3
+
+    def test_default_client_from_defaults(self, tmp_path):
+        """
+        test that the default client records, or replays, when the paths are set
+        """
+        path = str(tmp_path / "recording.jsonl.gz")
+        with patch.object(defaults, "API_RECORD_PATH", path), patch(
+            "requests.Session.get", side_effect=mocked_requests_get
+        ):
+            set_client(None)
+            assert isinstance(get_client(), RecordingClient)
+            assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
+            set_client(None)
+
+        self.restart()
+        with patch.object(defaults, "API_REPLAY_PATH", path):
+            set_client(None)
+            assert isinstance(get_client(), ReplayClient)
+            assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
@@ -3,14 +3,22 @@ test the transport_api module
 """
 import os
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import patch
 from src import defaults
 from src.data_model.dataclasses import JourneyRequest, JourneyDetails
 from src.data_model.api.transport_api import (
+    NoJourneyFound,
+    failed_leg_statistics,
+    leg_memory_cache,
+    timetable_graph,
+    prefetch_legs,
+    raise_if_failed_leg,
     retrieve_journey,
     build_query_params,
 )
+import pytest
+from src.data_model.db.trains import initialise_database
 
 JOURNEY_REQUEST = JourneyRequest(
     departure_date_time=datetime(2024, 6, 2, 14, 17),
@@ -28,11 +36,11 @@ JOURNEY_DETAILS = JourneyDetails(
         },
         {
             "station_id": "CHX",
-            "wait_time": 6,
+            "wait_time": 0,
         },
         {
             "station_id": "WAT",
-            "wait_time": 27,
+            "wait_time": 28,
         },
         {
             "station_id": "HMC",
@@ -141,6 +149,40 @@ def mocked_requests_get(*args, **kwargs):
     return MockResponse(None, 404)
 
 
+def windowed_requests_get(*args, **kwargs):
+    """
+    like the api, only the next few departures from the requested time are
+    returned. Every leg departs every 20 minutes, and takes 45 minutes
+    """
+
+    class MockResponse:
+        def __init__(self, json_data, status_code):
+            self.json_data = json_data
+            self.status_code = status_code
+
+        def json(self):
+            return self.json_data
+
+    params = kwargs["params"]
+    departures_from = datetime.strptime(
+        f"{params['date']} {params['time']}", "%Y-%m-%d %H:%M"
+    )
+    first_departure = departures_from + timedelta(minutes=-departures_from.minute % 20)
+    routes = []
+    for idx in range(3):
+        departure_date_time = first_departure + timedelta(minutes=20 * idx)
+        routes.append(
+            {
+                "departure_datetime": departure_date_time.isoformat(),
+                "arrival_datetime": (
+                    departure_date_time + timedelta(minutes=45)
+                ).isoformat(),
+                "duration": "00:45:00",
+            }
+        )
+    return MockResponse({"routes": routes}, 200)
+
+
 class TestBuildQueryParams:
     def test_build_query_params(self):
         """
@@ -163,9 +205,236 @@ class TestBuildQueryParams:
 
 
 class TestTransportApi:
-    @patch("requests.get", side_effect=mocked_requests_get)
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
     def test_retrieve_journey(self, mock_get):
         """
         test the retrieve_journey function
         """
         assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journey_shares_cached_legs(self, mock_get):
+        """
+        test that a route sharing legs with an earlier route
+        only requests the legs it does not share
+        """
+        retrieve_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2024, 6, 2, 14, 17),
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX", "WAT"],
+            )
+        )
+        assert mock_get.call_count == 2
+
+        assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
+        assert mock_get.call_count == 3
+        assert mock_get.call_args.kwargs["params"]["from"] == "crs:WAT"
+        assert mock_get.call_args.kwargs["params"]["to"] == "crs:HMC"
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journey_answered_from_departures(self, mock_get):
+        """
+        test that a later departure time within the window already
+        returned by the api does not request it again
+        """
+        retrieve_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2024, 6, 2, 14, 17),
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX"],
+            )
+        )
+        assert mock_get.call_count == 1
+
+        journey_details = retrieve_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2024, 6, 2, 14, 18),
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX"],
+            )
+        )
+        assert mock_get.call_count == 1
+        assert journey_details.train_stations_with_wait[0]["wait_time"] == 1
+        assert journey_details.arrival_date_time() == datetime(2024, 6, 2, 14, 38)
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journey_answered_from_timetable(self, mock_get):
+        """
+        test that a leg covered by the timetable graph is answered
+        without a database query
+        """
+        retrieve_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2024, 6, 2, 14, 17),
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX"],
+            )
+        )
+        with patch(
+            "src.data_model.api.transport_api.retrieve_leg_from_database"
+        ) as mock_retrieve_leg_from_database, patch(
+            "src.data_model.api.transport_api.retrieve_next_departure"
+        ) as mock_retrieve_next_departure:
+            journey_details = retrieve_journey(
+                JourneyRequest(
+                    departure_date_time=datetime(2024, 6, 2, 14, 18),
+                    max_wait_time=60,
+                    station_identifiers=["LBG", "CHX"],
+                )
+            )
+        mock_retrieve_leg_from_database.assert_not_called()
+        mock_retrieve_next_departure.assert_not_called()
+        assert mock_get.call_count == 1
+        assert journey_details.arrival_date_time() == datetime(2024, 6, 2, 14, 38)
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journey_prefetch(self, mock_get):
+        """
+        test that prefetching requests every leg up front, and the journey
+        is then resolved from the stored departures
+        """
+        journey_details = retrieve_journey(
+            JOURNEY_REQUEST,
+            prefetch=True,
+        )
+        # one window for the first leg, and one per offset for the later legs
+        assert mock_get.call_count == 1 + (2 * len(defaults.PREFETCH_OFFSETS_MINS))
+        assert journey_details == JOURNEY_DETAILS
+
+        # the windows already covered by stored departures are not requested again
+        mock_get.reset_mock()
+        retrieve_journey(JOURNEY_REQUEST, prefetch=True)
+        assert "crs:LBG" not in [x.kwargs["params"]["from"] for x in mock_get.call_args_list]
+        assert "crs:WAT" not in [x.kwargs["params"]["from"] for x in mock_get.call_args_list]
+
+    @patch("requests.Session.get", side_effect=windowed_requests_get)
+    def test_prefetch_covers_every_leg(self, mock_get):
+        """
+        test that after prefetching a route of 4 legs, each leg later than
+        the windows from the departure time is resolved without a request
+        """
+        journey_request = JourneyRequest(
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            max_wait_time=60,
+            station_identifiers=["LBG", "CHX", "WAT", "HMC", "NEM"],
+        )
+        prefetch_legs(journey_request=journey_request)
+        assert mock_get.call_count > 0
+
+        mock_get.reset_mock()
+        journey_details = retrieve_journey(journey_request)
+        mock_get.assert_not_called()
+        assert [x["wait_time"] for x in journey_details.train_stations_with_wait] == [
+            3,
+            15,
+            15,
+            15,
+            None,
+        ]
+        assert journey_details.arrival_date_time() == datetime(2024, 6, 2, 18, 5)
+
+    def test_same_leg_with_and_without_prefetch(self):
+        """
+        test that a leg is the same train whether it is chosen from the api
+        response or from the stored departures, where the api does not list
+        the departures in time order
+        """
+        journey_request = JourneyRequest(
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            max_wait_time=27,
+            station_identifiers=["LBG", "CHX", "WAT", "HMC"],
+        )
+        journeys = []
+        for prefetch in [False, True]:
+            os.remove("trains.db")
+            initialise_database()
+            leg_memory_cache.clear()
+            timetable_graph.clear()
+            with patch("requests.Session.get", side_effect=mocked_requests_get):
+                journeys.append(retrieve_journey(journey_request, prefetch=prefetch))
+        assert journeys[0] == journeys[1]
+        assert [x["wait_time"] for x in journeys[0].train_stations_with_wait] == [
+            0,
+            0,
+            28,
+            None,
+        ]
+        assert journeys[0].exceeded_wait_at_station() == "WAT"
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journey_stops_at_wait_too_long(self, mock_get):
+        """
+        test that the legs after a wait longer than the max wait time
+        are not requested
+        """
+        journey_details = retrieve_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2024, 6, 2, 14, 17),
+                max_wait_time=5,
+                station_identifiers=["LBG", "CHX", "WAT", "HMC"],
+            )
+        )
+        assert mock_get.call_count == 3
+        assert journey_details.exceeded_wait_at_station() == "WAT"
+        assert [x["wait_time"] for x in journey_details.train_stations_with_wait] == [
+            0,
+            0,
+            28,
+            None,
+        ]
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journey_no_viable_journey_is_stored(self, mock_get):
+        """
+        test that a leg with no viable journey is answered from the
+        database until it is out of date
+        """
+        journey_request = JourneyRequest(
+            departure_date_time=datetime(2024, 6, 2, 23, 50),
+            max_wait_time=60,
+            station_identifiers=["LBG", "CHX"],
+        )
+        hits = failed_leg_statistics.hits
+        with pytest.raises(NoJourneyFound, match="No viable journey found"):
+            retrieve_journey(journey_request)
+        with pytest.raises(NoJourneyFound, match="No viable journey found"):
+            retrieve_journey(journey_request)
+        assert mock_get.call_count == 1
+        assert failed_leg_statistics.hits == hits + 1
+
+        expirations = failed_leg_statistics.expirations
+        raise_if_failed_leg(
+            origin_station="LBG",
+            destination="CHX",
+            earliest_departure_time=datetime(2024, 6, 2, 23, 50),
+            ttl_mins=0,
+        )
+        assert failed_leg_statistics.expirations == expirations + 1
+
+    @patch("requests.Session.get")
+    def test_retrieve_journey_no_routes_is_stored(self, mock_get):
+        """
+        test that a leg with no routes is only requested once
+        """
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {"routes": []}
+        journey_request = JourneyRequest(
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            max_wait_time=60,
+            station_identifiers=["LBG", "XXX"],
+        )
+        for _ in range(2):
+            with pytest.raises(NoJourneyFound, match="No routes found"):
+                retrieve_journey(journey_request)
+        assert mock_get.call_count == 1
@@ -0,0 +1,160 @@
+"""
+test file for journey_lookup
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from src.data_model.dataclasses import JourneyDetails, JourneyRequest
+from src.data_model.db.journey_lookup import (
+    from_epoch_minutes,
+    retrieve_stored_journey,
+    route_hash,
+    to_epoch_minutes,
+)
+from src.data_model.db.trains import (
+    initialise_database,
+    retrieve_journey,
+    retrieve_sub_journey,
+    store_journey,
+)
+
+JOURNEY = JourneyDetails(
+    time_in_mins=32,
+    departure_date_time=datetime(2022, 2, 9, 14, 17),
+    train_stations_with_wait=[
+        {"station_id": "LBG", "wait_time": 0},
+        {"station_id": "SAJ", "wait_time": 10},
+        {"station_id": "NWX", "wait_time": 5},
+        {"station_id": "BXY", "wait_time": None},
+    ],
+)
+
+# stopped at SAJ, where the wait was longer than the max wait time
+STOPPED_JOURNEY = JourneyDetails(
+    time_in_mins=55,
+    departure_date_time=datetime(2022, 2, 9, 15, 17),
+    train_stations_with_wait=[
+        {"station_id": "LBG", "wait_time": 0},
+        {"station_id": "SAJ", "wait_time": 45},
+        {"station_id": "NWX", "wait_time": None},
+        {"station_id": "BXY", "wait_time": None},
+    ],
+    exceeded_wait_station_order=1,
+)
+
+
+def journey_request(journey: JourneyDetails, max_wait_time: int = 60) -> JourneyRequest:
+    return JourneyRequest(
+        departure_date_time=journey.departure_date_time,
+        max_wait_time=max_wait_time,
+        station_identifiers=journey.train_stations_with_wait.station_ids(),
+    )
+
+
+class TestCompactKeys:
+    def test_epoch_minutes(self):
+        """
+        test that a date and time on a whole minute is stored as the minutes
+        since the epoch, ignoring the timezone as the DateTime columns did
+        """
+        date_time = datetime(2022, 2, 9, 14, 17)
+        assert to_epoch_minutes(datetime(1970, 1, 1, 0, 1)) == 1
+        assert from_epoch_minutes(to_epoch_minutes(date_time)) == date_time
+        assert to_epoch_minutes(
+            date_time.replace(tzinfo=timezone(timedelta(hours=1)))
+        ) == to_epoch_minutes(date_time)
+        assert to_epoch_minutes(datetime(2022, 2, 9, 14, 17, 30)) is None
+        assert to_epoch_minutes(None) is None
+
+    def test_route_hash(self):
+        """
+        test that the route hash is the 64 bit FNV-1a hash of the joined
+        station list, as a signed integer
+        """
+        assert route_hash([]) == 0xCBF29CE484222325 - (1 << 64)
+        assert route_hash(["a"]) == 0xAF63DC4C8601EC8C - (1 << 64)
+        assert route_hash(["LBG", "SAJ"]) != route_hash(["SAJ", "LBG"])
+        assert all(
+            -(1 << 63) <= route_hash([x, "SAJ"]) < (1 << 63)
+            for x in ["LBG", "NWX", "BXY", "CHX"]
+        )
+
+
+class TestRetrieveStoredJourney:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def test_matches_trains_retrieve_journey(self):
+        """
+        test that a stored journey is read the same as with the orm
+        """
+        store_journey(JOURNEY)
+        journey_details = retrieve_stored_journey(journey_request(JOURNEY))
+        assert journey_details == JOURNEY
+        assert journey_details == retrieve_journey(
+            station_list=["LBG", "SAJ", "NWX", "BXY"],
+            departure_date_time=JOURNEY.departure_date_time,
+        )
+
+    def test_not_stored_is_none(self):
+        """
+        test that a journey that is not stored is not answered
+        """
+        store_journey(JOURNEY)
+        assert retrieve_stored_journey(journey_request(STOPPED_JOURNEY)) is None
+
+    def test_stopped_journey_only_answers_shorter_max_wait_time(self):
+        """
+        test that a journey that stopped at a long wait only answers a request
+        where that wait is also too long
+        """
+        store_journey(STOPPED_JOURNEY)
+        assert (
+            retrieve_stored_journey(journey_request(STOPPED_JOURNEY, max_wait_time=30))
+            == STOPPED_JOURNEY
+        )
+        assert (
+            retrieve_stored_journey(journey_request(STOPPED_JOURNEY, max_wait_time=60))
+            is None
+        )
+
+    def test_sub_route_of_stored_journey(self):
+        """
+        test that a sub-route is read the same as with the orm
+        """
+        store_journey(
+            JourneyDetails(
+                time_in_mins=JOURNEY.time_in_mins,
+                departure_date_time=JOURNEY.departure_date_time,
+                train_stations_with_wait=JOURNEY.train_stations_with_wait,
+                arrival_offsets_secs=[0, 300, 1260, 1920],
+            )
+        )
+        journey_details = retrieve_stored_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2022, 2, 9, 14, 22),
+                max_wait_time=60,
+                station_identifiers=["SAJ", "NWX"],
+            )
+        )
+        assert journey_details.time_in_mins == 16
+        assert journey_details == retrieve_sub_journey(
+            station_list=["SAJ", "NWX"],
+            departure_date_time=datetime(2022, 2, 9, 14, 22),
+        )
+
+    def test_no_database_is_none(self):
+        """
+        test that a missing database is not created, and nothing is answered
+        """
+        os.remove("trains.db")
+        assert retrieve_stored_journey(journey_request(JOURNEY)) is None
+        assert not os.path.exists("trains.db")
+        initialise_database()
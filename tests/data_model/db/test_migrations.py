@@ -0,0 +1,317 @@
+"""
+test file for migrations
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from src.data_model.dataclasses import JourneyDetails
+from src.data_model.db.journey_lookup import join_wait_times, to_epoch_minutes
+from src.data_model.db.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    get_column_names,
+    has_unique_index,
+    migrate_database_file,
+)
+from src.data_model.db.trains import (
+    engine,
+    retrieve_journey,
+    retrieve_sub_journey,
+    store_journey,
+)
+
+JOURNEY_ONE = JourneyDetails(
+    time_in_mins=32,
+    departure_date_time=datetime(2022, 2, 9, 14, 17),
+    train_stations_with_wait=[
+        {
+            "station_id": "LBG",
+            "wait_time": 0,
+        },
+        {
+            "station_id": "SAJ",
+            "wait_time": None,
+        },
+    ],
+)
+
+JOURNEY_TWO = JourneyDetails(
+    time_in_mins=35,
+    departure_date_time=datetime(2022, 2, 9, 15, 17),
+    train_stations_with_wait=JOURNEY_ONE.train_stations_with_wait,
+)
+
+SCHEMA_VERSION_ZERO = [
+    """
+    CREATE TABLE journeys (
+        journey_id INTEGER NOT NULL,
+        departure_date_time DATETIME NOT NULL,
+        joined_journey_list VARCHAR NOT NULL,
+        total_journey_time_mins INTEGER NOT NULL,
+        PRIMARY KEY (journey_id),
+        CONSTRAINT uidx_joined_journey_list UNIQUE (joined_journey_list)
+    )
+    """,
+    """
+    CREATE TABLE journey_stations (
+        journey_station_id INTEGER NOT NULL,
+        journey_id VARCHAR,
+        station_order INTEGER NOT NULL,
+        station_identifier VARCHAR NOT NULL,
+        wait_time_mins INTEGER,
+        PRIMARY KEY (journey_station_id),
+        FOREIGN KEY(journey_id) REFERENCES journeys (journey_id) ON DELETE Cascade ON UPDATE Cascade
+    )
+    """,
+    """
+    INSERT INTO journeys VALUES (1, '2022-02-09 14:17:00.000000', 'LBG_SAJ', 32)
+    """,
+    """
+    INSERT INTO journey_stations VALUES (1, 1, 0, 'LBG', 0), (2, 1, 1, 'SAJ', NULL)
+    """,
+]
+
+
+class TestMigrations:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        engine.dispose()
+        connection = sqlite3.connect("trains.db")
+        for statement in SCHEMA_VERSION_ZERO:
+            connection.execute(statement)
+        connection.commit()
+        connection.close()
+
+    def teardown_method(self, method):
+        engine.dispose()
+        os.remove("trains.db")
+
+    def test_migrate_journeys_unique_on_departure(self):
+        """
+        test that a database from before the schema was versioned
+        can store a second departure time of a stored route
+        """
+        store_journey(JOURNEY_TWO)
+
+        with engine.connect() as connection:
+            assert (
+                connection.exec_driver_sql("PRAGMA user_version").scalar()
+                == SCHEMA_VERSION
+            )
+            assert not has_unique_index(
+                connection=connection,
+                table_name="journeys",
+                columns=["joined_journey_list"],
+            )
+
+        assert (
+            retrieve_journey(
+                station_list=["LBG", "SAJ"],
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+            )
+            == JOURNEY_ONE
+        )
+        assert (
+            retrieve_journey(
+                station_list=["LBG", "SAJ"],
+                departure_date_time=JOURNEY_TWO.departure_date_time,
+            )
+            == JOURNEY_TWO
+        )
+
+    def test_migrate_journey_stations_times(self):
+        """
+        test that the journey_stations table is given the station times and
+        its indexes, and that a journey already stored, without times, is
+        given the times that follow from it, so answers itself as a sub-route
+        """
+        with engine.begin() as connection:
+            for _, migration in MIGRATIONS[:4]:
+                migration(connection)
+            assert {"arrival_date_time", "departure_date_time"} <= set(
+                get_column_names(connection=connection, table_name="journey_stations")
+            )
+            index_names = [
+                x[1]
+                for x in connection.exec_driver_sql(
+                    "PRAGMA index_list(journey_stations)"
+                ).all()
+            ]
+        assert "idx_station_ident_arrival" in index_names
+        assert "idx_journey_stations_journey_id_order" in index_names
+
+        store_journey(JOURNEY_TWO)
+
+        assert (
+            retrieve_sub_journey(
+                station_list=["LBG", "SAJ"],
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+            )
+            == JOURNEY_ONE
+        )
+        assert (
+            retrieve_journey(
+                station_list=["LBG", "SAJ"],
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+            )
+            == JOURNEY_ONE
+        )
+
+    def test_migrate_compact_journeys(self):
+        """
+        test that the journeys and their station times are moved to the
+        compact schema, other than a journey that did not depart on a whole
+        minute, and that the file can be vacuumed once migrated
+        """
+        with engine.begin() as connection:
+            for _, migration in MIGRATIONS[:4]:
+                migration(connection)
+            connection.exec_driver_sql(
+                "INSERT INTO journeys VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        2,
+                        "2022-02-09 15:17:00.000000",
+                        "LBG_SAJ_NWX",
+                        21,
+                        join_wait_times([0, 5, None]),
+                        None,
+                    ),
+                    (3, "2022-02-09 15:17:30.000000", "LBG_NWX", 9, "0_", None),
+                ],
+            )
+            connection.exec_driver_sql(
+                "INSERT INTO journey_stations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (3, "2", 0, "LBG", 0, "2022-02-09 15:17:00.000000", None),
+                    (
+                        4,
+                        "2",
+                        1,
+                        "SAJ",
+                        5,
+                        "2022-02-09 15:26:00.000000",
+                        "2022-02-09 15:31:00.000000",
+                    ),
+                    (5, "2", 2, "NWX", None, "2022-02-09 15:38:00.000000", None),
+                    (6, "3", 0, "LBG", 0, "2022-02-09 15:17:30.000000", None),
+                    (7, "3", 1, "NWX", None, "2022-02-09 15:26:30.000000", None),
+                ],
+            )
+        engine.dispose()
+
+        result = migrate_database_file(database_path="trains.db", vacuum=True)
+        assert result["from_version"] == 0
+        assert result["to_version"] == SCHEMA_VERSION
+        assert result["journeys"] == 2
+
+        with engine.connect() as connection:
+            table_names = connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            ).scalars().all()
+            station_identifiers = connection.exec_driver_sql(
+                "SELECT station_identifier FROM stations ORDER BY station_id"
+            ).scalars().all()
+        assert not [x for x in table_names if x.startswith("legacy_")]
+        assert station_identifiers == ["LBG", "NWX", "SAJ"]
+
+        assert (
+            retrieve_journey(
+                station_list=["LBG", "SAJ"],
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+            )
+            == JOURNEY_ONE
+        )
+        assert (
+            retrieve_journey(
+                station_list=["LBG", "SAJ", "NWX"],
+                departure_date_time=datetime(2022, 2, 9, 15, 17),
+            ).time_in_mins
+            == 21
+        )
+        assert (
+            retrieve_sub_journey(
+                station_list=["SAJ", "NWX"],
+                departure_date_time=datetime(2022, 2, 9, 15, 26),
+            ).time_in_mins
+            == 12
+        )
+
+    def test_legacy_journey_gains_times(self):
+        """
+        test that a journey stored without times is given the times that
+        follow from it when migrated, and the rest once it is stored again
+        """
+        with engine.begin() as connection:
+            for _, migration in MIGRATIONS[:4]:
+                migration(connection)
+            connection.exec_driver_sql(
+                "INSERT INTO journeys VALUES "
+                "(2, '2022-02-09 15:17:00.000000', 'LBG_SAJ_NWX', 21, '0_5_', NULL)"
+            )
+            connection.exec_driver_sql(
+                "INSERT INTO journey_stations VALUES "
+                "(3, '2', 0, 'LBG', 0, NULL, NULL), "
+                "(4, '2', 1, 'SAJ', 5, NULL, NULL), "
+                "(5, '2', 2, 'NWX', NULL, NULL, NULL)"
+            )
+        engine.dispose()
+        migrate_database_file(database_path="trains.db")
+
+        def station_times():
+            with engine.connect() as connection:
+                return connection.exec_driver_sql(
+                    "SELECT arrival_minutes, departure_minutes FROM journey_stations "
+                    "WHERE journey_id = 2 ORDER BY station_order"
+                ).all()
+
+        departure_minutes = to_epoch_minutes(datetime(2022, 2, 9, 15, 17))
+        assert station_times() == [
+            (departure_minutes, departure_minutes),
+            (None, None),
+            (departure_minutes + 21, None),
+        ]
+        assert (
+            retrieve_sub_journey(
+                station_list=["LBG", "SAJ", "NWX"],
+                departure_date_time=datetime(2022, 2, 9, 15, 17),
+            ).time_in_mins
+            == 21
+        )
+        assert (
+            retrieve_sub_journey(
+                station_list=["SAJ", "NWX"],
+                departure_date_time=datetime(2022, 2, 9, 15, 26),
+            )
+            is None
+        )
+
+        store_journey(
+            JourneyDetails(
+                time_in_mins=21,
+                departure_date_time=datetime(2022, 2, 9, 15, 17),
+                train_stations_with_wait=[
+                    {"station_id": "LBG", "wait_time": 0},
+                    {"station_id": "SAJ", "wait_time": 5},
+                    {"station_id": "NWX", "wait_time": None},
+                ],
+                arrival_offsets_secs=[0, 540, 1260],
+            )
+        )
+
+        assert station_times() == [
+            (departure_minutes, departure_minutes),
+            (departure_minutes + 9, departure_minutes + 14),
+            (departure_minutes + 21, None),
+        ]
+        assert (
+            retrieve_sub_journey(
+                station_list=["SAJ", "NWX"],
+                departure_date_time=datetime(2022, 2, 9, 15, 26),
+            ).time_in_mins
+            == 12
+        )
@@ -3,16 +3,36 @@ test file for trains
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from unittest.mock import patch
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT
 from src.data_model.dataclasses import JourneyDetails
+from src.data_model.db.journey_lookup import route_hash, to_epoch_minutes
 from src.data_model.db.trains import (
+    create_database_engine,
     Journeys,
     JourneyStations,
+    Routes,
+    Stations,
     initialise_database,
     Session,
+    engine,
     retrieve_journey,
+    retrieve_journeys,
+    retrieve_sub_journey,
+    retrieve_sub_journeys,
     store_journey,
+    store_journeys,
+    retrieve_leg,
+    store_leg,
+    retrieve_next_departure,
+    store_departures,
+    retrieve_failed_leg,
+    store_failed_leg,
 )
+from src import defaults
 
 JOURNEY_ONE = JourneyDetails(
     time_in_mins=32,
@@ -60,6 +80,28 @@ JOURNEY_TWO = JourneyDetails(
     ],
 )
 
+# JOURNEY_ONE with the arrival at each station, 5, 6 and 6 minute legs
+TIMED_JOURNEY = JourneyDetails(
+    time_in_mins=32,
+    departure_date_time=datetime(2022, 2, 9, 14, 17),
+    train_stations_with_wait=JOURNEY_ONE.train_stations_with_wait,
+    arrival_offsets_secs=[0, 300, 1260, 1920],
+)
+
+# stopped at SAJ, where the wait was longer than the max wait time
+STOPPED_JOURNEY = JourneyDetails(
+    time_in_mins=56,
+    departure_date_time=datetime(2022, 2, 9, 15, 17),
+    train_stations_with_wait=[
+        {"station_id": "LBG", "wait_time": 0},
+        {"station_id": "SAJ", "wait_time": 45},
+        {"station_id": "NWX", "wait_time": None},
+        {"station_id": "BXY", "wait_time": None},
+    ],
+    exceeded_wait_station_order=1,
+    arrival_offsets_secs=[0, 300, 3360, None],
+)
+
 
 class TestTrainJourneysDB:
     def setup_method(self, method):
@@ -80,10 +122,15 @@ class TestTrainJourneysDB:
         store_journey(JOURNEY_ONE)
         db_session = Session()
         query = (
-            db_session.query(Journeys, JourneyStations)
+            db_session.query(Journeys, JourneyStations, Stations)
+            .join(Routes, Routes.route_id == Journeys.route_id)
             .join(JourneyStations, JourneyStations.journey_id == Journeys.journey_id)
-            .filter(Journeys.joined_journey_list == "LBG_SAJ_NWX_BXY")
-            .filter(Journeys.departure_date_time == datetime(2022, 2, 9, 14, 17))
+            .join(Stations, Stations.station_id == JourneyStations.station_id)
+            .filter(Routes.joined_journey_list == "LBG_SAJ_NWX_BXY")
+            .filter(
+                Journeys.departure_minutes
+                == to_epoch_minutes(datetime(2022, 2, 9, 14, 17))
+            )
             .order_by(JourneyStations.station_order)
         )
 
@@ -91,8 +138,8 @@ class TestTrainJourneysDB:
 
         for row in query.all():
             assert row[0].total_journey_time_mins == 32
-            assert row[0].departure_date_time == datetime(2022, 2, 9, 14, 17)
-            journey_stations[row[1].station_identifier] = row[1]
+            assert row[0].route_id == route_hash(["LBG", "SAJ", "NWX", "BXY"])
+            journey_stations[row[2].station_identifier] = row[1]
 
         assert journey_stations["LBG"].wait_time_mins == 0
         assert journey_stations["LBG"].station_order == 0
@@ -120,3 +167,512 @@ class TestTrainJourneysDB:
             departure_date_time=JOURNEY_TWO.departure_date_time,
         )
         assert journey_details == JOURNEY_TWO
+
+    def test_sessions_are_returned_to_the_pool(self):
+        """
+        test that storing and retrieving a journey does not hold on to connections
+        """
+        store_journey(JOURNEY_ONE)
+        retrieve_journey(
+            station_list=[x["station_id"] for x in JOURNEY_ONE.train_stations_with_wait],
+            departure_date_time=JOURNEY_ONE.departure_date_time,
+        )
+        assert engine.pool.checkedout() == 0
+
+    def test_initialise_database_concurrently(self):
+        """
+        test that many threads can initialise a new database at once
+        """
+        os.remove("trains.db")
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for future in [executor.submit(initialise_database) for _ in range(8)]:
+                future.result()
+        store_journey(JOURNEY_ONE)
+        assert engine.pool.checkedout() == 0
+
+    def test_store_journey_many_departure_times(self):
+        """
+        test that a route can be stored for more than one departure time,
+        and that storing the same journey twice keeps the first
+        """
+        later_journey = JourneyDetails(
+            time_in_mins=40,
+            departure_date_time=datetime(2022, 2, 9, 15, 17),
+            train_stations_with_wait=JOURNEY_ONE.train_stations_with_wait,
+        )
+        store_journey(JOURNEY_ONE)
+        store_journey(later_journey)
+        store_journey(
+            JourneyDetails(
+                time_in_mins=50,
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+                train_stations_with_wait=JOURNEY_ONE.train_stations_with_wait,
+            )
+        )
+
+        station_list = [x["station_id"] for x in JOURNEY_ONE.train_stations_with_wait]
+        assert (
+            retrieve_journey(
+                station_list=station_list,
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+            )
+            == JOURNEY_ONE
+        )
+        assert (
+            retrieve_journey(
+                station_list=station_list,
+                departure_date_time=later_journey.departure_date_time,
+            )
+            == later_journey
+        )
+
+    def test_route_hash_collision_is_not_stored(self):
+        """
+        test that a journey whose route_id is taken by another route is not
+        stored, and the stored route only answers its own station list
+        """
+        with patch("src.data_model.db.trains.route_hash", return_value=1):
+            store_journeys([JOURNEY_ONE, JOURNEY_TWO])
+            assert (
+                retrieve_journey(
+                    station_list=JOURNEY_ONE.train_stations_with_wait.station_ids(),
+                    departure_date_time=JOURNEY_ONE.departure_date_time,
+                )
+                == JOURNEY_ONE
+            )
+            assert (
+                retrieve_journey(
+                    station_list=JOURNEY_TWO.train_stations_with_wait.station_ids(),
+                    departure_date_time=JOURNEY_TWO.departure_date_time,
+                ).time_in_mins
+                is None
+            )
+
+    def test_journey_not_on_a_whole_minute_is_not_stored(self):
+        """
+        test that a journey departing part way through a minute is not stored,
+        as the departures are stored in whole minutes
+        """
+        journey = JourneyDetails(
+            time_in_mins=32,
+            departure_date_time=datetime(2022, 2, 9, 14, 17, 30),
+            train_stations_with_wait=JOURNEY_ONE.train_stations_with_wait,
+        )
+        store_journey(journey)
+        assert (
+            retrieve_journey(
+                station_list=journey.train_stations_with_wait.station_ids(),
+                departure_date_time=journey.departure_date_time,
+            ).time_in_mins
+            is None
+        )
+        assert (
+            retrieve_journey(
+                station_list=journey.train_stations_with_wait.station_ids(),
+                departure_date_time=JOURNEY_ONE.departure_date_time,
+            ).time_in_mins
+            is None
+        )
+
+    def test_store_and_retrieve_journeys(self):
+        """
+        test that many journeys are stored, and retrieved together
+        """
+        store_journeys([JOURNEY_ONE, JOURNEY_TWO])
+        station_list_one = [x["station_id"] for x in JOURNEY_ONE.train_stations_with_wait]
+        station_list_two = [x["station_id"] for x in JOURNEY_TWO.train_stations_with_wait]
+
+        assert retrieve_journeys(
+            journey_keys=[
+                (station_list_one, JOURNEY_ONE.departure_date_time),
+                (station_list_two, JOURNEY_TWO.departure_date_time),
+                (station_list_two, datetime(2022, 2, 9, 15, 17)),
+            ],
+            chunk_size=2,
+        ) == {
+            (tuple(station_list_one), JOURNEY_ONE.departure_date_time): JOURNEY_ONE,
+            (tuple(station_list_two), JOURNEY_TWO.departure_date_time): JOURNEY_TWO,
+        }
+
+    def test_store_journeys_skips_stored_journeys(self):
+        """
+        test that a batch holding a journey that is already stored, and the
+        same journey twice, only stores each journey and its stations once
+        """
+        store_journey(JOURNEY_ONE)
+        store_journeys([JOURNEY_ONE, JOURNEY_TWO, JOURNEY_TWO])
+
+        with Session() as db_session:
+            assert db_session.query(Journeys).count() == 2
+            assert db_session.query(JourneyStations).count() == 8
+
+    def test_retrieve_sub_journey(self):
+        """
+        test that a prefix, and a sub-route departing when the stored journey
+        arrived at its first station, are answered from the stored journey
+        """
+        store_journey(TIMED_JOURNEY)
+        assert (
+            retrieve_sub_journey(
+                station_list=["LBG", "SAJ", "NWX", "BXY"],
+                departure_date_time=datetime(2022, 2, 9, 14, 17),
+            )
+            == TIMED_JOURNEY
+        )
+
+        prefix = retrieve_sub_journey(
+            station_list=["LBG", "SAJ", "NWX"],
+            departure_date_time=datetime(2022, 2, 9, 14, 17),
+        )
+        assert prefix == JourneyDetails(
+            time_in_mins=21,
+            departure_date_time=datetime(2022, 2, 9, 14, 17),
+            train_stations_with_wait=[
+                {"station_id": "LBG", "wait_time": 0},
+                {"station_id": "SAJ", "wait_time": 10},
+                {"station_id": "NWX", "wait_time": None},
+            ],
+        )
+        assert list(prefix.arrival_offsets_secs) == [0, 300, 1260]
+
+        sub_route = retrieve_sub_journey(
+            station_list=["SAJ", "NWX", "BXY"],
+            departure_date_time=datetime(2022, 2, 9, 14, 22),
+        )
+        assert sub_route == JourneyDetails(
+            time_in_mins=27,
+            departure_date_time=datetime(2022, 2, 9, 14, 22),
+            train_stations_with_wait=[
+                {"station_id": "SAJ", "wait_time": 10},
+                {"station_id": "NWX", "wait_time": 5},
+                {"station_id": "BXY", "wait_time": None},
+            ],
+        )
+        assert sub_route.arrival_date_time() == TIMED_JOURNEY.arrival_date_time()
+
+        # not when the stored journey arrived at SAJ, or not a sub-route of it
+        for station_list, departure_date_time in [
+            (["SAJ", "NWX", "BXY"], datetime(2022, 2, 9, 14, 23)),
+            (["SAJ", "BXY"], datetime(2022, 2, 9, 14, 22)),
+            (["NWX", "BXY", "SAJ"], datetime(2022, 2, 9, 14, 38)),
+        ]:
+            assert (
+                retrieve_sub_journey(
+                    station_list=station_list,
+                    departure_date_time=departure_date_time,
+                )
+                is None
+            )
+
+    def test_retrieve_sub_journey_of_stopped_journey(self):
+        """
+        test that a sub-route of a journey that stopped at a long wait stops
+        at the same station
+        """
+        store_journey(STOPPED_JOURNEY)
+        assert retrieve_sub_journey(
+            station_list=["SAJ", "NWX", "BXY"],
+            departure_date_time=datetime(2022, 2, 9, 15, 22),
+        ) == JourneyDetails(
+            time_in_mins=51,
+            departure_date_time=datetime(2022, 2, 9, 15, 22),
+            train_stations_with_wait=[
+                {"station_id": "SAJ", "wait_time": 45},
+                {"station_id": "NWX", "wait_time": None},
+                {"station_id": "BXY", "wait_time": None},
+            ],
+            exceeded_wait_station_order=0,
+        )
+        # the prefix ends before the long wait, so was retrieved in full
+        assert retrieve_sub_journey(
+            station_list=["LBG", "SAJ"],
+            departure_date_time=datetime(2022, 2, 9, 15, 17),
+        ) == JourneyDetails(
+            time_in_mins=5,
+            departure_date_time=datetime(2022, 2, 9, 15, 17),
+            train_stations_with_wait=[
+                {"station_id": "LBG", "wait_time": 0},
+                {"station_id": "SAJ", "wait_time": None},
+            ],
+        )
+
+    def test_retrieve_sub_journeys(self):
+        """
+        test that many sub-routes, of different lengths and first stations,
+        are answered in one query, the same as retrieving each of them
+        """
+        store_journeys([TIMED_JOURNEY, STOPPED_JOURNEY])
+        journey_keys = [
+            (["LBG", "SAJ", "NWX", "BXY"], datetime(2022, 2, 9, 14, 17)),
+            (["LBG", "SAJ", "NWX"], datetime(2022, 2, 9, 14, 17)),
+            (["LBG", "SAJ"], datetime(2022, 2, 9, 14, 17)),
+            (["SAJ", "NWX", "BXY"], datetime(2022, 2, 9, 14, 22)),
+            (["SAJ", "NWX", "BXY"], datetime(2022, 2, 9, 15, 22)),
+            (["LBG", "SAJ"], datetime(2022, 2, 9, 15, 17)),
+            (["SAJ", "NWX", "BXY"], datetime(2022, 2, 9, 14, 23)),
+            (["SAJ", "BXY"], datetime(2022, 2, 9, 14, 22)),
+            (["NWX", "BXY", "SAJ"], datetime(2022, 2, 9, 14, 38)),
+        ]
+        statements = []
+
+        def after_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            statements.append(statement)
+
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        try:
+            journeys = retrieve_sub_journeys(journey_keys=journey_keys)
+        finally:
+            event.remove(engine, "after_cursor_execute", after_cursor_execute)
+        assert len(statements) == 1
+
+        for station_list, departure_date_time in journey_keys:
+            assert journeys.get(
+                (tuple(station_list), departure_date_time)
+            ) == retrieve_sub_journey(
+                station_list=station_list,
+                departure_date_time=departure_date_time,
+            )
+        assert len(journeys) == 6
+
+    def test_journey_without_times_has_no_sub_journeys(self):
+        """
+        test that a journey stored without the arrival at each station only
+        answers itself
+        """
+        store_journey(JOURNEY_ONE)
+        assert (
+            retrieve_sub_journey(
+                station_list=["LBG", "SAJ", "NWX"],
+                departure_date_time=datetime(2022, 2, 9, 14, 17),
+            )
+            is None
+        )
+
+    def test_store_and_retrieve_leg(self):
+        """
+        test that a leg is stored and retrieved by its origin,
+        destination and earliest departure time
+        """
+        leg = {
+            "wait_time": 6,
+            "journey_time": 11,
+            "arrival_time": datetime(2024, 6, 2, 14, 53),
+        }
+        assert (
+            retrieve_leg(
+                origin_station="CHX",
+                destination="WAT",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 36),
+            )
+            is None
+        )
+        store_leg(
+            origin_station="CHX",
+            destination="WAT",
+            earliest_departure_date_time=datetime(2024, 6, 2, 14, 36),
+            leg=leg,
+        )
+        # storing the same leg again keeps the original row
+        store_leg(
+            origin_station="CHX",
+            destination="WAT",
+            earliest_departure_date_time=datetime(2024, 6, 2, 14, 36),
+            leg=leg,
+        )
+        assert (
+            retrieve_leg(
+                origin_station="CHX",
+                destination="WAT",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 36),
+            )
+            == leg
+        )
+        assert (
+            retrieve_leg(
+                origin_station="CHX",
+                destination="WAT",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 37),
+            )
+            is None
+        )
+
+    def test_retrieve_next_departure(self):
+        """
+        test that the first departure at or after the requested time is
+        returned, but only from a window covering the requested time
+        """
+        store_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=[
+                {
+                    "departure_time": datetime(2024, 6, 2, 14, 25),
+                    "arrival_time": datetime(2024, 6, 2, 14, 44),
+                    "journey_time": 19,
+                },
+                {
+                    "departure_time": datetime(2024, 6, 2, 14, 19),
+                    "arrival_time": datetime(2024, 6, 2, 14, 38),
+                    "journey_time": 19,
+                },
+            ],
+        )
+
+        assert retrieve_next_departure(
+            origin_station="LBG",
+            destination="CHX",
+            earliest_departure_date_time=datetime(2024, 6, 2, 14, 20),
+        ) == {
+            "departure_time": datetime(2024, 6, 2, 14, 25),
+            "arrival_time": datetime(2024, 6, 2, 14, 44),
+            "journey_time": 19,
+        }
+        assert retrieve_next_departure(
+            origin_station="LBG",
+            destination="CHX",
+            earliest_departure_date_time=datetime(2024, 6, 2, 14, 17),
+        ) == {
+            "departure_time": datetime(2024, 6, 2, 14, 19),
+            "arrival_time": datetime(2024, 6, 2, 14, 38),
+            "journey_time": 19,
+        }
+        # before the window, an earlier train may not have been returned
+        assert (
+            retrieve_next_departure(
+                origin_station="LBG",
+                destination="CHX",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 10),
+            )
+            is None
+        )
+        # after the last departure returned
+        assert (
+            retrieve_next_departure(
+                origin_station="LBG",
+                destination="CHX",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 26),
+            )
+            is None
+        )
+        # the departures are stale
+        assert (
+            retrieve_next_departure(
+                origin_station="LBG",
+                destination="CHX",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 20),
+                staleness_mins=-1,
+            )
+            is None
+        )
+
+    def test_store_and_retrieve_failed_leg(self):
+        """
+        test that a failed leg is stored with its reason, and storing
+        it again updates the reason
+        """
+        assert (
+            retrieve_failed_leg(
+                origin_station="LBG",
+                destination="XXX",
+                earliest_departure_date_time=datetime(2024, 6, 2, 23, 50),
+            )
+            is None
+        )
+        store_failed_leg(
+            origin_station="LBG",
+            destination="XXX",
+            earliest_departure_date_time=datetime(2024, 6, 2, 23, 50),
+            reason="No routes found",
+        )
+        store_failed_leg(
+            origin_station="LBG",
+            destination="XXX",
+            earliest_departure_date_time=datetime(2024, 6, 2, 23, 50),
+            reason="No viable journey found",
+        )
+        failed_leg = retrieve_failed_leg(
+            origin_station="LBG",
+            destination="XXX",
+            earliest_departure_date_time=datetime(2024, 6, 2, 23, 50),
+        )
+        assert failed_leg["reason"] == "No viable journey found"
+        assert failed_leg["retrieved_time"] <= datetime.now()
+
+
+class TestConnectionProfile:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def test_pragmas_are_applied_on_connect(self):
+        """
+        test that every connection has the connection profile
+        """
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            # NORMAL
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            # MEMORY
+            assert connection.exec_driver_sql("PRAGMA temp_store").scalar() == 2
+            assert (
+                connection.exec_driver_sql("PRAGMA cache_size").scalar()
+                == defaults.SQLITE_PRAGMAS["cache_size"]
+            )
+
+    def test_engine_with_another_profile(self, tmp_path):
+        """
+        test that an engine can be created with its own connection profile
+        """
+        database_engine = create_database_engine(
+            f"sqlite:///{tmp_path / 'trains.db'}",
+            pragmas={"journal_mode": "DELETE", "synchronous": "FULL"},
+        )
+        try:
+            with database_engine.connect() as connection:
+                assert (
+                    connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+                    == "delete"
+                )
+                assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 2
+        finally:
+            database_engine.dispose()
+
+    def test_journey_lookups_reuse_compiled_statements(self):
+        """
+        test that after the first call, retrieving and storing a journey
+        reuses the compiled statements from the query cache. The sqlite
+        upserts have no cache key, so are compiled every time
+        """
+        cache_hits = []
+
+        def after_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            if " ON CONFLICT " not in statement:
+                cache_hits.append(context.cache_hit == CACHE_HIT)
+
+        store_journey(JOURNEY_ONE)
+        retrieve_journey(
+            station_list=["LBG", "SAJ", "NWX", "BXY"],
+            departure_date_time=datetime(2022, 2, 9, 14, 17),
+        )
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        try:
+            store_journey(JOURNEY_TWO)
+            retrieve_journey(
+                station_list=["LBG", "SAJ", "NWX", "BXY"],
+                departure_date_time=datetime(2022, 2, 9, 14, 17),
+            )
+        finally:
+            event.remove(engine, "after_cursor_execute", after_cursor_execute)
+        assert cache_hits
+        assert all(cache_hits)
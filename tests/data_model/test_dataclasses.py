@@ -0,0 +1,93 @@
+"""
+test the dataclasses module
+"""
+
+import dataclasses
+from datetime import datetime
+import pytest
+from src.data_model.dataclasses import JourneyDetails, StationWaits
+
+STATIONS = [
+    {"station_id": "LBG", "wait_time": 0},
+    {"station_id": "CHX", "wait_time": 6},
+    {"station_id": "WAT", "wait_time": None},
+]
+
+
+class TestStationWaits:
+    def test_station_waits_read_as_dictionaries(self):
+        """
+        test that the compact stations read the same as the list of dictionaries
+        """
+        station_waits = StationWaits.from_dicts(STATIONS)
+        assert len(station_waits) == 3
+        assert station_waits == STATIONS
+        assert station_waits[1]["station_id"] == "CHX"
+        assert station_waits[1].get("wait_time") == 6
+        assert station_waits[-1]["wait_time"] is None
+        assert dict(station_waits[0]) == STATIONS[0]
+        assert [x["wait_time"] for x in station_waits] == [0, 6, None]
+        assert station_waits[1:] == STATIONS[1:]
+        assert station_waits.station_ids() == ["LBG", "CHX", "WAT"]
+        assert station_waits.as_list() == STATIONS
+        with pytest.raises(IndexError):
+            station_waits[3]
+        with pytest.raises(KeyError):
+            station_waits[0]["arrival_time"]
+
+    def test_station_waits_equality(self):
+        station_waits = StationWaits.from_lists(
+            station_ids=["LBG", "CHX", "WAT"], wait_times=[0, 6, None]
+        )
+        assert station_waits == StationWaits.from_dicts(STATIONS)
+        assert hash(station_waits) == hash(StationWaits.from_dicts(STATIONS))
+        assert station_waits != StationWaits.from_dicts(STATIONS[:2])
+        assert station_waits != [{"station_id": "LBG", "wait_time": 1}] + STATIONS[1:]
+
+
+class TestJourneyDetails:
+    def test_journey_details_is_compact_and_immutable(self):
+        journey_details = JourneyDetails(
+            time_in_mins=32,
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            train_stations_with_wait=STATIONS,
+        )
+        assert isinstance(journey_details.train_stations_with_wait, StationWaits)
+        assert not hasattr(journey_details, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            journey_details.time_in_mins = 10
+        assert journey_details.as_dict()["train_stations_with_wait"] == STATIONS
+        assert journey_details == JourneyDetails(
+            time_in_mins=32,
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            train_stations_with_wait=StationWaits.from_dicts(STATIONS),
+        )
+
+    def test_station_times(self):
+        """
+        test that the arrival and departure at each station are read from the
+        offsets, and are not known after the last leg retrieved
+        """
+        journey_details = JourneyDetails(
+            time_in_mins=32,
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            train_stations_with_wait=STATIONS,
+            arrival_offsets_secs=[0, 300, None],
+        )
+        assert journey_details.station_arrival_date_time(0) == datetime(
+            2024, 6, 2, 14, 17
+        )
+        assert journey_details.station_arrival_date_time(1) == datetime(
+            2024, 6, 2, 14, 22
+        )
+        assert journey_details.station_departure_date_time(1) == datetime(
+            2024, 6, 2, 14, 28
+        )
+        assert journey_details.station_arrival_date_time(2) is None
+        assert journey_details.station_departure_date_time(2) is None
+        # the times are not compared
+        assert journey_details == JourneyDetails(
+            time_in_mins=32,
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            train_stations_with_wait=STATIONS,
+        )
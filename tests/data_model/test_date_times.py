@@ -0,0 +1,71 @@
+"""
+test file to test the module src.data_model.date_times
+"""
+
+import json
+import os
+from datetime import datetime
+from unittest.mock import patch
+import pytest
+from dateutil import parser
+from src.data_model.date_times import parse_datetime
+
+EXAMPLE_API_RESPONSES = os.path.join(
+    os.path.dirname(__file__), "api", "example_api_responses"
+)
+
+
+class TestParseDatetime:
+    def test_api_datetimes_match_dateutil(self):
+        """
+        test that every datetime in the recorded responses is parsed to the
+        same wall clock time as dateutil, without calling dateutil
+        """
+        datetime_strs = []
+        for file_name in sorted(os.listdir(EXAMPLE_API_RESPONSES)):
+            with open(os.path.join(EXAMPLE_API_RESPONSES, file_name)) as fh:
+                response = json.load(fh)
+            for route in response.get("routes", []):
+                datetime_strs += [route["departure_datetime"], route["arrival_datetime"]]
+        assert datetime_strs
+
+        with patch("dateutil.parser.parse") as mock_parse:
+            parsed = [parse_datetime(x) for x in datetime_strs]
+        mock_parse.assert_not_called()
+        assert parsed == [parser.parse(x.split("+")[0]) for x in datetime_strs]
+
+    @pytest.mark.parametrize(
+        "datetime_str, expected",
+        [
+            # summer time, in and out of the local offset
+            ("2024-06-02T14:25:00+01:00", datetime(2024, 6, 2, 14, 25)),
+            ("2024-06-02T13:25:00+00:00", datetime(2024, 6, 2, 14, 25)),
+            ("2024-06-02T13:25:00Z", datetime(2024, 6, 2, 14, 25)),
+            ("2024-06-02T09:25:00-04:00", datetime(2024, 6, 2, 14, 25)),
+            # winter time
+            ("2024-01-02T14:25:00+00:00", datetime(2024, 1, 2, 14, 25)),
+            ("2024-01-02T15:25:00+01:00", datetime(2024, 1, 2, 14, 25)),
+        ],
+    )
+    def test_offsets_are_converted_to_local_time(self, datetime_str, expected):
+        """
+        test that a datetime with an offset is converted to the local wall
+        clock time, rather than having its offset cut off
+        """
+        date_time = parse_datetime(datetime_str)
+        assert date_time == expected
+        assert date_time.tzinfo is None
+
+    def test_other_formats_fall_back_to_dateutil(self):
+        """
+        test that a format datetime.fromisoformat does not know is parsed by dateutil
+        """
+        assert parse_datetime("2022-02-09 14:17") == datetime(2022, 2, 9, 14, 17)
+        assert parse_datetime("9 Feb 2022 14:17") == datetime(2022, 2, 9, 14, 17)
+
+    def test_unknown_format_raises(self):
+        """
+        test that a datetime in no recognised format raises a ValueError
+        """
+        with pytest.raises(ValueError):
+            parse_datetime("not a datetime")
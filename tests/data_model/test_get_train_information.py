@@ -4,18 +4,30 @@ test file to test the module src.data_model.get_train_information
 
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from unittest.mock import patch
-from src.data_model.get_train_information import retrieve_journey
+import pytest
+from sqlalchemy import event
+from src.data_model.get_train_information import (
+    journey_memory_cache,
+    retrieve_journey,
+    retrieve_journeys,
+)
 
+from src.data_model.api import transport_api
+from src.data_model.api.client import TransportApiError
 from src.data_model.dataclasses import (
     JourneyDetails,
     JourneyRequest,
 )
 from src.data_model.db.trains import (
+    engine,
     initialise_database,
     store_journey,
     retrieve_journey as db_retrieve_journey,
+    retrieve_journeys as db_retrieve_journeys,
 )
 
 JOURNEY_ONE = JourneyDetails(
@@ -98,11 +110,11 @@ API_JOURNEY_DETAILS = JourneyDetails(
         },
         {
             "station_id": "CHX",
-            "wait_time": 6,
+            "wait_time": 0,
         },
         {
             "station_id": "WAT",
-            "wait_time": 27,
+            "wait_time": 28,
         },
         {
             "station_id": "HMC",
@@ -228,6 +240,19 @@ class TestSourceFromDatabase:
         assert retrieve_journey(JOURNEY_REQUEST_ONE) == JOURNEY_ONE
         assert retrieve_journey(JOURNEY_REQUEST_TWO) == JOURNEY_TWO
 
+    def test_retrieve_journey_sourced_memory(self):
+        """
+        a journey read from the database is then served from memory
+        """
+        assert retrieve_journey(JOURNEY_REQUEST_ONE) == JOURNEY_ONE
+        with patch(
+            "src.data_model.get_train_information.retrieve_from_database"
+        ) as mock_retrieve_from_database:
+            assert retrieve_journey(JOURNEY_REQUEST_ONE) == JOURNEY_ONE
+        mock_retrieve_from_database.assert_not_called()
+        assert journey_memory_cache.statistics.hits == 1
+        assert journey_memory_cache.statistics.misses == 1
+
 
 class TestSourceFromAPI:
     def setup_method(self, method):
@@ -242,7 +267,7 @@ class TestSourceFromAPI:
     def teardown_method(self, method):
         os.remove("trains.db")
 
-    @patch("requests.get", side_effect=mocked_requests_get)
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
     def test_retrieve_journey_sourced_api(self, mock_get):
 
         # prove that it is not in the database
@@ -264,12 +289,48 @@ class TestSourceFromAPI:
             departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
         ) == API_JOURNEY_DETAILS
 
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_sub_routes_answered_from_stored_journey(self, mock_get):
+        """
+        a prefix, or a sub-route departing when the stored journey arrived at
+        its first station, is answered from the stored journey without the
+        api, the same as the api would answer it
+        """
+        journey_details = retrieve_journey(API_JOURNEY_REQUEST)
+        call_count = mock_get.call_count
+        sub_route_requests = [
+            JourneyRequest(
+                departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX", "WAT"],
+            ),
+            JourneyRequest(
+                departure_date_time=journey_details.station_arrival_date_time(1),
+                max_wait_time=60,
+                station_identifiers=["CHX", "WAT", "HMC"],
+            ),
+        ]
+        journey_memory_cache.clear()
+        with patch(
+            "src.data_model.get_train_information.retrieve_from_api"
+        ) as mock_retrieve_from_api:
+            sub_routes = [retrieve_journey(x) for x in sub_route_requests]
+        mock_retrieve_from_api.assert_not_called()
+        assert mock_get.call_count == call_count
+
+        for journey_request, journey_details in zip(sub_route_requests, sub_routes):
+            assert journey_details == transport_api.retrieve_journey(journey_request)
+        assert mock_get.call_count == call_count
+
+
 class TestSourceFromAPINoInitialisedDB:
     def setup_method(self, method):
         try:
             os.remove("trains.db")
         except Exception:
             pass
+        # drop pooled connections to any previously removed database file
+        engine.dispose()
 
     def teardown_method(self, method):
         try:
@@ -277,7 +338,7 @@ class TestSourceFromAPINoInitialisedDB:
         except Exception:
             pass
 
-    @patch("requests.get", side_effect=mocked_requests_get)
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
     def test_retrieve_journey_sourced_api_no_db(self, mock_get):
 
         # the fetch will come from the api as it is not in the database
@@ -288,3 +349,204 @@ class TestSourceFromAPINoInitialisedDB:
             station_list=API_JOURNEY_REQUEST.station_identifiers,
             departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
         ) == API_JOURNEY_DETAILS
+
+
+class TestConcurrentRequests:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def test_identical_requests_share_one_lookup(self):
+        """
+        identical requests made at the same time only request each leg once
+        """
+
+        def slow_requests_get(*args, **kwargs):
+            time.sleep(0.05)
+            return mocked_requests_get(*args, **kwargs)
+
+        with patch("requests.Session.get", side_effect=slow_requests_get) as mock_get:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                journeys = list(
+                    executor.map(retrieve_journey, [API_JOURNEY_REQUEST] * 4)
+                )
+
+        assert journeys == [API_JOURNEY_DETAILS] * 4
+        assert mock_get.call_count == 3
+
+
+class TestWaitTooLong:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_journey_stopped_early_is_cached(self, mock_get):
+        """
+        a journey that stopped at a wait too long is cached, and answers a later
+        request with a shorter max wait time, but not one with a longer one
+        """
+        journey_request = JourneyRequest(
+            departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+            max_wait_time=5,
+            station_identifiers=API_JOURNEY_REQUEST.station_identifiers,
+        )
+        journey_details = retrieve_journey(journey_request)
+        assert journey_details.exceeded_wait_at_station() == "WAT"
+        assert mock_get.call_count == 3
+
+        journey_memory_cache.clear()
+        journey_request.max_wait_time = 4
+        assert retrieve_journey(journey_request) == journey_details
+        assert mock_get.call_count == 3
+
+        # the wait at WAT is not too long, and the stored journey reached HMC
+        # after it, so the whole journey is answered from its stations
+        assert retrieve_journey(API_JOURNEY_REQUEST) == API_JOURNEY_DETAILS
+        assert mock_get.call_count == 3
+        assert (
+            db_retrieve_journey(
+                station_list=API_JOURNEY_REQUEST.station_identifiers,
+                departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+            )
+            == journey_details
+        )
+
+
+class TestRetrieveJourneys:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+        store_journey(JOURNEY_ONE)
+        store_journey(JOURNEY_TWO)
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieve_journeys(self, mock_get):
+        """
+        retrieve a batch of journeys, some cached and some from the api,
+        with the identical journeys only looked up once
+        """
+        journey_requests = [
+            JOURNEY_REQUEST_ONE,
+            API_JOURNEY_REQUEST,
+            JOURNEY_REQUEST_TWO,
+            API_JOURNEY_REQUEST,
+            JOURNEY_REQUEST_ONE,
+        ]
+        with patch(
+            "src.data_model.get_train_information.retrieve_many_from_database",
+            wraps=db_retrieve_journeys,
+        ) as mock_retrieve_many_from_database:
+            assert retrieve_journeys(journey_requests) == [
+                JOURNEY_ONE,
+                API_JOURNEY_DETAILS,
+                JOURNEY_TWO,
+                API_JOURNEY_DETAILS,
+                JOURNEY_ONE,
+            ]
+        assert mock_retrieve_many_from_database.call_count == 1
+        assert mock_get.call_count == 3
+
+        # prove that it is now cached in the database
+        assert db_retrieve_journey(
+            station_list=API_JOURNEY_REQUEST.station_identifiers,
+            departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+        ) == API_JOURNEY_DETAILS
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_request_with_no_journey_does_not_fail_the_batch(self, mock_get):
+        """
+        a request the api has no journey for is None, and the rest of the
+        batch is still returned and stored
+        """
+        no_journey_request = JourneyRequest(
+            departure_date_time=datetime(2024, 6, 2, 23, 50),
+            max_wait_time=60,
+            station_identifiers=["LBG", "CHX"],
+        )
+        assert retrieve_journeys(
+            [JOURNEY_REQUEST_ONE, no_journey_request, API_JOURNEY_REQUEST]
+        ) == [JOURNEY_ONE, None, API_JOURNEY_DETAILS]
+        assert db_retrieve_journey(
+            station_list=API_JOURNEY_REQUEST.station_identifiers,
+            departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+        ) == API_JOURNEY_DETAILS
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_api_failure_fails_the_batch(self, mock_get):
+        """
+        an error other than no journey, such as the api failing, is raised
+        """
+        failing_request = JourneyRequest(
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+            max_wait_time=60,
+            station_identifiers=["XYZ", "CHX"],
+        )
+        with pytest.raises(TransportApiError):
+            retrieve_journeys([API_JOURNEY_REQUEST, failing_request])
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_sub_routes_retrieved_together(self, mock_get):
+        """
+        the sub-routes of a batch are answered from the stored journey with
+        one query, rather than one query per journey
+        """
+        journey_details = retrieve_journey(API_JOURNEY_REQUEST)
+        call_count = mock_get.call_count
+        sub_route_requests = [
+            JourneyRequest(
+                departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX"],
+            ),
+            JourneyRequest(
+                departure_date_time=API_JOURNEY_REQUEST.departure_date_time,
+                max_wait_time=60,
+                station_identifiers=["LBG", "CHX", "WAT"],
+            ),
+            JourneyRequest(
+                departure_date_time=journey_details.station_arrival_date_time(1),
+                max_wait_time=60,
+                station_identifiers=["CHX", "WAT", "HMC"],
+            ),
+        ]
+        journey_memory_cache.clear()
+        statements = []
+
+        def after_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            statements.append(statement)
+
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        try:
+            with patch(
+                "src.data_model.get_train_information.retrieve_sub_journey"
+            ) as mock_retrieve_sub_journey:
+                sub_routes = retrieve_journeys(sub_route_requests)
+        finally:
+            event.remove(engine, "after_cursor_execute", after_cursor_execute)
+        mock_retrieve_sub_journey.assert_not_called()
+        assert mock_get.call_count == call_count
+        assert len([x for x in statements if "journey_stations" in x]) == 1
+
+        for journey_request, journey_details in zip(sub_route_requests, sub_routes):
+            assert journey_details == transport_api.retrieve_journey(journey_request)
@@ -0,0 +1,178 @@
+"""
+test the instrumentation module
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pytest
+from src.data_model.api.client import TransportApiClient
+from src.data_model.api.transport_api import set_client
+from src.data_model.db.trains import initialise_database
+from src.data_model.get_train_information import journey_memory_cache, retrieve_journey
+from src.data_model.instrumentation import (
+    InMemoryCollector,
+    JsonLinesExporter,
+    counters,
+    in_current_span,
+    increment,
+    is_enabled,
+    set_attribute,
+    set_exporter,
+    span,
+    traced,
+)
+from tests.data_model.api.test_transport_api import (
+    JOURNEY_DETAILS,
+    JOURNEY_REQUEST,
+    mocked_requests_get,
+)
+
+
+@traced("test.add")
+def add(x: int, y: int) -> int:
+    increment("test.calls")
+    return x + y
+
+
+class TestInstrumentation:
+    def teardown_method(self, method):
+        set_exporter(None)
+
+    def test_disabled_records_nothing(self):
+        """
+        test that without an exporter the hooks do nothing, and a traced
+        function is still called
+        """
+        assert not is_enabled()
+        with span("test.outer") as outer:
+            assert outer is None
+            increment("test.calls")
+            set_attribute("key", "value")
+            assert add(1, 2) == 3
+        assert counters() == {}
+
+    def test_spans_nest_and_roll_up_counters(self):
+        """
+        test that spans record their trace and parent, and that the counters
+        of a span are added to the span it is nested in
+        """
+        collector = InMemoryCollector()
+        set_exporter(collector)
+        with span("test.outer", stations=4) as outer:
+            assert add(1, 2) == 3
+            assert add(3, 4) == 7
+            set_attribute("source", "api")
+        with pytest.raises(ZeroDivisionError):
+            with span("test.failing"):
+                1 / 0
+
+        inner_spans = collector.spans_named("test.add")
+        assert len(inner_spans) == 2
+        for inner_span in inner_spans:
+            assert inner_span.trace_id == outer.trace_id
+            assert inner_span.parent_id == outer.span_id
+            assert inner_span.counters == {"test.calls": 1}
+            assert inner_span.duration_secs >= 0
+        assert outer.parent_id is None
+        assert outer.attributes == {"stations": 4, "source": "api"}
+        assert outer.counters == {"test.calls": 2}
+        assert collector.spans_named("test.failing")[0].error == "ZeroDivisionError"
+        assert counters() == {"test.calls": 2}
+
+    def test_in_current_span_nests_spans_from_other_threads(self):
+        """
+        test that a function run in a thread pool is nested in the span it was
+        submitted from
+        """
+        collector = InMemoryCollector()
+        set_exporter(collector)
+        with span("test.outer") as outer:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                assert list(executor.map(in_current_span(add), range(8), range(8))) == [
+                    x * 2 for x in range(8)
+                ]
+        assert {x.parent_id for x in collector.spans_named("test.add")} == {
+            outer.span_id
+        }
+        assert outer.counters == {"test.calls": 8}
+
+    def test_json_lines_exporter(self, tmp_path):
+        """
+        test that each span is appended to the file as it ends
+        """
+        path = tmp_path / "trace.jsonl"
+        set_exporter(JsonLinesExporter(str(path)))
+        with span("test.outer"):
+            add(1, 2)
+        set_exporter(None)
+
+        exported_spans = [json.loads(x) for x in path.read_text().splitlines()]
+        assert [x["name"] for x in exported_spans] == ["test.add", "test.outer"]
+        assert exported_spans[0]["parent_id"] == exported_spans[1]["span_id"]
+        assert exported_spans[1]["counters"] == {"test.calls": 1}
+
+
+class TestPipelineInstrumentation:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+        self.collector = InMemoryCollector()
+        set_exporter(self.collector)
+
+    def teardown_method(self, method):
+        set_exporter(None)
+        set_client(None)
+        os.remove("trains.db")
+
+    def test_stages_and_counters_of_a_lookup(self):
+        """
+        test that a journey from the api has a span for each stage, and counts
+        its api calls and retries, and the same journey is then a cache hit
+        """
+        set_client(TransportApiClient(sleep=lambda x: None))
+        responses = iter([None])
+
+        def fail_once_get(*args, **kwargs):
+            # the first request is answered with a 503, and retried
+            if next(responses, True) is None:
+                response = mocked_requests_get(*args, **kwargs)
+                response.status_code = 503
+                response.headers = {}
+                return response
+            return mocked_requests_get(*args, **kwargs)
+
+        with patch("requests.Session.get", side_effect=fail_once_get):
+            assert retrieve_journey(JOURNEY_REQUEST) == JOURNEY_DETAILS
+
+        (request_span,) = self.collector.spans_named("retrieve_journey")
+        assert request_span.attributes == {"stations": 4, "source": "api"}
+        assert request_span.counters["journey_cache.misses"] == 1
+        assert request_span.counters["api.calls"] == 3
+        assert request_span.counters["api.http_requests"] == 4
+        assert request_span.counters["api.retries"] == 1
+        assert request_span.counters["leg_cache.misses"] == 3
+        for name in [
+            "db.retrieve_journey",
+            "api.retrieve_journey",
+            "api.get_query",
+            "api.process_response",
+            "db.store_journey",
+        ]:
+            stage_spans = self.collector.spans_named(name)
+            assert stage_spans, name
+            assert {x.trace_id for x in stage_spans} == {request_span.trace_id}
+
+        self.collector.clear()
+        retrieve_journey(JOURNEY_REQUEST)
+        journey_memory_cache.clear()
+        retrieve_journey(JOURNEY_REQUEST)
+        assert [
+            x.attributes["source"] for x in self.collector.spans_named("retrieve_journey")
+        ] == ["memory", "database"]
+        assert counters()["journey_cache.memory_hits"] == 1
+        assert counters()["journey_cache.database_hits"] == 1
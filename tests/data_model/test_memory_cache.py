@@ -0,0 +1,66 @@
+"""
+test file to test the module src.data_model.memory_cache
+"""
+
+from src.data_model.memory_cache import CacheStatistics, MemoryCache
+
+
+class TestMemoryCache:
+    def setup_method(self, method):
+        self.clock_time = 0.0
+        self.memory_cache = MemoryCache(
+            max_size=2,
+            ttl_secs=60,
+            clock=lambda: self.clock_time,
+        )
+
+    def test_get_and_set(self):
+        """
+        test that a value is returned once it has been set
+        """
+        assert self.memory_cache.get("LBG_SAJ") is None
+        self.memory_cache.set("LBG_SAJ", 32)
+        assert self.memory_cache.get("LBG_SAJ") == 32
+        assert self.memory_cache.statistics == CacheStatistics(hits=1, misses=1)
+
+    def test_least_recently_used_is_evicted(self):
+        """
+        test that the least recently used entry is evicted once the cache is full
+        """
+        self.memory_cache.set("one", 1)
+        self.memory_cache.set("two", 2)
+        self.memory_cache.get("one")
+        self.memory_cache.set("three", 3)
+
+        assert len(self.memory_cache) == 2
+        assert self.memory_cache.get("two") is None
+        assert self.memory_cache.get("one") == 1
+        assert self.memory_cache.get("three") == 3
+        assert self.memory_cache.statistics.evictions == 1
+
+    def test_entries_expire(self):
+        """
+        test that an entry is not returned once its time to live has passed
+        """
+        self.memory_cache.set("one", 1)
+        self.clock_time = 59
+        assert self.memory_cache.get("one") == 1
+        self.clock_time = 60
+        assert self.memory_cache.get("one") is None
+        assert len(self.memory_cache) == 0
+        assert self.memory_cache.statistics.as_dict() == {
+            "hits": 1,
+            "misses": 1,
+            "evictions": 0,
+            "expirations": 1,
+        }
+
+    def test_clear(self):
+        """
+        test that clearing removes the entries and resets the counters
+        """
+        self.memory_cache.set("one", 1)
+        self.memory_cache.get("one")
+        self.memory_cache.clear()
+        assert len(self.memory_cache) == 0
+        assert self.memory_cache.statistics == CacheStatistics()
@@ -0,0 +1,221 @@
+"""
+test the route_times module
+"""
+
+import os
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import pytest
+from src.data_model.api.transport_api import (
+    NoJourneyFound,
+    leg_memory_cache,
+    parse_routes,
+    process_departure,
+    process_response,
+    retrieve_journey,
+)
+from src.data_model.dataclasses import JourneyRequest
+from src.data_model.db.trains import (
+    initialise_database,
+    retrieve_next_departure,
+    store_departures,
+)
+from src.data_model.route_times import retrieve_route_times
+from src.data_model.timetable import TimetableGraph
+from tests.test_main import API_JOURNEY_DETAILS, mocked_requests_get
+
+STATION_IDENTIFIERS = ["LBG", "CHX", "WAT"]
+
+
+def departures_every(
+    start: datetime, count: int, headway_mins: int, journey_time: int
+) -> list[dict]:
+    """
+    departures every headway_mins, from the start
+    """
+    return [
+        {
+            "departure_time": start + timedelta(minutes=idx * headway_mins),
+            "arrival_time": start
+            + timedelta(minutes=(idx * headway_mins) + journey_time),
+            "journey_time": journey_time,
+        }
+        for idx in range(count)
+    ]
+
+
+def api_route(departure_time: str, arrival_time: str, duration: str) -> dict:
+    """
+    a route in the format returned by the api
+    """
+    return {
+        "departure_datetime": f"2024-06-02T{departure_time}:00",
+        "arrival_datetime": f"2024-06-02T{arrival_time}:00",
+        "duration": f"{duration}:00",
+    }
+
+
+class TestRetrieveRouteTimes:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def test_matches_retrieve_journey(self):
+        """
+        test that every departure time is answered from the stored departures,
+        the same as retrieving each journey
+        """
+        store_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 6, 0),
+            departures=departures_every(
+                datetime(2024, 6, 2, 6, 4), count=30, headway_mins=10, journey_time=19
+            ),
+        )
+        store_departures(
+            origin_station="CHX",
+            destination="WAT",
+            window_start_date_time=datetime(2024, 6, 2, 6, 0),
+            departures=departures_every(
+                datetime(2024, 6, 2, 6, 2), count=20, headway_mins=25, journey_time=4
+            ),
+        )
+        departure_date_times = [
+            datetime(2024, 6, 2, 6, 0) + timedelta(minutes=5 * x, seconds=20 * x)
+            for x in range(48)
+        ]
+        with patch("requests.Session.get") as mock_get:
+            route_times = retrieve_route_times(
+                station_identifiers=STATION_IDENTIFIERS,
+                departure_date_times=departure_date_times,
+                max_wait_time=15,
+            )
+        mock_get.assert_not_called()
+        assert len(route_times) == 48
+        assert route_times.max_wait_exceeded.any()
+        assert not route_times.max_wait_exceeded.all()
+
+        for idx, departure_date_time in enumerate(departure_date_times):
+            leg_memory_cache.clear()
+            journey_details = retrieve_journey(
+                JourneyRequest(
+                    departure_date_time=departure_date_time,
+                    max_wait_time=15,
+                    station_identifiers=STATION_IDENTIFIERS,
+                )
+            )
+            assert route_times.journey_details(idx) == journey_details
+            if journey_details.exceeded_wait_station_order is None:
+                assert (
+                    route_times.arrival_date_times[idx].astype(datetime)
+                    == journey_details.arrival_date_time()
+                )
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_uncovered_departure_times_are_retrieved(self, mock_get):
+        """
+        test that the departure times not covered by stored departures are
+        retrieved leg by leg, and a leg with no journey is masked
+        """
+        route_times = retrieve_route_times(
+            station_identifiers=["LBG", "CHX", "WAT", "HMC"],
+            departure_date_times=[
+                datetime(2024, 6, 2, 14, 17),
+                datetime(2024, 6, 2, 23, 50),
+            ],
+        )
+        assert route_times.journey_details(0) == API_JOURNEY_DETAILS
+        assert route_times.time_in_mins[0] == 112
+        assert route_times.journey_found.tolist() == [True, False]
+        with pytest.raises(NoJourneyFound):
+            route_times.journey_details(1)
+
+    def test_every_path_chooses_the_same_train(self):
+        """
+        test that the api response, the stored departures, the timetable graph
+        and the route times choose the same train for a leg, from departures
+        returned out of order and two trains departing at the same time
+        """
+        response = {
+            "routes": [
+                api_route("14:42", "14:53", "00:11"),
+                api_route("14:45", "14:56", "00:11"),
+                api_route("14:36", "14:52", "00:16"),
+                api_route("14:36", "14:50", "00:14"),
+                api_route("14:50", "15:05", "00:15"),
+            ]
+        }
+        window_start_date_time = datetime(2024, 6, 2, 14, 30)
+        store_departures(
+            origin_station="CHX",
+            destination="WAT",
+            window_start_date_time=window_start_date_time,
+            departures=parse_routes(response=response),
+        )
+        loaded_graph = TimetableGraph()
+        loaded_graph.load(pairs=[("CHX", "WAT")])
+        added_graph = TimetableGraph()
+        added_graph.add_departures(
+            origin_station="CHX",
+            destination="WAT",
+            window_start_date_time=window_start_date_time,
+            departures=parse_routes(response=response),
+        )
+        departure_date_times = [
+            window_start_date_time + timedelta(minutes=x) for x in range(21)
+        ]
+        with patch("requests.Session.get") as mock_get:
+            route_times = retrieve_route_times(
+                station_identifiers=["CHX", "WAT"],
+                departure_date_times=departure_date_times,
+                max_wait_time=60,
+            )
+        mock_get.assert_not_called()
+
+        for idx, departure_date_time in enumerate(departure_date_times):
+            leg = process_response(
+                earliest_departure_time=departure_date_time, response=response
+            )
+            for departure in [
+                retrieve_next_departure(
+                    origin_station="CHX",
+                    destination="WAT",
+                    earliest_departure_date_time=departure_date_time,
+                ),
+                loaded_graph.next_departure(
+                    origin_station="CHX",
+                    destination="WAT",
+                    earliest_departure_date_time=departure_date_time,
+                ),
+                added_graph.next_departure(
+                    origin_station="CHX",
+                    destination="WAT",
+                    earliest_departure_date_time=departure_date_time,
+                ),
+            ]:
+                assert (
+                    process_departure(
+                        earliest_departure_time=departure_date_time,
+                        departure=departure,
+                    )
+                    == leg
+                )
+            journey_details = route_times.journey_details(idx)
+            assert journey_details.train_stations_with_wait.wait_times() == [
+                leg["wait_time"],
+                None,
+            ]
+            assert (
+                journey_details.time_in_mins == leg["wait_time"] + leg["journey_time"]
+            )
+            assert (
+                route_times.arrival_date_times[idx].astype(datetime)
+                == leg["arrival_time"]
+            )
@@ -0,0 +1,143 @@
+"""
+test the route_trie module
+"""
+
+import os
+from datetime import datetime
+from unittest.mock import patch
+from src.data_model.api.transport_api import (
+    leg_memory_cache,
+    retrieve_journey,
+    retrieve_leg,
+)
+from src.data_model.dataclasses import JourneyRequest
+from src.data_model.db.trains import initialise_database, store_departures
+from src.data_model.route_trie import build_route_trie, retrieve_routes
+from tests.data_model.test_route_times import departures_every
+from tests.test_main import API_JOURNEY_DETAILS, mocked_requests_get
+
+STATION_LISTS = [
+    ["LBG", "CHX", "WAT"],
+    ["LBG", "CHX", "HMC"],
+    ["LBG", "WAT"],
+    ["LBG", "CHX", "WAT"],
+]
+
+
+class TestRetrieveRoutes:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def store_timetable(self):
+        for origin_station, destination, first_departure, journey_time in [
+            ("LBG", "CHX", datetime(2024, 6, 2, 6, 4), 19),
+            ("CHX", "WAT", datetime(2024, 6, 2, 6, 2), 4),
+            ("CHX", "HMC", datetime(2024, 6, 2, 6, 13), 11),
+            ("LBG", "WAT", datetime(2024, 6, 2, 6, 8), 25),
+        ]:
+            store_departures(
+                origin_station=origin_station,
+                destination=destination,
+                window_start_date_time=datetime(2024, 6, 2, 6, 0),
+                departures=departures_every(
+                    first_departure, count=20, headway_mins=25, journey_time=journey_time
+                ),
+            )
+
+    def test_build_route_trie(self):
+        """
+        test that the routes share a node for each shared prefix
+        """
+        roots = build_route_trie(STATION_LISTS)
+        assert list(roots) == ["LBG"]
+        assert list(roots["LBG"].children) == ["CHX", "WAT"]
+        assert list(roots["LBG"].children["CHX"].children) == ["WAT", "HMC"]
+        assert roots["LBG"].children["CHX"].children["HMC"].depth == 2
+
+    def test_matches_retrieve_journey(self):
+        """
+        test that each distinct leg is retrieved once, and every route is the
+        same as retrieving it alone
+        """
+        self.store_timetable()
+        departure_date_time = datetime(2024, 6, 2, 7, 0)
+        with patch("requests.Session.get") as mock_get, patch(
+            "src.data_model.route_trie.retrieve_leg", side_effect=retrieve_leg
+        ) as mock_retrieve_leg:
+            journeys = retrieve_routes(
+                station_lists=STATION_LISTS,
+                departure_date_time=departure_date_time,
+                max_wait_time=60,
+            )
+        mock_get.assert_not_called()
+        assert mock_retrieve_leg.call_count == 4
+
+        for station_list, journey_details in zip(STATION_LISTS, journeys):
+            leg_memory_cache.clear()
+            assert journey_details == retrieve_journey(
+                JourneyRequest(
+                    departure_date_time=departure_date_time,
+                    max_wait_time=60,
+                    station_identifiers=station_list,
+                )
+            )
+        assert journeys[0].exceeded_wait_station_order is None
+
+    def test_legs_after_a_long_wait_are_not_retrieved(self):
+        """
+        test that the routes through a wait longer than the max wait time stop
+        there, without retrieving the legs after it
+        """
+        self.store_timetable()
+        departure_date_time = datetime(2024, 6, 2, 7, 0)
+        with patch(
+            "src.data_model.route_trie.retrieve_leg", side_effect=retrieve_leg
+        ) as mock_retrieve_leg:
+            journeys = retrieve_routes(
+                station_lists=STATION_LISTS,
+                departure_date_time=departure_date_time,
+                max_wait_time=2,
+            )
+        # LBG to CHX and LBG to WAT, each with a wait longer than 2 minutes
+        assert mock_retrieve_leg.call_count == 2
+        for station_list, journey_details in zip(STATION_LISTS, journeys):
+            assert journey_details.exceeded_wait_at_station() == "LBG"
+            leg_memory_cache.clear()
+            assert journey_details == retrieve_journey(
+                JourneyRequest(
+                    departure_date_time=departure_date_time,
+                    max_wait_time=2,
+                    station_identifiers=station_list,
+                )
+            )
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_retrieved_from_the_api(self, mock_get):
+        """
+        test that the legs are retrieved from the api, and a route with a leg
+        that has no journey is None
+        """
+        station_list = ["LBG", "CHX", "WAT", "HMC"]
+        journeys = retrieve_routes(
+            station_lists=[station_list, station_list[:2]],
+            departure_date_time=datetime(2024, 6, 2, 14, 17),
+        )
+        assert journeys[0] == API_JOURNEY_DETAILS
+        assert journeys[1] == retrieve_journey(
+            JourneyRequest(
+                departure_date_time=datetime(2024, 6, 2, 14, 17),
+                max_wait_time=60,
+                station_identifiers=station_list[:2],
+            )
+        )
+        assert retrieve_routes(
+            station_lists=[station_list],
+            departure_date_time=datetime(2024, 6, 2, 23, 50),
+        ) == [None]
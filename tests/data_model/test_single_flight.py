@@ -0,0 +1,110 @@
+"""
+test file to test the module src.data_model.single_flight
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pytest
+from src.data_model.single_flight import Flight, SingleFlight
+
+
+class FinishedEvent(threading.Event):
+    """
+    the finished event of a flight, releasing followers_waiting as each
+    follower starts to wait on it
+    """
+
+    def __init__(self, followers_waiting: threading.Semaphore):
+        super().__init__()
+        self.followers_waiting = followers_waiting
+
+    def wait(self, timeout=None):
+        self.followers_waiting.release()
+        return super().wait(timeout)
+
+
+def observed_flights(followers_waiting: threading.Semaphore):
+    """
+    patch SingleFlight to create flights with a FinishedEvent
+    """
+
+    def create_flight() -> Flight:
+        flight = Flight()
+        flight.finished = FinishedEvent(followers_waiting=followers_waiting)
+        return flight
+
+    return patch("src.data_model.single_flight.Flight", create_flight)
+
+
+def wait_for_followers(followers_waiting: threading.Semaphore, waiting: int) -> None:
+    """
+    wait until the given number of calls are waiting on the flight
+    """
+    for _ in range(waiting):
+        if not followers_waiting.acquire(timeout=5):
+            raise TimeoutError("the followers did not wait on the flight")
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_are_coalesced(self):
+        """
+        test that concurrent calls with the same key make a single call
+        and all share its result
+        """
+        single_flight = SingleFlight()
+        release = threading.Event()
+        followers_waiting = threading.Semaphore(0)
+        calls = []
+
+        def function():
+            calls.append(1)
+            release.wait()
+            return "result"
+
+        with observed_flights(followers_waiting), ThreadPoolExecutor(
+            max_workers=5
+        ) as executor:
+            futures = [
+                executor.submit(single_flight.do, "key", function) for _ in range(5)
+            ]
+            wait_for_followers(followers_waiting=followers_waiting, waiting=4)
+            release.set()
+            assert [x.result() for x in futures] == ["result"] * 5
+        assert len(calls) == 1
+        assert single_flight.flights == {}
+
+    def test_error_is_shared(self):
+        """
+        test that the callers waiting on a failing call all receive its error,
+        and the next call is made again
+        """
+        single_flight = SingleFlight()
+        release = threading.Event()
+        followers_waiting = threading.Semaphore(0)
+
+        def function():
+            release.wait()
+            raise ValueError("No routes found")
+
+        with observed_flights(followers_waiting), ThreadPoolExecutor(
+            max_workers=3
+        ) as executor:
+            futures = [
+                executor.submit(single_flight.do, "key", function) for _ in range(3)
+            ]
+            wait_for_followers(followers_waiting=followers_waiting, waiting=2)
+            release.set()
+            for future in futures:
+                with pytest.raises(ValueError):
+                    future.result()
+
+        assert single_flight.do("key", lambda: "retried") == "retried"
+
+    def test_different_keys_are_not_coalesced(self):
+        """
+        test that calls with different keys are each made
+        """
+        single_flight = SingleFlight()
+        assert single_flight.do("one", lambda: 1) == 1
+        assert single_flight.do("two", lambda: 2) == 2
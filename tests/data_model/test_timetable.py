@@ -0,0 +1,222 @@
+"""
+test the timetable module
+"""
+
+import os
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from src.data_model.db.trains import (
+    initialise_database,
+    retrieve_departures,
+    retrieve_next_departure,
+    store_departures,
+)
+from src.data_model.timetable import TimetableEdge, TimetableGraph
+
+DEPARTURES = [
+    {
+        "departure_time": datetime(2024, 6, 2, 14, 25),
+        "arrival_time": datetime(2024, 6, 2, 14, 44),
+        "journey_time": 19,
+    },
+    {
+        "departure_time": datetime(2024, 6, 2, 14, 19),
+        "arrival_time": datetime(2024, 6, 2, 14, 38),
+        "journey_time": 19,
+    },
+]
+
+
+class TestTimetableGraph:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+        self.timetable_graph = TimetableGraph()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def next_departure(self, earliest_departure_date_time: datetime):
+        departure = self.timetable_graph.next_departure(
+            origin_station="LBG",
+            destination="CHX",
+            earliest_departure_date_time=earliest_departure_date_time,
+        )
+        if departure is None:
+            return None
+        return departure["departure_time"]
+
+    def test_next_departure(self):
+        """
+        test that the first departure at or after the requested time is
+        returned, but only from a window covering the requested time
+        """
+        self.timetable_graph.add_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=DEPARTURES,
+        )
+        assert self.next_departure(datetime(2024, 6, 2, 14, 17)) == datetime(
+            2024, 6, 2, 14, 19
+        )
+        assert self.next_departure(datetime(2024, 6, 2, 14, 20)) == datetime(
+            2024, 6, 2, 14, 25
+        )
+        # before the window, an earlier train may not have been returned
+        assert self.next_departure(datetime(2024, 6, 2, 14, 16)) is None
+        # after the last departure
+        assert self.next_departure(datetime(2024, 6, 2, 14, 26)) is None
+        assert (
+            self.timetable_graph.next_departure(
+                origin_station="CHX",
+                destination="LBG",
+                earliest_departure_date_time=datetime(2024, 6, 2, 14, 17),
+            )
+            is None
+        )
+
+    def test_stale_departures_are_ignored(self):
+        self.timetable_graph.add_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=DEPARTURES,
+        )
+        self.timetable_graph.staleness_mins = -1
+        assert self.next_departure(datetime(2024, 6, 2, 14, 17)) is None
+
+    def test_load_matches_the_database(self):
+        """
+        test that the stored departures are loaded once, and answer
+        in the same way as the database
+        """
+        store_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=DEPARTURES,
+        )
+        with patch(
+            "src.data_model.timetable.retrieve_departures",
+            wraps=retrieve_departures,
+        ) as mock_retrieve_departures:
+            self.timetable_graph.load(pairs=[("LBG", "CHX"), ("CHX", "WAT")])
+            self.timetable_graph.load(pairs=[("LBG", "CHX"), ("CHX", "WAT")])
+        assert mock_retrieve_departures.call_count == 1
+        assert len(self.timetable_graph) == 2
+
+        departure_date_time = datetime(2024, 6, 2, 14, 16)
+        while departure_date_time < datetime(2024, 6, 2, 14, 27):
+            stored_departure = retrieve_next_departure(
+                origin_station="LBG",
+                destination="CHX",
+                earliest_departure_date_time=departure_date_time,
+            )
+            assert self.next_departure(departure_date_time) == (
+                None if stored_departure is None else stored_departure["departure_time"]
+            )
+            departure_date_time += timedelta(minutes=1)
+
+    def test_departures_are_merged_and_stale_ones_dropped(self):
+        """
+        test that departures added later are merged in departure order, and
+        the departures retrieved before the staleness window are dropped
+        """
+        window_start_date_time = datetime(2024, 6, 2, 14, 17)
+        retrieved_after = datetime(2024, 6, 2, 12, 0)
+        edge = TimetableEdge()
+        edge.add_departures(
+            [
+                {
+                    **x,
+                    "window_start_time": window_start_date_time,
+                    "retrieved_time": datetime(2024, 6, 2, 11, 0),
+                }
+                for x in DEPARTURES
+            ],
+            retrieved_after=retrieved_after - timedelta(hours=2),
+        )
+        edge.add_departures(
+            [
+                {
+                    "departure_time": datetime(2024, 6, 2, 14, 22),
+                    "arrival_time": datetime(2024, 6, 2, 14, 41),
+                    "journey_time": 19,
+                    "window_start_time": window_start_date_time,
+                    "retrieved_time": datetime(2024, 6, 2, 13, 0),
+                }
+            ],
+            retrieved_after=retrieved_after - timedelta(hours=2),
+        )
+        assert edge.departures[0] == [
+            datetime(2024, 6, 2, 14, 19),
+            datetime(2024, 6, 2, 14, 22),
+            datetime(2024, 6, 2, 14, 25),
+        ]
+
+        edge.add_departures([], retrieved_after=retrieved_after)
+        assert edge.departures[0] == [datetime(2024, 6, 2, 14, 22)]
+        assert edge.earliest_window_start == window_start_date_time
+        edge.add_departures([], retrieved_after=datetime(2024, 6, 2, 14, 0))
+        assert edge.departures == ([], [])
+        assert edge.earliest_window_start is None
+
+    def test_least_recently_used_edges_are_evicted(self):
+        """
+        test that once there are more than max_edges, the least recently
+        used edge is evicted, and is loaded from the database again
+        """
+        self.timetable_graph.max_edges = 2
+        store_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=DEPARTURES,
+        )
+        self.timetable_graph.load(pairs=[("LBG", "CHX"), ("CHX", "WAT")])
+        assert self.next_departure(datetime(2024, 6, 2, 14, 17)) is not None
+        self.timetable_graph.add_departures(
+            origin_station="WAT",
+            destination="HMC",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=DEPARTURES,
+        )
+        assert list(self.timetable_graph.edges) == [("LBG", "CHX"), ("WAT", "HMC")]
+        assert self.timetable_graph.loaded == {("LBG", "CHX")}
+
+        with patch(
+            "src.data_model.timetable.retrieve_departures",
+            wraps=retrieve_departures,
+        ) as mock_retrieve_departures:
+            self.timetable_graph.load(pairs=[("CHX", "WAT")])
+        mock_retrieve_departures.assert_called_once()
+        assert list(self.timetable_graph.edges) == [("WAT", "HMC"), ("CHX", "WAT")]
+
+    def test_load_queries_without_the_lock(self):
+        """
+        test that the graph is not locked while the departures are queried,
+        so the edges already held are answered meanwhile
+        """
+        self.timetable_graph.add_departures(
+            origin_station="LBG",
+            destination="CHX",
+            window_start_date_time=datetime(2024, 6, 2, 14, 17),
+            departures=DEPARTURES,
+        )
+
+        def retrieve_departures_unlocked(*args, **kwargs):
+            assert not self.timetable_graph.lock.locked()
+            assert self.next_departure(datetime(2024, 6, 2, 14, 17)) is not None
+            return retrieve_departures(*args, **kwargs)
+
+        with patch(
+            "src.data_model.timetable.retrieve_departures",
+            side_effect=retrieve_departures_unlocked,
+        ) as mock_retrieve_departures:
+            self.timetable_graph.load(pairs=[("CHX", "WAT")])
+        mock_retrieve_departures.assert_called_once()
+        assert ("CHX", "WAT") in self.timetable_graph.loaded
@@ -2,7 +2,9 @@
 tests the src/main.py file
 """
 import os
+import sys
 import json
+import subprocess
 import pytest
 from datetime import datetime
 from unittest.mock import patch
@@ -13,6 +15,7 @@ from src.main import (
     main,
 )
 from src.data_model.dataclasses import JourneyDetails, JourneyRequest
+from src.data_model.db.trains import initialise_database
 
 JOURNEY = JourneyDetails(
     time_in_mins=32,
@@ -53,11 +56,11 @@ API_JOURNEY_DETAILS = JourneyDetails(
         },
         {
             "station_id": "CHX",
-            "wait_time": 6,
+            "wait_time": 0,
         },
         {
             "station_id": "WAT",
-            "wait_time": 27,
+            "wait_time": 28,
         },
         {
             "station_id": "HMC",
@@ -67,6 +70,12 @@ API_JOURNEY_DETAILS = JourneyDetails(
 )
 BASE_URL = "https://transportapi.com/v3/uk/public_journey.json"
 
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules a cache hit from the command line should not need
+SLOW_MODULES = ("sqlalchemy", "requests", "dateutil", "numpy")
+# importing the orm and the api client alone takes around 400ms
+IMPORT_TIME_BUDGET_US = 150_000
+
 LBG_CHX_ARGS = {
     "from": "crs:LBG",
     "to": "crs:CHX",
@@ -190,8 +199,8 @@ class TestGetDateTimeFromString:
         """
         assert isinstance(get_datetime_from_string("2022-02-09 14:17"), datetime)
 
-    @patch("src.main.parser")
-    def test_get_date_time_raises_when_not_ok(self, mock_parser):
+    @patch("dateutil.parser.parse")
+    def test_get_date_time_raises_when_not_ok(self, mock_parse):
         """
         raises when the date_time parser does not work
         """
@@ -199,7 +208,7 @@ class TestGetDateTimeFromString:
         def side_effect(*args, **kwargs):
             raise (Exception)
 
-        mock_parser.parse.side_effect = side_effect
+        mock_parse.side_effect = side_effect
         with pytest.raises(Exception) as err:
             get_datetime_from_string("9-10-2022")
 
@@ -215,16 +224,80 @@ class TestDateTimeAsAString:
 
 
 class TestMain:
-    @patch("requests.get", side_effect=mocked_requests_get)
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        initialise_database()
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
     def test_main(self, mock_get, capsys):
         """
         Run a test of the main function
         """
         main(journey_request=API_JOURNEY_REQUEST)
         captured = capsys.readouterr()
-        assert "Not cached in database, retrieving from API" in captured.out
-        assert "Arrival time: 2024-06-02 16:09:00" in captured.out
+        assert captured.out == "Arrival time: 2024-06-02 16:09:00\n"
+        assert mock_get.call_count == 3
         main(journey_request=API_JOURNEY_REQUEST)
         captured = capsys.readouterr()
-        assert "Not cached in database, retrieving from API" not in captured.out
-        assert "Arrival time: 2024-06-02 16:09:00" in captured.out
+        assert captured.out == "Arrival time: 2024-06-02 16:09:00\n"
+        assert mock_get.call_count == 3
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_main_cache_hit_skips_the_orm(self, mock_get, capsys):
+        """
+        A stored journey is answered by the sqlite3 lookup, without
+        get_train_information
+        """
+        main(journey_request=API_JOURNEY_REQUEST)
+        capsys.readouterr()
+        with patch(
+            "src.data_model.get_train_information.retrieve_journey"
+        ) as mock_retrieve_journey:
+            main(journey_request=API_JOURNEY_REQUEST)
+        mock_retrieve_journey.assert_not_called()
+        assert "Arrival time: 2024-06-02 16:09:00" in capsys.readouterr().out
+
+
+class TestStartup:
+    def run_python(self, *args: str) -> subprocess.CompletedProcess:
+        """
+        run a new interpreter from the repository root
+        """
+        return subprocess.run(
+            [sys.executable, *args],
+            cwd=REPOSITORY_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    def test_import_does_not_import_slow_modules(self):
+        """
+        importing main should not import the orm, the api client or numpy
+        """
+        result = self.run_python(
+            "-c",
+            "import sys, src.main; "
+            f"print(','.join(x for x in {SLOW_MODULES!r} if x in sys.modules))",
+        )
+        assert result.stdout.strip() == ""
+
+    def test_import_time_budget(self):
+        """
+        the cumulative import time of main, measured with -X importtime,
+        should stay within the budget
+        """
+        result = self.run_python("-X", "importtime", "-c", "import src.main")
+        cumulative_us = [
+            int(line.split("|")[1])
+            for line in result.stderr.splitlines()
+            if line.split("|")[-1].strip() == "src.main"
+        ]
+        assert cumulative_us
+        assert cumulative_us[0] < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,214 @@
+"""
+tests the src/service.py file
+"""
+import asyncio
+import http.client
+import json
+import os
+import threading
+import time
+from unittest.mock import patch
+from src.service import JourneyService, build_journey_request, BadRequest
+from tests.test_main import mocked_requests_get
+import pytest
+
+
+class ServiceThread:
+    """
+    run the service on its own event loop, in a background thread
+    """
+
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.service = None
+        self.kwargs = kwargs
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.service = asyncio.run_coroutine_threadsafe(
+            self.create_service(), self.loop
+        ).result()
+        self.serving = asyncio.run_coroutine_threadsafe(
+            self.service.serve_until_stopped(), self.loop
+        )
+
+    async def create_service(self) -> JourneyService:
+        service = JourneyService(port=0, **self.kwargs)
+        await service.start()
+        return service
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.service.stop)
+        self.serving.result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class TestBuildJourneyRequest:
+    def test_build_journey_request(self):
+        journey_request = build_journey_request(
+            "departure_date_time=2024-06-02T14:17&station_identifiers=LBG,chx,WAT&max_wait_time=30"
+        )
+        assert journey_request.station_identifiers == ["LBG", "CHX", "WAT"]
+        assert journey_request.max_wait_time == 30
+        assert journey_request.departure_date_time.isoformat() == "2024-06-02T14:17:00"
+
+    def test_build_journey_request_raises_when_not_ok(self):
+        with pytest.raises(BadRequest):
+            build_journey_request("station_identifiers=LBG,CHX")
+        with pytest.raises(BadRequest):
+            build_journey_request("departure_date_time=2024-06-02T14:17&station_identifiers=LBG")
+        with pytest.raises(BadRequest):
+            build_journey_request(
+                "departure_date_time=not-a-date&station_identifiers=LBG,CHX"
+            )
+
+
+class TestJourneyService:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+        self.service_thread = ServiceThread()
+        self.connection = http.client.HTTPConnection(
+            "127.0.0.1", self.service_thread.service.port, timeout=10
+        )
+
+    def teardown_method(self, method):
+        self.connection.close()
+        self.service_thread.stop()
+        os.remove("trains.db")
+
+    def get_json(self, path: str) -> tuple[int, dict]:
+        self.connection.request("GET", path)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_journey(self, mock_get):
+        """
+        test that the journey is returned in the json format, and the second
+        request on the same connection is answered from the cache
+        """
+        path = "/journey?departure_date_time=2024-06-02%2014:17&station_identifiers=LBG,CHX,WAT,HMC"
+        assert self.get_json(path) == (
+            200,
+            {"arrival_time": "2024-06-02T16:09:00", "error": None},
+        )
+        assert self.get_json(path) == (
+            200,
+            {"arrival_time": "2024-06-02T16:09:00", "error": None},
+        )
+        assert mock_get.call_count == 3
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_journey_wait_too_long(self, mock_get):
+        status, body = self.get_json(
+            "/journey?departure_date_time=2024-06-02T14:17&station_identifiers=LBG,CHX,WAT,HMC&max_wait_time=10"
+        )
+        assert status == 200
+        assert body["arrival_time"] is None
+        assert "longer than the requested maximum wait time of 10 minutes" in body["error"]
+
+    @patch("requests.Session.get", side_effect=mocked_requests_get)
+    def test_tables_are_created_on_start(self, mock_get):
+        """
+        test that the service creates the tables before serving,
+        so the first requests are not answered with an error
+        """
+        path = "/journey?departure_date_time=2024-06-02T14:17&station_identifiers=LBG,CHX"
+        connections = [
+            http.client.HTTPConnection(
+                "127.0.0.1", self.service_thread.service.port, timeout=10
+            )
+            for _ in range(4)
+        ]
+        for connection in connections:
+            connection.request("GET", path)
+        for connection in connections:
+            response = connection.getresponse()
+            assert response.status == 200
+            assert json.loads(response.read()) == {
+                "arrival_time": "2024-06-02T14:36:00",
+                "error": None,
+            }
+            connection.close()
+
+    def test_bad_request(self):
+        assert self.get_json("/journey?station_identifiers=LBG,CHX") == (
+            400,
+            {"arrival_time": None, "error": "departure_date_time is required"},
+        )
+        assert self.get_json("/unknown")[0] == 404
+        assert self.get_json("/health") == (200, {"status": "ok"})
+
+
+class TestJourneyServiceShutdown:
+    def setup_method(self, method):
+        try:
+            os.remove("trains.db")
+        except Exception:
+            pass
+
+    def teardown_method(self, method):
+        os.remove("trains.db")
+
+    def test_request_in_flight_finishes(self):
+        """
+        test that stopping the service waits for the request in flight
+        """
+
+        def slow_requests_get(*args, **kwargs):
+            time.sleep(0.2)
+            return mocked_requests_get(*args, **kwargs)
+
+        service_thread = ServiceThread()
+        connection = http.client.HTTPConnection(
+            "127.0.0.1", service_thread.service.port, timeout=10
+        )
+        with patch("requests.Session.get", side_effect=slow_requests_get):
+            connection.request(
+                "GET",
+                "/journey?departure_date_time=2024-06-02T14:17&station_identifiers=LBG,CHX",
+            )
+            time.sleep(0.1)
+            service_thread.loop.call_soon_threadsafe(service_thread.service.stop)
+            response = connection.getresponse()
+            assert response.status == 200
+            assert json.loads(response.read()) == {
+                "arrival_time": "2024-06-02T14:36:00",
+                "error": None,
+            }
+            assert response.getheader("Connection") == "close"
+        service_thread.stop()
+        connection.close()
+
+    def test_idle_connection_is_closed(self):
+        """
+        test that stopping the service closes an idle keep-alive connection
+        before waiting for the server to close, rather than waiting for the client
+        """
+        service_thread = ServiceThread()
+        service = service_thread.service
+        connection = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+        connection.request("GET", "/health")
+        response = connection.getresponse()
+        assert json.loads(response.read()) == {"status": "ok"}
+        assert response.getheader("Connection") == "keep-alive"
+
+        wait_closed = service.server.wait_closed
+        open_connections = []
+
+        async def wait_closed_after_connections():
+            open_connections.append(len(service.connections))
+            await wait_closed()
+
+        service.server.wait_closed = wait_closed_after_connections
+        started = time.monotonic()
+        service_thread.stop()
+        assert time.monotonic() - started < service.shutdown_timeout_secs
+        assert open_connections == [0]
+        # the server has closed its end of the connection
+        assert connection.sock.recv(1) == b""
+        connection.close()